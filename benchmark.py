@@ -0,0 +1,320 @@
+import argparse
+import asyncio
+import contextlib
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+from data import FramePool, SensorDataDecoder
+from midi import MIDISender
+from midi_backend import create_backend
+from player import Player
+from dispatch import Priority
+from processing import Processor
+from receiver import Receiver
+from recorder import read_session, synthetic_session
+from tracing import tracer
+
+
+class StageTimer:
+    """ Collects per-call durations in nanoseconds for named pipeline stages """
+
+    def __init__(self):
+        self.samples = {}
+
+    def wrap(self, name, callback):
+        samples = self.samples.setdefault(name, [])
+
+        async def timed(*args):
+            start = time.perf_counter_ns()
+            await callback(*args)
+            samples.append(time.perf_counter_ns() - start)
+        return timed
+
+    def add(self, name, duration_ns):
+        self.samples.setdefault(name, []).append(duration_ns)
+
+    def summary(self):
+        return {name: latency_summary(values) for name, values in self.samples.items() if values}
+
+
+def latency_summary(values_ns):
+    values = np.asarray(values_ns, dtype=np.float64) / 1000.0
+    return {'count': int(values.size),
+            'p50_us': float(np.percentile(values, 50)),
+            'p99_us': float(np.percentile(values, 99)),
+            'max_us': float(values.max()),
+            'mean_us': float(values.mean())}
+
+
+async def run_pipeline(packets, gui=False, midi_backend='null', threaded=False):
+    """
+    Feed packets into Receiver.handle_data with Processor, Player and a MIDI backend
+    (null by default, see midi_backend).
+
+    Returns a result dict with per-stage latencies and the sustained packet rate.
+    """
+    timer = StageTimer()
+    receiver = Receiver()
+    processor = Processor()
+    midi = MIDISender(threaded=threaded, backend=midi_backend)
+    player = Player(midi)
+    await receiver.add_callback(timer.wrap('processor', processor.new_data), Priority.CRITICAL)
+    await receiver.add_callback(timer.wrap('player_data', player.new_data), Priority.CRITICAL)
+    await processor.add_callback(timer.wrap('player_event', player.event_triggered), Priority.CRITICAL)
+
+    app = None
+    if gui:
+        from PyQt5.QtWidgets import QApplication
+        from fast_gui import MainWindow2D, MainWindow3D
+        app = QApplication.instance() or QApplication(sys.argv[:1])
+        window2d = MainWindow2D()
+        window2d.show()
+        window3d = MainWindow3D()
+        window3d.show()
+        await receiver.add_callback(timer.wrap('gui_2d', window2d.update_plot), Priority.NORMAL)
+        await receiver.add_callback(timer.wrap('gui_3d', window3d.update_plot), Priority.VISUAL)
+        await processor.add_callback(timer.wrap('gui_events', window2d.event_triggered), Priority.VISUAL)
+
+    tracer.reset()
+    start_wall = time.perf_counter()
+    for t, data in packets:
+        start = time.perf_counter_ns()
+        await receiver.handle_data(None, data, t)
+        timer.add('end_to_end', time.perf_counter_ns() - start)
+        if app is not None:
+            app.processEvents()
+            # let the coalesced visualization consumers run
+            await asyncio.sleep(0)
+    wall = time.perf_counter() - start_wall
+
+    visual_frames = {**receiver.callbacks.stats(), **processor.callbacks.stats()}
+    if app is not None:
+        window2d.close()
+        window3d.close()
+    receiver.callbacks.clear()
+    processor.callbacks.clear()
+    midi.close()
+    trace = tracer.summary()
+    stages = timer.summary()
+    # decoding runs inside Receiver.handle_data, so it is part of end_to_end and traced there
+    if 'decode' in trace:
+        stages['decode'] = trace['decode']
+    return {'stages': stages,
+            'packets': len(packets),
+            'packets_per_second': len(packets) / wall if wall > 0 else float('inf'),
+            'visual_frames': visual_frames,
+            'trace': trace}
+
+
+class AllocationMonitor:
+    """
+    Memory allocation per packet of the pipeline.
+
+    tracemalloc gives the bytes allocated on top of the memory in use before each
+    packet (the peak, so short lived temporaries count as well), sys.getallocatedblocks
+    the memory blocks still allocated after the run (including rings like the tracer's
+    that are still filling up).
+    """
+
+    def __init__(self):
+        self.packets = 0
+        self.peak_bytes = 0
+        self.retained_blocks = 0
+        self._blocks = 0
+
+    def __enter__(self):
+        gc.collect()
+        self._blocks = sys.getallocatedblocks()
+        tracemalloc.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        tracemalloc.stop()
+        gc.collect()
+        self.retained_blocks = sys.getallocatedblocks() - self._blocks
+
+    async def measure(self, callback, *args):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        await callback(*args)
+        self.peak_bytes += tracemalloc.get_traced_memory()[1] - before
+        self.packets += 1
+
+    def summary(self):
+        packets = max(self.packets, 1)
+        return {'allocated_bytes_per_packet': self.peak_bytes / packets,
+                'retained_blocks_per_packet': self.retained_blocks / packets}
+
+
+async def gc_pressure(packets, pooled=True):
+    """
+    Run the headless pipeline with pooled (reused) or freshly allocated frames and
+    report the memory allocated per packet and the time per packet.
+    """
+    receiver = Receiver()
+    if not pooled:
+        receiver.frames = None
+    processor = Processor()
+    midi = MIDISender(backend='null')
+    player = Player(midi)
+    await processor.add_receiver(receiver)
+    await player.add_receiver(receiver)
+    await player.add_event_processor(processor)
+
+    frame = FramePool(1).next()
+    start = time.perf_counter_ns()
+    for t, data in packets:
+        if pooled:
+            SensorDataDecoder.decode_into(data, frame, t)
+        else:
+            SensorDataDecoder.decode_data(data, t)
+    decode_ns = time.perf_counter_ns() - start
+
+    # timed on the first half, tracemalloc slows the allocations of the second half down
+    half = len(packets) // 2
+    start = time.perf_counter_ns()
+    for t, data in packets[:half]:
+        await receiver.handle_data(None, data, t)
+    pipeline_ns = time.perf_counter_ns() - start
+    with AllocationMonitor() as monitor:
+        for t, data in packets[half:]:
+            await monitor.measure(receiver.handle_data, None, data, t)
+    receiver.callbacks.clear()
+    processor.callbacks.clear()
+    midi.close()
+    return {**monitor.summary(),
+            'decode_us_per_packet': decode_ns / 1000.0 / len(packets),
+            'pipeline_us_per_packet': pipeline_ns / 1000.0 / max(half, 1)}
+
+
+def print_gc_results(results):
+    for mode, result in results.items():
+        print(f"[{mode}] decode {result['decode_us_per_packet']:.2f}us/packet, pipeline "
+              f"{result['pipeline_us_per_packet']:.2f}us/packet, allocated "
+              f"{result['allocated_bytes_per_packet']:.0f} bytes/packet, retained "
+              f"{result['retained_blocks_per_packet']:.2f} blocks/packet")
+
+
+class JitterProbe:
+    """
+    Measures how late the event loop dispatches timer callbacks.
+
+    A callback is scheduled every interval seconds on an absolute grid, its
+    lateness against the grid is the dispatch jitter any other callback
+    (e.g. a BLE notification) experiences as well.
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.lateness_ns = []
+
+    async def run(self, duration):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        deadline = start
+        while deadline - start < duration:
+            deadline += self.interval
+            await asyncio.sleep(max(0.0, deadline - loop.time()))
+            self.lateness_ns.append(max(0.0, loop.time() - deadline) * 1e9)
+        return self.summary()
+
+    def summary(self):
+        return latency_summary(self.lateness_ns)
+
+    def print_summary(self, label):
+        stats = self.summary()
+        print(f"[{label}] dispatch jitter over {stats['count']} timer callbacks: p50 {stats['p50_us']:.1f}us"
+              f"  p99 {stats['p99_us']:.1f}us  max {stats['max_us']:.1f}us")
+
+
+def compare(results, baseline, tolerance):
+    """ Return a list of regressions of results against a baseline result file """
+    regressions = []
+    for config, result in results['configurations'].items():
+        reference = baseline.get('configurations', {}).get(config)
+        if reference is None:
+            continue
+        p99 = result['stages']['end_to_end']['p99_us']
+        reference_p99 = reference['stages']['end_to_end']['p99_us']
+        if p99 > reference_p99 * (1 + tolerance):
+            regressions.append(f"{config}: end_to_end p99 {p99:.1f}us > {reference_p99:.1f}us")
+        rate = result['packets_per_second']
+        reference_rate = reference['packets_per_second']
+        if rate < reference_rate * (1 - tolerance):
+            regressions.append(f"{config}: {rate:.0f} packets/s < {reference_rate:.0f} packets/s")
+    return regressions
+
+
+def print_results(results):
+    for config, result in results['configurations'].items():
+        print(f"[{config}] {result['packets']} packets, {result['packets_per_second']:.0f} packets/s")
+        for name, stats in result['stages'].items():
+            print(f"  {name:14s} p50 {stats['p50_us']:9.1f}us  p99 {stats['p99_us']:9.1f}us"
+                  f"  max {stats['max_us']:9.1f}us")
+        for name, frames in result['visual_frames'].items():
+            print(f"  {name}: {frames['delivered']} frames drawn, {frames['dropped']} dropped")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Latency and throughput benchmark of the receive->MIDI path")
+    parser.add_argument("--session", metavar="PATH", help="recorded session to feed instead of synthetic packets")
+    parser.add_argument("--packets", type=int, default=10000, help="number of synthetic packets")
+    parser.add_argument("--rate", type=float, default=100.0, help="sample rate of the synthetic packets")
+    parser.add_argument("--gui", action="store_true", help="additionally run with the fast_gui windows attached")
+    parser.add_argument("--midi-backend", default="null", help="null, recording, direct or pygame")
+    parser.add_argument("--midi-device", help="MIDI output id or name for the direct/pygame backends")
+    parser.add_argument("--midi-thread", action="store_true", help="write MIDI from the output thread")
+    parser.add_argument("--output", metavar="PATH", default="benchmark_results.json", help="result file (json)")
+    parser.add_argument("--baseline", metavar="PATH", help="fail if results regress against this result file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    parser.add_argument("--gc", action="store_true",
+                        help="compare memory allocated per packet with pooled and freshly allocated frames")
+    args = parser.parse_args()
+
+    if args.session:
+        packets = list(read_session(args.session))
+    else:
+        packets = list(synthetic_session(args.packets, args.rate))
+
+    if args.gc:
+        with open(os.devnull, 'w') as null, contextlib.redirect_stdout(null):
+            results = {mode: await gc_pressure(packets, pooled) for mode, pooled in (('allocated', False),
+                                                                                     ('pooled', True))}
+        print_gc_results(results)
+        return
+
+    results = {'timestamp': time.time(),
+               'python': platform.python_version(),
+               'machine': platform.machine(),
+               'source': args.session or f"synthetic@{args.rate}Hz",
+               'midi_backend': args.midi_backend,
+               'configurations': {}}
+    # silence the per-packet logging of the pipeline, but keep paying for it
+    with open(os.devnull, 'w') as null, contextlib.redirect_stdout(null):
+        for config, gui in (('headless', False), ('gui', True)):
+            if gui and not args.gui:
+                continue
+            backend = create_backend(args.midi_backend, args.midi_device)
+            results['configurations'][config] = await run_pipeline(packets, gui, backend, args.midi_thread)
+
+    print_results(results)
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f"results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION", regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,193 @@
+import argparse
+import asyncio
+import contextlib
+import inspect
+import os
+import time
+import numpy as np
+from recorder import synthetic_session
+
+
+class SimulatedDevice:
+    """ scan result of a SimulatedPeripheral, like bleak's BLEDevice """
+
+    def __init__(self, address, name):
+        self.address = address
+        self.name = name
+
+
+class SimulatedAdvertisement:
+    def __init__(self, service_uuids):
+        self.service_uuids = service_uuids
+
+
+class SimulatedPeripheral:
+    """
+    A saber as seen over BLE: advertises its service, accepts one connection and
+    notifies synthetic 36 byte packets at rate Hz while subscribed.
+
+    drop() emulates a link loss, the saber stays unreachable for outage seconds.
+    """
+
+    def __init__(self, address, service_uuid, name="MusicSaber", rate=100.0, connect_delay=0.05,
+                 advertise_interval=0.02):
+        self.device = SimulatedDevice(address, name)
+        self.advertisement = SimulatedAdvertisement([service_uuid])
+        self.rate = rate
+        self.connect_delay = connect_delay
+        self.advertise_interval = advertise_interval
+        self.unreachable_until = 0.0
+        self.client = None
+
+    @property
+    def reachable(self):
+        return time.perf_counter() >= self.unreachable_until
+
+    def drop(self, outage=0.0):
+        self.unreachable_until = time.perf_counter() + outage
+        if self.client is not None:
+            self.client.link_lost()
+
+
+class SimulatedClient:
+    """ stand-in for bleak.BleakClient connected to a SimulatedPeripheral """
+
+    def __init__(self, peripheral: SimulatedPeripheral, disconnected_callback=None, timeout=10.0):
+        self.peripheral = peripheral
+        self.disconnected_callback = disconnected_callback
+        self.timeout = timeout
+        self.is_connected = False
+        self.mtu_size = 247
+        self.notify_task = None
+
+    async def connect(self):
+        await asyncio.sleep(self.peripheral.connect_delay)
+        if not self.peripheral.reachable:
+            # a real connect attempt waits for the whole timeout
+            await asyncio.sleep(max(0.0, min(self.timeout, self.peripheral.unreachable_until - time.perf_counter())))
+            raise TimeoutError(f"{self.peripheral.device.address} not reachable")
+        if self.peripheral.client is not None:
+            raise ConnectionError(f"{self.peripheral.device.address} already connected")
+        self.peripheral.client = self
+        self.is_connected = True
+        return True
+
+    async def disconnect(self):
+        self._close()
+        if self.disconnected_callback is not None:
+            self.disconnected_callback(self)
+        return True
+
+    def link_lost(self):
+        self._close()
+        if self.disconnected_callback is not None:
+            self.disconnected_callback(self)
+
+    def _close(self):
+        if self.notify_task is not None:
+            self.notify_task.cancel()
+            self.notify_task = None
+        if self.peripheral.client is self:
+            self.peripheral.client = None
+        self.is_connected = False
+
+    async def start_notify(self, characteristic_uuid, callback):
+        if not self.is_connected:
+            raise ConnectionError("not connected")
+        self.notify_task = asyncio.ensure_future(self._notify(characteristic_uuid, callback))
+
+    async def stop_notify(self, characteristic_uuid):
+        if self.notify_task is not None:
+            self.notify_task.cancel()
+            self.notify_task = None
+
+    async def _notify(self, characteristic_uuid, callback):
+        interval = 1.0 / self.peripheral.rate
+        next_time = time.perf_counter()
+        for _, data in synthetic_session(1 << 62, self.peripheral.rate):
+            next_time += interval
+            await asyncio.sleep(max(0.0, next_time - time.perf_counter()))
+            result = callback(characteristic_uuid, bytearray(data))
+            if inspect.isawaitable(result):
+                await result
+
+
+class SimulatedBle:
+    """
+    Simulated BLE environment, replaces bleak in a Receiver:
+    Receiver(client_class=ble.client, scanner=ble)
+    """
+
+    def __init__(self):
+        self.peripherals = {}
+
+    def add_peripheral(self, peripheral: SimulatedPeripheral):
+        self.peripherals[peripheral.device.address] = peripheral
+        return peripheral
+
+    def client(self, device, disconnected_callback=None, timeout=10.0):
+        address = getattr(device, 'address', device)
+        return SimulatedClient(self.peripherals[address], disconnected_callback, timeout)
+
+    async def find_device_by_filter(self, filterfunc, timeout=10.0):
+        """ advertisements arrive every advertise_interval from every reachable peripheral """
+        deadline = time.perf_counter() + timeout
+        interval = min((p.advertise_interval for p in self.peripherals.values()), default=0.1)
+        while True:
+            for peripheral in self.peripherals.values():
+                if peripheral.reachable and peripheral.client is None and \
+                        filterfunc(peripheral.device, peripheral.advertisement):
+                    return peripheral.device
+            if time.perf_counter() >= deadline:
+                return None
+            await asyncio.sleep(interval)
+
+
+async def measure_reconnect(drops=10, outage=0.2, interval=1.0, rate=100.0):
+    """
+    Connect a Receiver to a simulated saber, drop the link drops times and
+    report the downtime from link loss until notifications are delivered again.
+    """
+    from receiver import CHARACTERISTIC_UUID, SERVICE_UUID, Receiver
+
+    ble = SimulatedBle()
+    peripheral = ble.add_peripheral(SimulatedPeripheral("00:00:00:00:00:01", SERVICE_UUID, rate=rate))
+    receiver = Receiver(client_class=ble.client, scanner=ble)
+    device = await receiver.find_device(SERVICE_UUID, timeout=2.0)
+    await receiver.connect(device)
+    await receiver.start_notifications(SERVICE_UUID, CHARACTERISTIC_UUID)
+    receiver.keep_connected()
+
+    gaps = []
+    for _ in range(drops):
+        await asyncio.sleep(interval)
+        packets = receiver.stats.packets
+        dropped = time.perf_counter()
+        peripheral.drop(outage)
+        while receiver.stats.packets == packets:
+            await asyncio.sleep(0.001)
+        gaps.append(time.perf_counter() - dropped)
+    await receiver.disconnect()
+    gaps = np.array(gaps)
+    return {'drops': drops, 'outage': outage,
+            'reconnect_p50': float(np.percentile(receiver.downtimes, 50)),
+            'reconnect_max': float(np.max(receiver.downtimes)),
+            'gap_p50': float(np.percentile(gaps, 50)),
+            'gap_max': float(gaps.max())}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconnect downtime against a simulated saber")
+    parser.add_argument("--drops", type=int, default=10)
+    parser.add_argument("--outage", type=float, default=0.2, help="seconds the saber stays unreachable")
+    args = parser.parse_args()
+    # silence the connection logging of the receiver
+    with open(os.devnull, 'w') as null, contextlib.redirect_stdout(null):
+        result = asyncio.run(measure_reconnect(args.drops, args.outage))
+    print(f"{result['drops']} drops with {result['outage'] * 1000:.0f} ms outage: downtime after the outage"
+          f" p50 {(result['reconnect_p50'] - result['outage']) * 1000:.0f} ms,"
+          f" gap between packets p50 {result['gap_p50'] * 1000:.0f} ms max {result['gap_max'] * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import asyncio
+import heapq
+import time
+from collections import deque
+from data import SensorData
+
+SEQUENCE_MODULO = 1 << 32
+DEVICE_CLOCK_WRAP = (1 << 32) * 1e-6  # uint32 microseconds
+
+
+class SequenceTracker:
+    """
+    Detects lost, duplicate and reordered packets from the 32 bit packet counter.
+
+    The skipped sequence numbers of the last window packets are remembered, a late
+    packet only gives back a loss when it is one of them, anything else is a duplicate.
+    """
+
+    def __init__(self, window=1024):
+        self.window = window
+        self.expected = None
+        self.missing = {}  # skipped sequence numbers in skip order, used as ordered set
+        self.received = 0
+        self.lost = 0
+        self.duplicates = 0
+        self.reordered = 0
+
+    def update(self, sequence: int) -> int:
+        """ returns the number of packets lost right before this one """
+        self.received += 1
+        if self.expected is None:
+            self.expected = (sequence + 1) % SEQUENCE_MODULO
+            return 0
+        gap = (sequence - self.expected) % SEQUENCE_MODULO
+        if gap < SEQUENCE_MODULO // 2:
+            if gap:
+                self.lost += gap
+                missing = self.missing
+                # only the newest ones of a long outage can still arrive late
+                for skipped in range(sequence - min(gap, self.window), sequence):
+                    missing[skipped % SEQUENCE_MODULO] = None
+                while len(missing) > self.window:
+                    del missing[next(iter(missing))]
+            self.expected = (sequence + 1) % SEQUENCE_MODULO
+            return gap
+        if sequence in self.missing:
+            # late packet that was already counted as lost
+            del self.missing[sequence]
+            self.reordered += 1
+            self.lost -= 1
+        else:
+            self.duplicates += 1
+        return 0
+
+    def summary(self):
+        return {'received': self.received, 'lost': self.lost,
+                'duplicates': self.duplicates, 'reordered': self.reordered}
+
+
+class ClockSync:
+    """
+    Continuous host <-> device clock offset estimation.
+
+    Every packet gives offset = host receive time - device time, which is the
+    true offset plus a varying transport delay (BLE connection intervals batch
+    several samples). The minimum over a sliding window is the sample with the
+    least delay and tracks slow clock drift as the window moves on.
+    """
+
+    def __init__(self, window=10.0):
+        self.window = window
+        self.samples = deque()  # (device_time, offset), offsets increasing
+        self.last_raw = None
+        self.wraps = 0
+        self.offset = None
+        self.delay = 0.0  # transport delay above the minimum of the latest packet
+
+    def unwrap(self, device_time: float) -> float:
+        if self.last_raw is not None and device_time < self.last_raw - DEVICE_CLOCK_WRAP / 2:
+            self.wraps += 1
+        self.last_raw = device_time
+        return device_time + self.wraps * DEVICE_CLOCK_WRAP
+
+    def update(self, host_time: float, device_time: float) -> float:
+        """ feed one packet, returns its device time mapped to the host clock """
+        device_time = self.unwrap(device_time)
+        offset = host_time - device_time
+        samples = self.samples
+        while samples and samples[-1][1] >= offset:
+            samples.pop()
+        samples.append((device_time, offset))
+        while samples[0][0] < device_time - self.window:
+            samples.popleft()
+        self.offset = samples[0][1]
+        self.delay = offset - self.offset
+        return device_time + self.offset
+
+
+class JitterBuffer:
+    """
+    Adaptive playout buffer for frames with device-clock based timestamps.
+
+    Frames are released delay seconds after their (host mapped) sample time, so
+    packets arriving in BLE bursts come out evenly spaced again. The delay follows
+    multiplier times the smoothed transport jitter, bounded by min_delay..max_delay.
+    Frames that arrive after a newer one was released are dropped.
+    """
+
+    def __init__(self, dispatch, min_delay=0.005, max_delay=0.05, multiplier=2.0, smoothing=0.05):
+        self.dispatch = dispatch
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.smoothing = smoothing
+        self.delay = min_delay
+        self.jitter = 0.0
+        self.heap = []
+        self.pushed = 0
+        self.released = 0
+        self.late = 0
+        self.last_released = float('-inf')
+        self._wakeup = None
+        self._task = None
+
+    def push(self, data: SensorData, transport_delay: float):
+        self.jitter += (transport_delay - self.jitter) * self.smoothing
+        self.delay = min(max(self.multiplier * self.jitter, self.min_delay), self.max_delay)
+        if data.time <= self.last_released:
+            self.late += 1
+            return
+        heapq.heappush(self.heap, (data.time + self.delay, self.pushed, data))
+        self.pushed += 1
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            if not self.heap:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            release, _, data = self.heap[0]
+            wait = release - time.perf_counter()
+            if wait > 0:
+                self._wakeup.clear()
+                try:
+                    # an earlier frame may arrive in the meantime
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self.heap)
+            if data.time <= self.last_released:
+                self.late += 1
+                continue
+            self.last_released = data.time
+            self.released += 1
+            await self.dispatch(data)
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def summary(self):
+        return {'delay_ms': self.delay * 1000.0, 'jitter_ms': self.jitter * 1000.0,
+                'released': self.released, 'late': self.late, 'queued': len(self.heap)}
@@ -0,0 +1,108 @@
+import asyncio
+import operator
+import time
+from data import SensorData
+from midi import MIDISender
+
+PITCH_BEND = 'pitchbend'
+
+
+class ControllerMapping:
+    """
+    Maps one sensor value (e.g. 'rot.y', 'acc.x') to a MIDI CC or pitch bend.
+
+    The input range in_min..in_max is scaled to 0..127 (CC) or 0..16383 (pitch bend).
+    Changes smaller than deadband (in output steps) are suppressed and at most
+    max_rate messages per second are sent, faster changes are coalesced.
+    """
+
+    def __init__(self, source='rot.y', controller=1, in_min=-100.0, in_max=100.0,
+                 deadband=1, max_rate=50.0, channel=0):
+        self.source = source
+        self.read = operator.attrgetter(source)
+        self.controller = controller
+        self.in_min = in_min
+        self.scale = 1.0 / (in_max - in_min)
+        self.out_max = 16383 if controller == PITCH_BEND else 127
+        self.deadband = deadband
+        self.min_interval = 1.0 / max_rate if max_rate else 0.0
+        self.channel = channel
+        self.last_value = None
+        self.last_time = float('-inf')
+        self.pending = None
+
+    @classmethod
+    def from_config(cls, config: dict):
+        return cls(**config)
+
+    def value(self, data: SensorData) -> int:
+        position = (self.read(data) - self.in_min) * self.scale
+        if position <= 0.0:
+            return 0
+        if position >= 1.0:
+            return self.out_max
+        return round(position * self.out_max)
+
+
+class ContinuousController:
+    """ Streams controller messages for every frame according to a list of ControllerMapping """
+
+    def __init__(self, midi: MIDISender, mappings: [ControllerMapping]):
+        self.midi = midi
+        self.mappings = mappings
+        self.sent = 0
+        self.suppressed = 0
+
+    def update(self, data: SensorData, now=None):
+        if now is None:
+            now = time.perf_counter()
+        for mapping in self.mappings:
+            value = mapping.value(data)
+            last_value = mapping.last_value
+            if last_value is not None and abs(value - last_value) < mapping.deadband:
+                # back inside the deadband, a coalesced value is obsolete
+                mapping.pending = None
+                self.suppressed += 1
+            elif now - mapping.last_time < mapping.min_interval:
+                mapping.pending = value
+                self.suppressed += 1
+            else:
+                self._send(mapping, value, now)
+
+    def flush(self, now=None):
+        """ send coalesced values whose rate limit interval has passed """
+        if now is None:
+            now = time.perf_counter()
+        for mapping in self.mappings:
+            if mapping.pending is not None and now - mapping.last_time >= mapping.min_interval:
+                self._send(mapping, mapping.pending, now)
+
+    async def run(self):
+        """ flush periodically, so a coalesced value is also sent when no new frames arrive """
+        interval = min((mapping.min_interval for mapping in self.mappings if mapping.min_interval), default=0.01)
+        while True:
+            await asyncio.sleep(interval)
+            self.flush()
+
+    def reset(self):
+        """ forget the sent values, e.g. after a link loss """
+        for mapping in self.mappings:
+            mapping.last_value = None
+            mapping.last_time = float('-inf')
+            mapping.pending = None
+
+    def _send(self, mapping: ControllerMapping, value, now):
+        if mapping.controller == PITCH_BEND:
+            self.midi.pitch_bend(value, mapping.channel)
+        else:
+            self.midi.control_change(mapping.controller, value, mapping.channel)
+        mapping.last_value = value
+        mapping.last_time = now
+        mapping.pending = None
+        self.sent += 1
+
+
+def default_mappings(channel=0):
+    """ saber tilt bends the pitch, swinging acceleration drives the modulation wheel """
+    return [ControllerMapping('rot.y', PITCH_BEND, -100.0, 100.0, deadband=32, max_rate=100.0, channel=channel),
+            ControllerMapping('acc.x', 1, -20.0, 20.0, deadband=2, max_rate=50.0, channel=channel)]
@@ -1,8 +1,14 @@
+import logging
 import math
 import struct
 import time
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
 
 class Vec3:
+    __slots__ = ('x', 'y', 'z')
     x: float
     y: float
     z: float
@@ -12,18 +18,81 @@ class Vec3:
         self.y = y
         self.z = z
 
+    def set(self, x: float, y: float, z: float):
+        self.x = x
+        self.y = y
+        self.z = z
+
 
 class SensorData:
+    __slots__ = ('rot', 'acc', 'gyro', 'time', 'sequence', 'device_time')
     rot: Vec3
     acc: Vec3
     gyro: Vec3
     time: float
+    sequence: int
+    device_time: float
 
-    def __init__(self, rot: Vec3, acc: Vec3, gyro: Vec3, t: float) -> object:
+    def __init__(self, rot: Vec3, acc: Vec3, gyro: Vec3, t: float, sequence=None, device_time=None) -> object:
         self.rot = rot
         self.acc = acc
         self.gyro = gyro
         self.time = t
+        # only sent by the 44 byte protocol: packet counter and sensor clock in seconds
+        self.sequence = sequence
+        self.device_time = device_time
+
+    @staticmethod
+    def empty():
+        return SensorData(Vec3(0.0, 0.0, 0.0), Vec3(0.0, 0.0, 0.0), Vec3(0.0, 0.0, 0.0), 0.0)
+
+
+class FramePool:
+    """
+    Fixed ring of preallocated SensorData frames for SensorDataDecoder.decode_into.
+
+    Frames are handed out round robin, so a frame keeps its values for the next
+    size - 1 decodes. Consumers that keep frames longer (e.g. a jitter buffer) must
+    use freshly decoded frames instead.
+    """
+
+    def __init__(self, size=64):
+        self.frames = [SensorData.empty() for _ in range(size)]
+        self.index = 0
+
+    def next(self) -> SensorData:
+        frame = self.frames[self.index]
+        self.index += 1
+        if self.index == len(self.frames):
+            self.index = 0
+        return frame
+
+
+# Annahme: Inklinationswinkel für Deutschland beträgt etwa 60 Grad
+INCLINATION_ANGLE_DEG = 60
+INCLINATION_COS = math.cos(math.radians(INCLINATION_ANGLE_DEG))
+INCLINATION_SIN = math.sin(math.radians(INCLINATION_ANGLE_DEG))
+
+# structured layout of decoded batches, one row per packet
+SENSOR_DTYPE = np.dtype([('rot', '<f4', (3,)),
+                         ('acc', '<f4', (3,)),
+                         ('gyro', '<f4', (3,)),
+                         ('time', '<f8')])
+
+# raw layout of the 44 byte protocol
+TIMED_PACKET_DTYPE = np.dtype([('values', '<f4', (9,)),
+                               ('sequence', '<u4'),
+                               ('device_time', '<u4')])
+
+# legacy 18 byte protocol: raw counts -> microtesla, m/s^2, dps
+LEGACY_SCALE_SI = np.array([100 / 450, 100 / 450, 100 / 400,
+                            0.001 * 9.80665, 0.001 * 9.80665, 0.001 * 9.80665,
+                            8.75 * 0.001, 8.75 * 0.001, 8.75 * 0.001], dtype=np.float32)
+
+
+_LEGACY_PACKET = struct.Struct('<9h')
+_FLOAT_PACKET = struct.Struct('<9f')
+_TIMED_PACKET = struct.Struct('<9fII')
 
 
 class SensorDataDecoder:
@@ -38,38 +107,100 @@ class SensorDataDecoder:
         # this will be deprecated, as we will move to unified
         # protocol using float values instead of raw sensor measurements
         if len(data) == 18:
-            mag_x = SensorDataDecoder._decode_16bit(data[1], data[0])
-            mag_y = SensorDataDecoder._decode_16bit(data[3], data[2])
-            mag_z = SensorDataDecoder._decode_16bit(data[5], data[4])
-            acc_x = SensorDataDecoder._decode_16bit(data[7], data[6])
-            acc_y = SensorDataDecoder._decode_16bit(data[9], data[8])
-            acc_z = SensorDataDecoder._decode_16bit(data[11], data[10])
-            g_x = SensorDataDecoder._decode_16bit(data[13], data[12])
-            g_y = SensorDataDecoder._decode_16bit(data[15], data[14])
-            g_z = SensorDataDecoder._decode_16bit(data[17], data[16])
-            mag = SensorDataDecoder.convert_magnetometer_data(Vec3(mag_x, mag_y, mag_z), "LSM303_MAGGAIN_4_0")
-            # print(mag)
-            orientation_angles = SensorDataDecoder.calculate_orientation_angles_xyz(mag)
-            acc = SensorDataDecoder.convert_accelerometer_data(Vec3(acc_x, acc_y, acc_z))
-            # print(acc)
-            gyr = SensorDataDecoder.convert_gyro_data(Vec3(g_x, g_y, g_z))
-            return SensorData(Vec3(mag_x, mag_y, mag_z), Vec3(acc_x, acc_y, acc_z),
-                              Vec3(g_x, g_y, g_z), t)
+            values = _LEGACY_PACKET.unpack(data)
         # new, unified float-based protocol (36 byte)
         # contains all values in float
         elif len(data) == 36:
-            num_floats = len(data) // 4
-            format_string = f'{num_floats}f'
+            values = _FLOAT_PACKET.unpack(data)
+        # unified protocol followed by a uint32 packet sequence number
+        # and the uint32 device clock in microseconds (44 byte)
+        elif len(data) == 44:
+            values = _TIMED_PACKET.unpack(data)
+            return SensorData(Vec3(values[0], values[1], values[2]),
+                              Vec3(values[3], values[4], values[5]),
+                              Vec3(values[6], values[7], values[8]), t,
+                              values[9], values[10] * 1e-6)
+        else:
+            logger.warning("unsupported bt protocol format (%d bytes)", len(data))
+            return None
+        return SensorData(Vec3(values[0], values[1], values[2]),
+                          Vec3(values[3], values[4], values[5]),
+                          Vec3(values[6], values[7], values[8]), t)
 
-            # Unpack the byte array into floats
-            float_values = struct.unpack(format_string, data)
+    @staticmethod
+    def decode_into(data, frame: SensorData, t=None):
+        """ decode_data into an existing frame (e.g. from a FramePool), returns None for unknown formats """
+        if t is None:
+            t = time.perf_counter()
+        size = len(data)
+        if size == 36:
+            x0, y0, z0, x1, y1, z1, x2, y2, z2 = _FLOAT_PACKET.unpack(data)
+            frame.sequence = None
+            frame.device_time = None
+        elif size == 44:
+            x0, y0, z0, x1, y1, z1, x2, y2, z2, sequence, device_time = _TIMED_PACKET.unpack(data)
+            frame.sequence = sequence
+            frame.device_time = device_time * 1e-6
+        elif size == 18:
+            x0, y0, z0, x1, y1, z1, x2, y2, z2 = _LEGACY_PACKET.unpack(data)
+            frame.sequence = None
+            frame.device_time = None
+        else:
+            logger.warning("unsupported bt protocol format (%d bytes)", len(data))
+            return None
+        frame.rot.set(x0, y0, z0)
+        frame.acc.set(x1, y1, z1)
+        frame.gyro.set(x2, y2, z2)
+        frame.time = t
+        return frame
 
-            print(float_values)  # Output: (1.0, 2.0)
-            return SensorData(Vec3(float_values[0], float_values[1], float_values[2]),
-                              Vec3(float_values[3], float_values[4], float_values[5]),
-                              Vec3(float_values[6], float_values[7], float_values[8]), t)
+    @staticmethod
+    def decode_batch(buffer, timestamps, packet_size=36, scale=None, device_clock=False) -> np.ndarray:
+        """
+        Decode many concatenated packets of the same protocol in one pass.
+
+        Args:
+            buffer (bytes): Concatenated raw notifications, all of size packet_size.
+            timestamps (array_like): One receive time per packet.
+            packet_size (int): 36 for the float protocol, 44 for the float protocol with sequence
+                number and device clock, 18 for the legacy int16 protocol.
+            scale (array_like): Optional factor per value (9 entries, rot/acc/gyro xyz),
+                e.g. LEGACY_SCALE_SI to convert legacy raw counts. Defaults to no scaling.
+            device_clock (bool): 44 byte protocol only, use the (unwrapped) device clock relative
+                to the first packet plus the first timestamp as time column.
+
+        Returns:
+            np.ndarray: Structured array of dtype SENSOR_DTYPE, one row per packet.
+        """
+        device_times = None
+        if packet_size == 36:
+            raw = np.frombuffer(buffer, dtype='<f4')
+        elif packet_size == 44:
+            packets = np.frombuffer(buffer, dtype=TIMED_PACKET_DTYPE)
+            raw = packets['values'].reshape(-1)
+            device_times = packets['device_time']
+        elif packet_size == 18:
+            raw = np.frombuffer(buffer, dtype='<i2')
         else:
-            print("unsupported bt protocol format")
+            raise ValueError("unsupported bt protocol format")
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        if raw.size != 9 * len(timestamps):
+            raise ValueError("buffer size does not match number of timestamps")
+        values = raw.reshape(-1, 9)
+        if scale is not None:
+            values = values * np.asarray(scale, dtype=np.float32)
+
+        decoded = np.empty(len(timestamps), dtype=SENSOR_DTYPE)
+        decoded['rot'] = values[:, 0:3]
+        decoded['acc'] = values[:, 3:6]
+        decoded['gyro'] = values[:, 6:9]
+        decoded['time'] = timestamps
+        if device_clock and device_times is not None and len(device_times):
+            # the 32 bit microsecond clock wraps every ~71 minutes
+            steps = np.diff(device_times.astype(np.int64)) % (1 << 32)
+            elapsed = np.concatenate(([0], np.cumsum(steps))) * 1e-6
+            decoded['time'] = timestamps[0] + elapsed
+        return decoded
 
     @staticmethod
     def convert_magnetometer_data(mag: Vec3, gain='LSM303_MAGGAIN_4_0') -> Vec3:
@@ -135,15 +266,10 @@ class SensorDataDecoder:
         magnetic_y = mag.y
         magnetic_z = mag.z
 
-        # Annahme: Inklinationswinkel für Deutschland beträgt etwa 60 Grad
-        inclination_angle_deg = 60
-
         # Umrechnung der Magnetometerdaten in lokales Koordinatensystem
-        local_magnetic_x = magnetic_x * math.cos(math.radians(inclination_angle_deg)) + magnetic_z * math.sin(
-            math.radians(inclination_angle_deg))
+        local_magnetic_x = magnetic_x * INCLINATION_COS + magnetic_z * INCLINATION_SIN
         local_magnetic_y = magnetic_y
-        local_magnetic_z = -magnetic_x * math.sin(math.radians(inclination_angle_deg)) + magnetic_z * math.cos(
-            math.radians(inclination_angle_deg))
+        local_magnetic_z = -magnetic_x * INCLINATION_SIN + magnetic_z * INCLINATION_COS
 
         # Berechnung der Orientierungswinkel im lokalen Koordinatensystem
         angle_xy_rad = math.atan2(local_magnetic_y, local_magnetic_x)
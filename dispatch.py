@@ -0,0 +1,121 @@
+import asyncio
+import traceback
+from enum import Enum
+
+
+class Priority(Enum):
+    CRITICAL = 1  # audio path, awaited inline before anything else
+    NORMAL = 2  # awaited inline after all critical callbacks
+    VISUAL = 3  # coalesced, runs from its own task, stale values are dropped
+
+
+class LatestValueQueue:
+    """
+    Bounded coalescing queue in front of one consumer callback.
+
+    It holds at most one pending value. Offering a new value while the
+    previous one was not consumed yet replaces it and counts a dropped frame.
+    The consumer runs from its own task whenever the event loop is idle.
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.name = getattr(callback, '__qualname__', repr(callback))
+        self.pending = None
+        self.has_pending = False
+        self.delivered = 0
+        self.dropped = 0
+        self._ready = None
+        self._task = None
+
+    def offer(self, *args):
+        if self.has_pending:
+            self.dropped += 1
+        self.pending = args
+        self.has_pending = True
+        if self._task is None:
+            self._ready = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        self._ready.set()
+
+    async def _run(self):
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            if not self.has_pending:
+                continue
+            args = self.pending
+            self.pending = None
+            self.has_pending = False
+            try:
+                await self.callback(*args)
+            except Exception:
+                traceback.print_exc()
+            self.delivered += 1
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+class Dispatcher:
+    """
+    Calls registered callbacks by priority class, see Priority
+
+    snapshot(*args) -> args copies reused (mutable) arguments before they are queued
+    for the coalesced consumers, which run after the dispatch returned.
+    """
+
+    def __init__(self, snapshot=None):
+        self.snapshot = snapshot
+        self.critical = []
+        self.normal = []
+        self.visual = []
+
+    def __len__(self):
+        return len(self.critical) + len(self.normal) + len(self.visual)
+
+    def add(self, callback, priority=Priority.NORMAL):
+        if priority == Priority.CRITICAL:
+            self.critical.append(callback)
+        elif priority == Priority.NORMAL:
+            self.normal.append(callback)
+        else:
+            self.visual.append(LatestValueQueue(callback))
+
+    def remove(self, callback):
+        if callback in self.critical:
+            self.critical.remove(callback)
+        elif callback in self.normal:
+            self.normal.remove(callback)
+        else:
+            for queue in self.visual:
+                if queue.callback == callback:
+                    queue.close()
+                    self.visual.remove(queue)
+                    return
+            raise ValueError("callback not registered")
+
+    def clear(self):
+        for queue in self.visual:
+            queue.close()
+        self.critical.clear()
+        self.normal.clear()
+        self.visual.clear()
+
+    async def dispatch(self, *args):
+        for callback in self.critical:
+            await callback(*args)
+        for callback in self.normal:
+            await callback(*args)
+        if self.visual:
+            if self.snapshot is not None:
+                args = self.snapshot(*args)
+            for queue in self.visual:
+                queue.offer(*args)
+
+    def stats(self):
+        """ delivered and dropped frame counters of the coalesced consumers """
+        return {queue.name: {'delivered': queue.delivered, 'dropped': queue.dropped}
+                for queue in self.visual}
@@ -0,0 +1,266 @@
+import json
+import math
+import numpy as np
+from processing import Dimension, Event3, EventType
+
+INPUTS = ('rot', 'acc', 'gyro')
+NODE_TYPES = ('lowpass', 'highpass', 'derivative', 'abs', 'scale', 'magnitude', 'threshold', 'hysteresis')
+DIMENSIONS = (Dimension.X, Dimension.Y, Dimension.Z)
+INPUT_CHANNELS = 3 * len(INPUTS)  # rot, acc and gyro xyz at the start of the values list
+
+# Example configuration: swing energy of the smoothed gyro with a hysteresis trigger
+DEFAULT_GRAPH = {
+    'rate': 100.0,
+    'nodes': [
+        {'name': 'smooth', 'type': 'lowpass', 'input': 'gyro', 'cutoff': 20.0},
+        {'name': 'energy', 'type': 'magnitude', 'input': 'smooth'},
+        {'name': 'swing', 'type': 'hysteresis', 'input': 'energy', 'high': 300.0, 'low': 150.0,
+         'event': 'THRESHOLD_POS'},
+    ]
+}
+
+
+def biquad_coefficients(kind, cutoff, rate, q=0.7071067811865476):
+    """ (b0, b1, b2, a1, a2) of a low-/high-pass biquad (RBJ audio EQ cookbook), normalized to a0 = 1 """
+    w0 = 2 * math.pi * cutoff / rate
+    alpha = math.sin(w0) / (2 * q)
+    cos_w0 = math.cos(w0)
+    a0 = 1 + alpha
+    if kind == 'lowpass':
+        b0 = b2 = (1 - cos_w0) / 2
+        b1 = 1 - cos_w0
+    else:
+        b0 = b2 = (1 + cos_w0) / 2
+        b1 = -(1 + cos_w0)
+    return b0 / a0, b1 / a0, b2 / a0, -2 * cos_w0 / a0, (1 - alpha) / a0
+
+
+class SignalGraph:
+    """
+    Declarative per-sample signal graph compiled into one fused Python step function.
+
+    Nodes are dicts with a unique name, a type (see NODE_TYPES), an input (rot, acc,
+    gyro or another node) and the parameters of their type:
+        lowpass/highpass: cutoff (Hz), q (default 0.707), biquad at the graph rate
+        derivative: d/dt with the sample timestamps, keeps the last value for non-increasing timestamps
+        abs, magnitude (3 channels -> 1), scale: gain
+        threshold: level, 1.0 while above level
+        hysteresis: high, low, 1.0 from above high until below low
+    Detectors with an event type (e.g. 'THRESHOLD_POS') are reported by events() while on.
+
+    compile() resolves the graph once into the source of step() and batch(), with all
+    node channels in dependency order and no calls or loops per node. Node names are
+    only dictionary keys: the generated source addresses every channel by its index
+    into the preallocated values list v (the 9 input channels first), filter and
+    detector state by its index into the state list s, parameters are float literals.
+    """
+
+    def __init__(self, nodes, rate=100.0):
+        self.nodes = self._sort([dict(node) for node in nodes])
+        self.rate = rate
+        self.outputs = {}  # node name -> (first index in out, channels)
+        self.detectors = []  # (on state index, onset state index, value index, event)
+        self.compile()
+
+    @staticmethod
+    def load(path) -> 'SignalGraph':
+        with open(path) as file:
+            config = json.load(file)
+        return SignalGraph(config['nodes'], config.get('rate', 100.0))
+
+    @staticmethod
+    def _sort(nodes):
+        """ order nodes so every node comes after its input """
+        by_name = {}
+        for node in nodes:
+            name = node.get('name')
+            if not isinstance(name, str) or not name:
+                raise ValueError(f"invalid node name {name!r}")
+            if name in by_name or name in INPUTS:
+                raise ValueError(f"duplicate node name {name}")
+            if node.get('type') not in NODE_TYPES:
+                raise ValueError(f"unknown node type {node.get('type')}")
+            by_name[name] = node
+        ordered = []
+        done = set()
+        visiting = set()
+
+        def visit(node):
+            name = node['name']
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f"cycle at node {name}")
+            visiting.add(name)
+            source = node.get('input')
+            if source in by_name:
+                visit(by_name[source])
+            elif source not in INPUTS:
+                raise ValueError(f"unknown input {source} of node {name}")
+            visiting.discard(name)
+            done.add(name)
+            ordered.append(node)
+
+        for node in nodes:
+            visit(node)
+        return ordered
+
+    def compile(self):
+        values = [0.0] * INPUT_CHANNELS
+        state = []
+        body = []
+        detectors = []
+        # name -> (first index in values, channels)
+        channels = {source: (3 * i, 3) for i, source in enumerate(INPUTS)}
+        used_inputs = set()
+
+        def slot(value=0.0):
+            state.append(value)
+            return len(state) - 1
+
+        for node in self.nodes:
+            kind = node['type']
+            source = node['input']
+            if source in INPUTS:
+                used_inputs.add(source)
+            first, count = channels[source]
+            inputs = list(range(first, first + count))
+            if kind == 'magnitude':
+                count = 1
+            results = list(range(len(values), len(values) + count))
+            values += [0.0] * count
+
+            if kind in ('lowpass', 'highpass'):
+                b0, b1, b2, a1, a2 = biquad_coefficients(kind, node['cutoff'], self.rate,
+                                                         node.get('q', 0.7071067811865476))
+                for x, y in zip(inputs, results):
+                    z1 = slot()
+                    z2 = slot()
+                    body += [f"x = v[{x}]",
+                             f"y = {b0!r} * x + s[{z1}]",
+                             f"s[{z1}] = {b1!r} * x - {a1!r} * y + s[{z2}]",
+                             f"s[{z2}] = {b2!r} * x - {a2!r} * y",
+                             f"v[{y}] = y"]
+            elif kind == 'derivative':
+                for x, y in zip(inputs, results):
+                    last = slot()
+                    held = slot()
+                    body += ["if valid:",
+                             f"    x = v[{x}]",
+                             f"    y = (x - s[{last}]) / dt",
+                             f"    s[{last}] = x",
+                             f"    s[{held}] = y",
+                             f"    v[{y}] = y",
+                             "else:",
+                             f"    v[{y}] = s[{held}]"]
+            elif kind == 'abs':
+                body += [f"v[{y}] = abs(v[{x}])" for x, y in zip(inputs, results)]
+            elif kind == 'scale':
+                gain = float(node['gain'])
+                body += [f"v[{y}] = {gain!r} * v[{x}]" for x, y in zip(inputs, results)]
+            elif kind == 'magnitude':
+                if len(inputs) == 1:
+                    body.append(f"v[{results[0]}] = abs(v[{inputs[0]}])")
+                else:
+                    x0, x1, x2 = inputs
+                    body += [f"a = v[{x0}]", f"b = v[{x1}]", f"c = v[{x2}]",
+                             f"v[{results[0]}] = sqrt(a * a + b * b + c * c)"]
+            else:
+                event = EventType[node['event']] if node.get('event') else None
+                for channel, (x, y) in enumerate(zip(inputs, results)):
+                    on = slot()
+                    onset = slot()
+                    if kind == 'threshold':
+                        body += [f"y = 1.0 if v[{x}] > {float(node['level'])!r} else 0.0",
+                                 f"if y and not s[{on}]:",
+                                 f"    s[{onset}] = t",
+                                 f"s[{on}] = y",
+                                 f"v[{y}] = y"]
+                    else:
+                        body += [f"if s[{on}]:",
+                                 f"    if v[{x}] < {float(node['low'])!r}:",
+                                 f"        s[{on}] = 0.0",
+                                 f"elif v[{x}] > {float(node['high'])!r}:",
+                                 f"    s[{on}] = 1.0",
+                                 f"    s[{onset}] = t",
+                                 f"v[{y}] = s[{on}]"]
+                    if event is not None:
+                        dimension = DIMENSIONS[channel] if len(inputs) == 3 else Dimension.X
+                        # detector inputs are kept for the event values
+                        detectors.append((on, onset, x, Event3(0.0, 0, 0.0, event, dimension)))
+            channels[node['name']] = (results[0], count)
+            self.outputs[node['name']] = (results[0] - INPUT_CHANNELS, count)
+
+        # the last timestamp starts at -inf, so the first derivative is 0
+        self.time_slot = slot(-math.inf)
+        prologue = [f"dt = t - s[{self.time_slot}]",
+                    "valid = dt > 0.0"]
+        epilogue = ["if valid:",
+                    f"    s[{self.time_slot}] = t"]
+        unpack = []
+        for i, source in enumerate(INPUTS):
+            if source in used_inputs:
+                unpack += [f"f = frame.{source}",
+                           f"v[{3 * i}] = f.x", f"v[{3 * i + 1}] = f.y", f"v[{3 * i + 2}] = f.z"]
+        unpack.append("t = frame.time")
+        # batch rows are lists of rot xyz, acc xyz, gyro xyz and time
+        copy = [f"v[{first}:{first + 3}] = row[{first}:{first + 3}]"
+                for first in (3 * INPUTS.index(source) for source in INPUTS if source in used_inputs)]
+        copy.append(f"t = row[{INPUT_CHANNELS}]")
+
+        lines = ["def step(frame):", "    v = values", "    s = state"]
+        lines += ["    " + line for line in unpack + prologue + body + epilogue]
+        lines += ["", "def batch(rows):", "    v = values", "    s = state", "    results = []",
+                  "    for row in rows:"]
+        lines += ["        " + line for line in copy + prologue + body + epilogue]
+        lines += [f"        results.append(v[{INPUT_CHANNELS}:])", "    return results"]
+        self.source = "\n".join(lines)
+
+        self.values = values
+        self.state = state
+        self.initial_state = list(state)
+        self.detectors = detectors
+        # the source only contains slot indices and float literals, never node names
+        namespace = {'sqrt': math.sqrt, 'inf': math.inf, 'nan': math.nan, 'values': values, 'state': state}
+        exec(compile(self.source, "<SignalGraph>", "exec"), namespace)
+        self.step = namespace['step']
+        self._batch = namespace['batch']
+
+    def reset(self):
+        self.state[:] = self.initial_state
+
+    @property
+    def out(self):
+        """ current values of all nodes, in the order of self.outputs """
+        return self.values[INPUT_CHANNELS:]
+
+    def output(self, name):
+        """ current values of node name """
+        first, channels = self.outputs[name]
+        first += INPUT_CHANNELS
+        return self.values[first:first + channels]
+
+    def batch(self, frames: np.ndarray) -> np.ndarray:
+        """
+        Run the graph over a structured array of SENSOR_DTYPE (see decode_batch),
+        continuing from and updating the current state.
+
+        Returns:
+            np.ndarray: (N, outputs) array, columns in the order of self.outputs.
+        """
+        rows = np.column_stack((frames['rot'], frames['acc'], frames['gyro'],
+                                frames['time'])).astype(np.float64).tolist()
+        outputs = len(self.values) - INPUT_CHANNELS
+        return np.array(self._batch(rows), dtype=np.float64).reshape(len(frames), outputs)
+
+    def events(self):
+        """ Event3 (reused objects) of all detectors with an event type that are on """
+        events = []
+        state = self.state
+        values = self.values
+        for on, onset, x, event in self.detectors:
+            if state[on]:
+                event.position = state[onset]
+                event.value = values[x]
+                events.append(event)
+        return events
@@ -1,6 +1,7 @@
 import pyqtgraph as pg
 import pyqtgraph.opengl as gl
-from PyQt5.QtWidgets import QApplication, QMainWindow, QVBoxLayout, QWidget
+from PyQt5.QtGui import QFont
+from PyQt5.QtWidgets import QApplication, QLabel, QMainWindow, QVBoxLayout, QWidget
 from data import SensorData
 from processing import SensorHistory, Derivation3, Event3
 import sys
@@ -9,7 +10,7 @@ import numpy as np
 
 
 class MainWindow2D(QMainWindow):
-    def __init__(self, history_length = 100):
+    def __init__(self, history_length = 100, fps=60, tracer=None):
         super().__init__()
 
         self.centralWidget = QWidget()
@@ -49,27 +50,73 @@ class MainWindow2D(QMainWindow):
 
         self.history = SensorHistory(history_length)
         self.gyro_derivation = Derivation3(history_length, True)
-
-    async def update_plot(self, data: SensorData):
+        self.events = ([], [])
+        self.dirty = False
+
+        # render at most fps times per second, independent of the sensor rate.
+        # fps=None redraws on every packet (legacy behaviour)
+        self.fps = fps
+        self.timer = None
+        if fps:
+            self.timer = pg.QtCore.QTimer()
+            self.timer.timeout.connect(self.render)
+            self.timer.start(max(1, round(1000 / fps)))
+
+        # optional live overlay of the hot-path latency histograms (tracing.Tracer)
+        self.tracer = tracer
+        self.trace_label = None
+        if tracer is not None:
+            self.trace_label = QLabel()
+            self.trace_label.setFont(QFont("Monospace", 9))
+            self.layout.addWidget(self.trace_label)
+            self.trace_timer = pg.QtCore.QTimer()
+            self.trace_timer.timeout.connect(self.update_trace_overlay)
+            self.trace_timer.start(500)
+
+    def update_trace_overlay(self):
+        self.trace_label.setText(self.tracer.overlay_text())
+
+    def append(self, data: SensorData):
+        """ ingest one sample, only stores it in the history buffers """
         self.history.append(data)
         self.gyro_derivation.append(data.gyro, data.time)
+        self.dirty = True
+        if self.timer is None:
+            self.render()
+
+    async def update_plot(self, data: SensorData):
+        self.append(data)
+
+    def render(self):
+        """ draw the latest history buffers, called once per frame """
+        if not self.dirty:
+            return
+        self.dirty = False
+
+        # one copy per signal and frame, the ring buffers keep changing while Qt paints
+        rot = self.history.rot.view().copy()
+        acc = self.history.acc.view().copy()
+        gyro = self.history.gyro.view().copy()
+        gyro_derivation = self.gyro_derivation.view().copy()
 
         # Update X, Y, Z plots
-        self.rot_curve_x.setData(self.history.rot.t, self.history.rot.x)
-        self.rot_curve_y.setData(self.history.rot.t,self.history.rot.y)
-        self.rot_curve_z.setData(self.history.rot.t, self.history.rot.z)
+        self.rot_curve_x.setData(rot[3], rot[0])
+        self.rot_curve_y.setData(rot[3], rot[1])
+        self.rot_curve_z.setData(rot[3], rot[2])
+
+        self.acc_curve_x.setData(acc[3], acc[0])
+        self.acc_curve_y.setData(acc[3], acc[1])
+        self.acc_curve_z.setData(acc[3], acc[2])
 
-        self.acc_curve_x.setData(self.history.acc.t, self.history.acc.x)
-        self.acc_curve_y.setData(self.history.acc.t, self.history.acc.y)
-        self.acc_curve_z.setData(self.history.acc.t, self.history.acc.z)
+        self.gyro_curve_x.setData(gyro[3], gyro[0])
+        self.gyro_curve_y.setData(gyro[3], gyro[1])
+        self.gyro_curve_z.setData(gyro[3], gyro[2])
 
-        self.gyro_curve_x.setData(self.history.gyro.t, self.history.gyro.x)
-        self.gyro_curve_y.setData(self.history.gyro.t, self.history.gyro.y)
-        self.gyro_curve_z.setData(self.history.gyro.t, self.history.gyro.z)
+        self.gyro_derivation_x.setData(gyro_derivation[3], gyro_derivation[0])
+        self.gyro_derivation_y.setData(gyro_derivation[3], gyro_derivation[1])
+        self.gyro_derivation_z.setData(gyro_derivation[3], gyro_derivation[2])
 
-        self.gyro_derivation_x.setData(self.gyro_derivation.t, self.gyro_derivation.x)
-        self.gyro_derivation_y.setData(self.gyro_derivation.t, self.gyro_derivation.y)
-        self.gyro_derivation_z.setData(self.gyro_derivation.t, self.gyro_derivation.z)
+        self.gyro_derivation_events.setData(*self.events)
 
     async def event_triggered(self, events: [Event3]):
         event_x = []
@@ -77,13 +124,27 @@ class MainWindow2D(QMainWindow):
         for e in events:
             event_x.append(e.position)
             event_y.append(e.value)
-        self.gyro_derivation_events.setData(event_x, event_y)
+        self.set_events(event_x, event_y)
+
+    def set_events(self, positions, values):
+        """ event markers (time, value) shown in the gyro derivation plot """
+        self.events = (positions, values)
+        self.dirty = True
+        if self.timer is None:
+            self.render()
 
 class MainWindow3D(QMainWindow):
-    def __init__(self):
+    # origin and the tips of the x, y and z axis
+    AXES = np.array([[0, 0, 0], [10.0, 0, 0], [0, 10.0, 0], [0, 0, 10.0]])
+    LINES = [[0, 1], [0, 2], [0, 3]]
+    COLORS = [[1, 0, 0, 1], [0, 1, 0, 1], [0, 0, 1, 1]]
+
+    def __init__(self, fps=60, orientation=None):
         super().__init__()
 
         self.device = None
+        # optional orientation.OrientationEngine, replaces the raw rot angles
+        self.orientation = orientation
 
         self.centralWidget = QWidget()
         self.setCentralWidget(self.centralWidget)
@@ -95,17 +156,51 @@ class MainWindow3D(QMainWindow):
         self.graphWidget_3d.setWindowTitle('3D Coordinate System')
         self.layout.addWidget(self.graphWidget_3d)
 
+        # the line items are created once and only get new positions per frame
+        self.line_items = []
+        for line, color in zip(self.LINES, self.COLORS):
+            line_item = gl.GLLinePlotItem(pos=self.AXES[line], color=color, width=5)
+            self.graphWidget_3d.addItem(line_item)
+            self.line_items.append(line_item)
+
         # Rotation data
         self.alpha = 0
         self.beta = 0
         self.gamma = 0
-        # self.timer = pg.QtCore.QTimer()
-        # self.timer.timeout.connect(self.update_plot)
-        # self.timer.start(30)  # Update plot every 10 milliseconds
+        self.dirty = False
+
+        # redraw at most fps times per second, fps=None redraws on every packet
+        self.fps = fps
+        self.timer = None
+        if fps:
+            self.timer = pg.QtCore.QTimer()
+            self.timer.timeout.connect(self.render)
+            self.timer.start(max(1, round(1000 / fps)))
+
+    @staticmethod
+    def rotation_matrix(alpha, beta, gamma):
+        """
+        Combined rotation matrix R_z(gamma) @ R_y(beta) @ R_x(alpha).
+
+        Args:
+            alpha (float): Angle in radians around x.
+            beta (float): Angle in radians around y.
+            gamma (float): Angle in radians around z.
+
+        Returns:
+            np.array: 3x3 rotation matrix.
+        """
+        ca, sa = math.cos(alpha), math.sin(alpha)
+        cb, sb = math.cos(beta), math.sin(beta)
+        cg, sg = math.cos(gamma), math.sin(gamma)
+        return np.array([[cg * cb, cg * sb * sa - sg * ca, cg * sb * ca + sg * sa],
+                         [sg * cb, sg * sb * sa + cg * ca, sg * sb * ca - cg * sa],
+                         [-sb, cb * sa, cb * ca]])
 
     def rotate_coords(self, coords, alpha, beta, gamma):
         """
-        Rotate coordinates around the origin by an angle alpha in 3D space.
+        Rotate coordinates around the origin, first around x by alpha, then around y by beta
+        and around z by gamma.
 
         Args:
             coords (np.array): Array of shape (N, 3) representing coordinates in 3D space.
@@ -116,64 +211,31 @@ class MainWindow3D(QMainWindow):
         Returns:
             np.array: Rotated coordinates.
         """
-        # Rotation matrix around the x-axis
-        R_x = np.array([[1, 0, 0],
-                        [0, np.cos(alpha), -np.sin(alpha)],
-                        [0, np.sin(alpha), np.cos(alpha)]])
-
-        # Rotation matrix around the y-axis
-        R_y = np.array([[np.cos(beta), 0, np.sin(beta)],
-                        [0, 1, 0],
-                        [-np.sin(beta), 0, np.cos(beta)]])
-
-        # Rotation matrix around the z-axis
-        R_z = np.array([[np.cos(gamma), -np.sin(gamma), 0],
-                        [np.sin(gamma), np.cos(gamma), 0],
-                        [0, 0, 1]])
+        return np.dot(coords, self.rotation_matrix(alpha, beta, gamma).T)
 
-        # Rotate coordinates around the x-axis
-        coords = np.dot(coords, R_x.T)
-
-        # Rotate coordinates around the y-axis
-        coords = np.dot(coords, R_y.T)
-
-        # Rotate coordinates around the z-axis
-        coords = np.dot(coords, R_z.T)
-
-        return coords
+    def append(self, data: SensorData):
+        """ store the latest orientation, drawn on the next frame """
+        self.alpha = math.radians(data.rot.x)
+        self.beta = math.radians(data.rot.y)
+        self.gamma = math.radians(data.rot.z)
+        self.dirty = True
+        if self.timer is None:
+            self.render()
 
     async def update_plot(self, data : SensorData):
-        # Update 3D plot
-        self.alpha = data.rot.x * math.pi / 180.0
-        self.beta = data.rot.y * math.pi / 180.0
-        self.gamma = data.rot.z * math.pi / 180.0
-        self.graphWidget_3d.items.clear()
-        if (self.alpha >= 2 * math.pi):
-            self.alpha -= 2 * math.pi
-        if (self.beta >= 2 * math.pi):
-            self.beta -= 2 * math.pi
-        if (self.gamma >= 2 * math.pi):
-            self.gamma -= 2 * math.pi
-        if (self.alpha < 0):
-            self.alpha += 2 * math.pi
-        if (self.beta < 0):
-            self.beta += 2 * math.pi
-        if (self.gamma < 0):
-            self.gamma += 2 * math.pi
-        # coords = np.array([self.rotate_coords([0, 0, 0], self.alpha), self.rotate_coords([10.0, 0, 0], self.alpha),
-        #                  self.rotate_coords([0, 10.0, 0], self.alpha), self.rotate_coords([0, 0, 10.0], self.alpha)])
-        coords = self.rotate_coords([[0, 0, 0], [10.0, 0, 0], [0, 10.0, 0], [0, 0, 10.0]], self.alpha, self.beta,
-                                    self.gamma)
-        # print(coords)
-        # coords = self.rotate_coords(coords, self.alpha)
-        lines = [[0, 1], [0, 2], [0, 3]]
-        colors = [[1, 0, 0, 1], [0, 1, 0, 1], [0, 0, 1, 1]]
-
-        for line, color in zip(lines, colors):
-            line_item = gl.GLLinePlotItem(pos=coords[line], color=color, width=5)
-            self.graphWidget_3d.addItem(line_item)
-
-        # self.add_arrow()
+        self.append(data)
+
+    def render(self):
+        """ move the persistent axis lines to the latest orientation """
+        if not self.dirty:
+            return
+        self.dirty = False
+        if self.orientation is not None:
+            coords = np.dot(self.AXES, self.orientation.rotation_matrix().T)
+        else:
+            coords = self.rotate_coords(self.AXES, self.alpha, self.beta, self.gamma)
+        for line, line_item in zip(self.LINES, self.line_items):
+            line_item.setData(pos=coords[line])
 
         self.graphWidget_3d.opts['rotation'] = (0, 0, 0)
 
@@ -199,6 +261,4 @@ if __name__ == '__main__':
     window3d.resize(800, 600)
     window3d.show()
 
-    window3d.update_plot(0, 0, 0)
-
     sys.exit(app.exec_())
@@ -0,0 +1,279 @@
+import json
+import os
+import numpy as np
+from dispatch import Dispatcher, Priority
+from processing import SensorHistory, History3
+
+INF = float('inf')
+
+
+def z_normalize(window: np.ndarray) -> np.ndarray:
+    """ per channel zero mean and unit variance of a (N, D) window """
+    std = window.std(axis=0)
+    std[std < 1e-9] = 1.0
+    return (window - window.mean(axis=0)) / std
+
+
+def envelope(samples: np.ndarray, radius: int):
+    """ running max/min over +-radius samples, the LB_Keogh envelope of a (N, D) series """
+    n = len(samples)
+    padded_max = np.pad(samples, ((radius, radius), (0, 0)), mode='constant', constant_values=-INF)
+    padded_min = np.pad(samples, ((radius, radius), (0, 0)), mode='constant', constant_values=INF)
+    windows = np.lib.stride_tricks.sliding_window_view
+    upper = windows(padded_max, 2 * radius + 1, axis=0)[:n].max(axis=-1)
+    lower = windows(padded_min, 2 * radius + 1, axis=0)[:n].min(axis=-1)
+    return upper, lower
+
+
+def dtw_distance(query: np.ndarray, template: np.ndarray, radius: int, best_so_far=INF) -> float:
+    """
+    DTW with squared euclidean cost inside a Sakoe-Chiba band of +-radius.
+
+    Abandons early and returns inf as soon as a whole row exceeds best_so_far.
+    """
+    n = len(query)
+    m = len(template)
+    cost = ((query[:, None, :] - template[None, :, :]) ** 2).sum(axis=-1).tolist()
+    previous = [INF] * (m + 1)
+    previous[0] = 0.0
+    for i in range(1, n + 1):
+        current = [INF] * (m + 1)
+        row = cost[i - 1]
+        row_min = INF
+        for j in range(max(1, i - radius), min(m, i + radius) + 1):
+            best = previous[j - 1]
+            if previous[j] < best:
+                best = previous[j]
+            if current[j - 1] < best:
+                best = current[j - 1]
+            value = row[j - 1] + best
+            current[j] = value
+            if value < row_min:
+                row_min = value
+        if row_min >= best_so_far:
+            return INF
+        previous = current
+    return previous[m]
+
+
+def dtw_distances(query: np.ndarray, templates: np.ndarray, radius: int, best_so_far=INF) -> np.ndarray:
+    """
+    dtw_distance of query against a (K, M, D) stack of templates at once.
+
+    Each band row is one NumPy step over all templates: with the row costs c, their
+    running sum C and a[j] = min(previous[j - 1], previous[j]), the horizontal chain
+    current[j] = c[j] + min(a[j], current[j - 1]) is C[j] + min over k <= j of (a[k] - C[k - 1]),
+    a minimum.accumulate. Stops early and returns all inf once every row exceeds best_so_far.
+    """
+    n = len(query)
+    count, m = templates.shape[:2]
+    # (n, m, count) so every band slice is one contiguous block over all templates,
+    # summed per channel as summing over a short last axis is much slower
+    cost = np.zeros((n, m, count))
+    columns = templates.transpose(1, 2, 0)
+    for channel in range(query.shape[1]):
+        difference = query[:, None, channel, None] - columns[None, :, channel, :]
+        cost += difference * difference
+    table = np.full((n + 1, m + 1, count), INF)
+    table[0, 0] = 0.0
+    for i in range(1, n + 1):
+        low = max(1, i - radius)
+        high = min(m, i + radius)
+        previous = table[i - 1]
+        reach = np.minimum(previous[low - 1:high], previous[low:high + 1])
+        row = cost[i - 1, low - 1:high]
+        total = np.cumsum(row, axis=0)
+        current = total + np.minimum.accumulate(reach - (total - row), axis=0)
+        if current.min() >= best_so_far:
+            return np.full(count, INF)
+        table[i, low:high + 1] = current
+    return table[n, m].copy()
+
+
+class GestureTemplate:
+    def __init__(self, name: str, samples):
+        self.name = name
+        self.samples = np.asarray(samples, dtype=np.float64)
+
+
+class GestureRecognizer:
+    """
+    Matches the latest SensorHistory window against recorded template swings with DTW.
+
+    Templates are z-normalized and their LB_Keogh envelopes are stacked into one
+    index, so the lower bounds against all templates are a single NumPy expression.
+    The banded DTW then runs vectorized over all templates whose lower bound is
+    within the threshold, so many takes per gesture cost about as much as one.
+    """
+
+    def __init__(self, length=20, radius=3, threshold=15.0, min_energy=50.0, stride=2, cooldown=0.3,
+                 signal='gyro'):
+        self.length = length
+        self.radius = radius
+        self.threshold = threshold  # maximum DTW distance of a match
+        self.min_energy = min_energy  # minimum RMS of the window, ignores small movements
+        self.stride = stride  # match every stride samples
+        self.cooldown = cooldown  # seconds between two recognized gestures
+        self.signal = signal
+        self.templates = []
+        self._clear_index()
+        self.callbacks = Dispatcher()
+        self.processed = 0
+        self.last_match = -INF
+
+    def _clear_index(self):
+        self.upper = np.empty((0, self.length, 3))
+        self.lower = np.empty((0, self.length, 3))
+        self.normalized = np.empty((0, self.length, 3))
+
+    def window(self, history: SensorHistory):
+        """ (length, 3) window of the newest samples, None if not enough samples yet """
+        signal: History3 = getattr(history, self.signal)
+        if len(signal) < self.length:
+            return None
+        return signal.view()[:3, -self.length:].T
+
+    def record(self, name: str, history: SensorHistory) -> GestureTemplate:
+        """ store the newest window of history as template for gesture name """
+        window = self.window(history)
+        if window is None:
+            raise ValueError("history is shorter than the gesture length")
+        return self.add_template(GestureTemplate(name, window.copy()))
+
+    def add_template(self, template: GestureTemplate) -> GestureTemplate:
+        if template.samples.shape != (self.length, 3):
+            raise ValueError(f"template must have shape ({self.length}, 3)")
+        normalized = z_normalize(template.samples)
+        upper, lower = envelope(normalized, self.radius)
+        self.templates.append(template)
+        self.normalized = np.concatenate((self.normalized, normalized[None]))
+        self.upper = np.concatenate((self.upper, upper[None]))
+        self.lower = np.concatenate((self.lower, lower[None]))
+        return template
+
+    def match(self, window: np.ndarray):
+        """ (name, distance) of the best template within threshold, None otherwise """
+        if not self.templates:
+            return None
+        if np.sqrt((window ** 2).mean()) < self.min_energy:
+            return None
+        query = z_normalize(window)
+        above = np.maximum(query[None] - self.upper, 0.0)
+        below = np.maximum(self.lower - query[None], 0.0)
+        lower_bounds = (above ** 2 + below ** 2).sum(axis=(1, 2))
+
+        candidates = np.flatnonzero(lower_bounds < self.threshold)
+        if not len(candidates):
+            return None
+        distances = dtw_distances(query, self.normalized[candidates], self.radius, self.threshold)
+        best = int(distances.argmin())
+        if distances[best] >= self.threshold:
+            return None
+        return self.templates[candidates[best]].name, float(distances[best])
+
+    async def update(self, history: SensorHistory):
+        """ called for every new sample, matches every stride samples """
+        self.processed += 1
+        if self.processed % self.stride:
+            return
+        window = self.window(history)
+        if window is None:
+            return
+        t = getattr(history, self.signal).t[-1]
+        if t - self.last_match < self.cooldown:
+            return
+        result = self.match(window)
+        if result is not None:
+            self.last_match = t
+            await self.callbacks.dispatch(*result)
+
+    async def add_callback(self, callback, priority=Priority.NORMAL):
+        self.callbacks.add(callback, priority)
+
+    async def remove_callback(self, callback):
+        self.callbacks.remove(callback)
+
+    def save(self, path, actions=None):
+        """ store templates (all takes of a gesture) and their MIDI actions (gesture name -> notes) as json """
+        actions = actions or {}
+        gestures = {}
+        for template in self.templates:
+            gesture = gestures.setdefault(template.name, {'takes': [], 'notes': actions.get(template.name, [])})
+            gesture['takes'].append(template.samples.tolist())
+        with open(path, 'w') as file:
+            json.dump({'length': self.length, 'signal': self.signal, 'gestures': gestures}, file)
+
+    def load(self, path):
+        """
+        add templates from a json file, returns the MIDI actions (gesture name -> notes)
+
+        Without templates so far, length and signal are taken from the file, otherwise they have to match.
+        """
+        with open(path) as file:
+            content = json.load(file)
+        length = content.get('length', self.length)
+        signal = content.get('signal', self.signal)
+        if not self.templates:
+            self.length = length
+            self.signal = signal
+            self._clear_index()
+        elif (length, signal) != (self.length, self.signal):
+            raise ValueError(f"{path} has {length} sample {signal} templates,"
+                             f" expected {self.length} sample {self.signal} templates")
+        actions = {}
+        for name, gesture in content['gestures'].items():
+            for samples in gesture['takes']:
+                self.add_template(GestureTemplate(name, samples))
+            actions[name] = gesture['notes']
+        return actions
+
+
+class GestureRecorder:
+    """
+    Records templates for a GestureRecognizer, registered like one with Processor.add_gesture_recognizer.
+
+    Every swing whose window RMS rises above the recognizer's min_energy is one take:
+    the window with the highest RMS during the swing is added as template name, and
+    all templates are saved to path with notes as the MIDI action of name.
+    Callbacks get the new GestureTemplate.
+    """
+
+    def __init__(self, recognizer: GestureRecognizer, name: str, path, notes=()):
+        self.recognizer = recognizer
+        self.name = name
+        self.path = path
+        # keep the templates and actions already in the file
+        self.actions = recognizer.load(path) if os.path.exists(path) else {}
+        self.actions[name] = list(notes)
+        self.best = None
+        self.best_energy = 0.0
+        self.takes = 0
+        self.callbacks = Dispatcher()
+
+    @property
+    def length(self):
+        return self.recognizer.length
+
+    async def update(self, history: SensorHistory):
+        window = self.recognizer.window(history)
+        if window is None:
+            return
+        energy = np.sqrt((window ** 2).mean())
+        if energy >= self.recognizer.min_energy:
+            if energy > self.best_energy:
+                self.best_energy = energy
+                self.best = window.copy()
+            return
+        if self.best is not None:
+            template = self.recognizer.add_template(GestureTemplate(self.name, self.best))
+            self.best = None
+            self.best_energy = 0.0
+            self.takes += 1
+            self.recognizer.save(self.path, self.actions)
+            await self.callbacks.dispatch(template)
+
+    async def add_callback(self, callback, priority=Priority.NORMAL):
+        self.callbacks.add(callback, priority)
+
+    async def remove_callback(self, callback):
+        self.callbacks.remove(callback)
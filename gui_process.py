@@ -0,0 +1,85 @@
+import multiprocessing
+import sys
+from shm_ring import SharedFrameRing, frame_to_sensor_data
+
+
+def run_gui(name, fps=60):
+    """ GUI process main: show the fast_gui windows fed from the shared frame ring name """
+    import pyqtgraph as pg
+    from PyQt5.QtWidgets import QApplication
+    from fast_gui import MainWindow2D, MainWindow3D
+
+    app = QApplication(sys.argv[:1])
+    ring = SharedFrameRing(name)
+
+    window2d = MainWindow2D(fps=fps)
+    window2d.resize(800, 600)
+    window2d.show()
+    window3d = MainWindow3D(fps=fps)
+    window3d.resize(800, 600)
+    window3d.show()
+
+    def poll():
+        frames = ring.read_frames()
+        for frame in frames:
+            window2d.append(frame_to_sensor_data(frame))
+        if len(frames):
+            window3d.append(frame_to_sensor_data(frames[-1]))
+        events = ring.read_events()
+        if events is not None:
+            window2d.set_events(events['position'].tolist(), events['value'].tolist())
+
+    timer = pg.QtCore.QTimer()
+    timer.timeout.connect(poll)
+    timer.start(max(1, round(1000 / fps)))
+    app.exec_()
+    ring.close()
+
+
+class RemoteGui:
+    """
+    Runs the plot windows in a separate process.
+
+    new_data and event_triggered only copy into the shared frame ring, register
+    them as callbacks. The GUI process can lag, crash or be detached (and attached
+    again) without any effect on the audio process.
+    """
+
+    def __init__(self, fps=60, capacity=4096):
+        self.fps = fps
+        self.ring = SharedFrameRing(capacity=capacity)
+        self.process = None
+
+    def attach(self):
+        if self.alive:
+            return
+        # spawn: the GUI process must not inherit the asyncio loop or BLE state
+        context = multiprocessing.get_context('spawn')
+        self.process = context.Process(target=run_gui, args=(self.ring.name, self.fps),
+                                       name="musicsaber-gui", daemon=True)
+        self.process.start()
+
+    def detach(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join(1.0)
+            self.process = None
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    async def new_data(self, data):
+        self.ring.write_frame(data)
+
+    async def event_triggered(self, events):
+        self.ring.write_events(events)
+
+    def close(self):
+        self.detach()
+        self.ring.close()
+
+
+if __name__ == "__main__":
+    # attach a GUI to a running audio process: python gui_process.py SHARED_MEMORY_NAME
+    run_gui(sys.argv[1], float(sys.argv[2]) if len(sys.argv) > 2 else 60)
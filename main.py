@@ -1,56 +1,278 @@
+import time
+START_TIME = time.perf_counter()
+
+import argparse
 import asyncio
 
-from PyQt5.QtCore import QCoreApplication
-from PyQt5.QtWidgets import QApplication
 import sys
-from fast_gui import MainWindow2D, MainWindow3D
-from receiver import Receiver
+from receiver import CHARACTERISTIC_UUID, DEVICE_MAC_ADDRESS, SERVICE_UUID, DeviceCache, Receiver
+from recorder import SessionRecorder, ReplayReceiver, SimulatedReceiver
 from midi import MIDISender
-from processing import Processor
-from player import Player
-
-async def connect_bt(device):
-    DEVICE_MAC_ADDRESS = "A0:A3:B3:97:7C:D6"
-    SERVICE_UUID = "4fafc201-1fb5-459e-8fcc-c5c9c331914b"
-    CHARACTERISTIC_UUID = "e68da052-33c2-4814-8793-60112fe6570a"
-    await device.scan_and_select_device()
+from midi_backend import prompt_output_device
+from rig import SaberRig
+from dispatch import Priority
+from tracing import tracer
+# the GUI modules (PyQt5, pyqtgraph, qasync, fast_gui) are imported on demand
+IMPORT_TIME = time.perf_counter()
+
+
+class StartupTimer:
+    """ seconds since main.py started for each startup phase, reported when the first note plays """
+
+    def __init__(self, start=START_TIME):
+        self.start = start
+        self.phases = [('imports', IMPORT_TIME - start)]
+
+    def mark(self, phase):
+        self.phases.append((phase, time.perf_counter() - self.start))
+
+    def report(self):
+        print("startup: " + ", ".join(f"{phase} {seconds * 1000:.0f} ms" for phase, seconds in self.phases))
+
+    async def wait_for_first_note(self, midi: MIDISender):
+        await midi.first_note.wait()
+        self.phases.append(('first note', midi.first_note_time - self.start))
+        self.report()
+
+
+async def connect_bt(device, cache=None, timeout=5.0, select=False):
+    found = None
+    if select:
+        await device.scan_and_select_device()
+    else:
+        # first known (cached) device or any device advertising the saber service
+        found = await device.find_device(SERVICE_UUID, cache, timeout)
+        if found is None and device.device_address:
+            print(f"No saber found within {timeout:.0f}s, trying the configured address {device.device_address}")
     if device.device_address:
-        await device.connect()
+        await device.connect(found)
         await device.start_notifications(SERVICE_UUID, CHARACTERISTIC_UUID)
+        device.keep_connected()
+        if cache is not None:
+            cache.add(device.device_address)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="MusicSaber: BLE sensor data to MIDI")
+    parser.add_argument("--record", metavar="PATH",
+                        help="log all raw BLE notifications to PATH (PATH.<n> with several sabers)")
+    parser.add_argument("--device", action="append", metavar="MAC",
+                        help="BLE address of a saber, repeat for several sabers (one MIDI channel each)")
+    parser.add_argument("--select", action="store_true",
+                        help="list all BLE devices and ask which one to connect to")
+    parser.add_argument("--scan-timeout", type=float, default=5.0,
+                        help="seconds to scan for a known saber or the saber service")
+    parser.add_argument("--device-cache", metavar="PATH", default=None,
+                        help="json file of known saber addresses (default ~/.musicsaber_devices.json)")
+    parser.add_argument("--simulate", type=int, metavar="N", help="run N simulated sabers instead of BLE")
+    parser.add_argument("--replay", metavar="PATH", help="play back a recorded session instead of BLE")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="replay speed factor, 0 replays as fast as possible")
+    parser.add_argument("--loop", choices=["qt", "poll"], default="qt",
+                        help="qt: Qt and asyncio share one event loop, poll: legacy 5 ms polling loop")
+    parser.add_argument("--gui", choices=["inline", "process", "none"], default="inline",
+                        help="inline: windows in this process, process: windows in a separate process "
+                             "fed through shared memory, none: no windows and no Qt")
+    parser.add_argument("--headless", dest="gui", action="store_const", const="none",
+                        help="same as --gui none, only loads the receive, processing and MIDI modules")
+    parser.add_argument("--fps", type=float, default=60,
+                        help="maximum redraw rate of the plot windows, 0 redraws on every packet")
+    parser.add_argument("--midi-backend", default="pygame", help="pygame, direct, null or recording")
+    parser.add_argument("--midi-device",
+                        help="MIDI output id or name, asked interactively if not given")
+    parser.add_argument("--controllers", action="store_true",
+                        help="stream pitch bend and modulation from the saber orientation and acceleration")
+    parser.add_argument("--fusion", nargs="?", const="imu", choices=("imu", "marg"),
+                        help="fuse gyro and acc into a stable orientation (Madgwick), "
+                             "marg also fuses the rot field as raw magnetometer")
+    parser.add_argument("--gestures", metavar="PATH",
+                        help="json file of gesture templates, recognized gestures play their mapped notes")
+    parser.add_argument("--record-gesture", metavar="NAME",
+                        help="record every swing of the first saber as a template of gesture NAME into --gestures")
+    parser.add_argument("--gesture-notes", metavar="NOTES", default="",
+                        help="with --record-gesture: comma separated MIDI notes the gesture plays, e.g. 60,64,67")
+    parser.add_argument("--onset", action="store_true",
+                        help="play on the rising slope of a swing, with velocity from the early slope")
+    parser.add_argument("--aftertouch", action="store_true",
+                        help="with --onset: send polyphonic aftertouch when the swing peaks")
+    parser.add_argument("--dsp", metavar="PATH",
+                        help="json signal graph (see dsp.py), its detectors trigger notes like the built-in detector")
+    parser.add_argument("--dsp-only", action="store_true",
+                        help="only use the --dsp graph, without the built-in gyro derivative detector")
+    parser.add_argument("--jitter-buffer", type=float, metavar="MAX_MS",
+                        help="even out device-clocked samples with an adaptive delay of at most MAX_MS")
+    parser.add_argument("--no-trace", action="store_true", help="disable the hot-path stage tracing")
+    parser.add_argument("--trace-overlay", action="store_true", help="show stage latencies in the 2D window")
+    parser.add_argument("--trace-export", metavar="PATH",
+                        help="write the stage latency histograms to PATH on exit (.json or .csv)")
+    parser.add_argument("--measure-jitter", type=float, metavar="SECONDS",
+                        help="measure callback-dispatch jitter for SECONDS, print it and exit")
+    args = parser.parse_args()
+    if args.record_gesture and not args.gestures:
+        parser.error("--record-gesture needs --gestures PATH to write the templates to")
+    return args
+
+
+async def poll_qt_events():
+    """ legacy loop: process Qt events every 5 ms from asyncio """
+    from PyQt5.QtCore import QCoreApplication
+    while True:
+        QCoreApplication.processEvents()  # Process Qt events
+        await asyncio.sleep(0.005)
 
 
-async def main():
-    app = QApplication(sys.argv)
+def create_receivers(args):
+    if args.replay:
+        return [ReplayReceiver(args.replay, args.speed)]
+    if args.simulate:
+        return [SimulatedReceiver(f"simulated-{i}", speed=args.speed, swing_period=0.8 + 0.1 * i)
+                for i in range(args.simulate)]
+    if args.device:
+        return [Receiver(address) for address in args.device]
+    return [Receiver(DEVICE_MAC_ADDRESS)]
 
+
+async def attach_windows(args, primary):
+    """ show the plot windows for the first saber in this process """
+    from fast_gui import MainWindow2D, MainWindow3D
     # Create and show 2D window
-    window2d = MainWindow2D()
+    window2d = MainWindow2D(fps=args.fps, tracer=tracer if args.trace_overlay else None)
     window2d.resize(800, 600)
     window2d.show()
 
-    receiver = Receiver()
     # Create and show 3D window
-    window3d = MainWindow3D()
+    window3d = MainWindow3D(fps=args.fps, orientation=primary.orientation)
     window3d.resize(800, 600)
     window3d.show()
-    processor = Processor()
-    await processor.add_receiver(receiver)
-    await receiver.add_callback(window2d.update_plot)
-    await receiver.add_callback(window3d.update_plot)
-    await processor.add_callback(window2d.event_triggered)
 
-    midi = MIDISender()
-    player = Player(midi)
-    await player.add_receiver(receiver)
-    await player.add_event_processor(processor)
+    # visualization must never delay the audio path, stale frames are dropped.
+    # the 2D window only stores samples here and redraws from its own frame timer
+    await primary.receiver.add_callback(window2d.update_plot, Priority.NORMAL)
+    await primary.receiver.add_callback(window3d.update_plot, Priority.VISUAL)
+    await primary.processor.add_callback(window2d.event_triggered, Priority.VISUAL)
+    return window2d, window3d
 
-    await connect_bt(receiver)
 
-    # Start the Qt event loop
-    # sys.exit(app.exec_())
-    while True:
-        QCoreApplication.processEvents()  # Process Qt events
-        await asyncio.sleep(0.005)
+async def attach_remote_gui(args, primary):
+    """ show the plot windows for the first saber in a separate process """
+    from gui_process import RemoteGui
+    gui = RemoteGui(args.fps)
+    # only a copy into shared memory, cheap enough to run inline
+    await primary.receiver.add_callback(gui.new_data, Priority.NORMAL)
+    await primary.processor.add_callback(gui.event_triggered, Priority.NORMAL)
+    gui.attach()
+    print("GUI process attached to shared memory", gui.ring.name)
+    return gui
+
+
+async def main(args, app, startup=None):
+    if startup is None:
+        startup = StartupTimer()
+    tracer.enabled = not args.no_trace
+
+    receivers = create_receivers(args)
+    if args.jitter_buffer:
+        for receiver in receivers:
+            receiver.enable_jitter_buffer(max_delay=args.jitter_buffer / 1000.0)
+    if args.record:
+        for i, receiver in enumerate(receivers):
+            path = args.record if len(receivers) == 1 else f"{args.record}.{i}"
+            receiver.set_recorder(SessionRecorder(path))
+
+    midi_device = args.midi_device
+    if args.midi_backend in ("pygame", "direct") and midi_device is None:
+        midi_device = prompt_output_device()
+    midi = MIDISender(midi_device, threaded=True, backend=args.midi_backend)
+    startup.mark('midi')
+
+    # one pipeline and MIDI channel per saber, all sharing the MIDI output
+    gesture_notes = [int(note) for note in args.gesture_notes.split(",") if note.strip()]
+    rig = SaberRig(midi, args.controllers, args.fusion, args.gestures, args.dsp, args.dsp_only,
+                   args.onset, args.aftertouch, args.record_gesture, gesture_notes)
+    for receiver in receivers:
+        await rig.add_device(receiver)
+
+    startup.mark('pipelines')
+
+    # the windows show the first saber
+    remote_gui = None
+    if args.gui == "inline":
+        # keep references, otherwise the windows are garbage collected
+        windows = await attach_windows(args, rig.pipelines[0])
+        startup.mark('gui')
+    elif args.gui == "process":
+        remote_gui = await attach_remote_gui(args, rig.pipelines[0])
+        startup.mark('gui')
+
+    if args.loop == "poll" and app is not None:
+        asyncio.ensure_future(poll_qt_events())
+
+    if args.replay or args.simulate:
+        for receiver in receivers:
+            asyncio.ensure_future(receiver.play())
+    elif args.measure_jitter:
+        pass
+    elif args.device:
+        await rig.connect_all(SERVICE_UUID, CHARACTERISTIC_UUID)
+    else:
+        cache = DeviceCache(args.device_cache) if args.device_cache else DeviceCache()
+        await connect_bt(receivers[0], cache, args.scan_timeout, args.select)
+    startup.mark('connected')
+    first_note = asyncio.ensure_future(startup.wait_for_first_note(midi))
+
+    try:
+        if args.measure_jitter:
+            from benchmark import JitterProbe
+            probe = JitterProbe()
+            await probe.run(args.measure_jitter)
+            probe.print_summary(f"{args.loop} loop")
+        elif app is not None:
+            # run until the last window is closed
+            quit_event = asyncio.Event()
+            app.lastWindowClosed.connect(quit_event.set)
+            await quit_event.wait()
+        else:
+            # no windows in this process, run until interrupted
+            await asyncio.Event().wait()
+    finally:
+        first_note.cancel()
+        await rig.disconnect_all()
+        rig.print_stats()
+        midi.panic()
+        midi.close()
+        for receiver in receivers:
+            if receiver.recorder is not None:
+                receiver.recorder.close()
+        if remote_gui is not None:
+            remote_gui.close()
+        if args.trace_export:
+            tracer.export(args.trace_export)
+
+
+def run():
+    args = parse_args()
+    startup = StartupTimer()
+    if args.gui != "inline":
+        # headless or GUI in another process: this process doesn't run Qt at all
+        try:
+            asyncio.run(main(args, None, startup))
+        except KeyboardInterrupt:
+            pass
+        return
+    from PyQt5.QtWidgets import QApplication
+    app = QApplication(sys.argv[:1])
+    startup.mark('qt')
+    if args.loop == "poll":
+        asyncio.run(main(args, app, startup))
+    else:
+        import qasync
+        # Qt drives one event loop that also dispatches asyncio callbacks,
+        # BLE notifications and Qt timers run as soon as they are ready
+        loop = qasync.QEventLoop(app)
+        asyncio.set_event_loop(loop)
+        with loop:
+            loop.run_until_complete(main(args, app, startup))
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    run()
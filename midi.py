@@ -1,45 +1,220 @@
-import pygame.midi
+import asyncio
+import threading
 import time
+import traceback
+from collections import deque
+import numpy as np
+from midi_backend import MIDIBackend, PygameBackend, create_backend, prompt_output_device
+from tracing import tracer, Stage
+
+
+class MIDIOutputThread:
+    """
+    Writes MIDI messages from a dedicated thread.
+
+    The event loop only appends messages to a deque (atomic, no lock needed) and
+    wakes the thread. The thread drains everything queued so far and hands it to
+    the port as one Output.write batch, so a chord is one call and a stalling MIDI
+    driver never blocks BLE handling. Messages are sent immediately, the timestamp
+    of every batch entry is 0.
+    """
+    MAX_BATCH = 1024  # limit of pygame.midi.Output.write
+
+    def __init__(self, output_port):
+        self.output_port = output_port
+        self.queue = deque()
+        self.wakeup = threading.Event()
+        self.running = True
+        self.batches = 0
+        self.messages = 0
+        self.thread = threading.Thread(target=self._run, name="midi-output", daemon=True)
+        self.thread.start()
+
+    def send(self, status, data1=0, data2=0, notify=True):
+        """ queue one message """
+        self.queue.append([[status, data1, data2], 0])
+        if notify:
+            self.wakeup.set()
+
+    def notify(self):
+        self.wakeup.set()
+
+    def flush(self, timeout=1.0):
+        """ block until everything queued so far was written, returns False on timeout """
+        done = threading.Event()
+        self.queue.append(done)
+        self.wakeup.set()
+        return done.wait(timeout)
+
+    def discard(self):
+        """ drop all messages that were not written yet, pending flush() calls are still released """
+        markers = []
+        # popleft is atomic, iterating the deque could race with the output thread
+        while True:
+            try:
+                message = self.queue.popleft()
+            except IndexError:
+                break
+            if isinstance(message, threading.Event):
+                markers.append(message)
+        for marker in markers:
+            marker.set()
+
+    def close(self):
+        self.flush()
+        self.running = False
+        self.wakeup.set()
+        self.thread.join(1.0)
+
+    def _run(self):
+        while self.running:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            self._drain()
+
+    def _drain(self):
+        batch = []
+        while self.queue:
+            message = self.queue.popleft()
+            if isinstance(message, threading.Event):
+                self._write(batch)
+                batch = []
+                message.set()
+                continue
+            batch.append(message)
+            if len(batch) == self.MAX_BATCH:
+                self._write(batch)
+                batch = []
+        self._write(batch)
+
+    def _write(self, batch):
+        if not batch:
+            return
+        try:
+            self.output_port.write(batch)
+        except Exception:
+            traceback.print_exc()
+        self.batches += 1
+        self.messages += len(batch)
 
 
 class MIDISender:
     c_scale = [60, 62, 64, 65, 67, 69, 71, 72]  # C-Dur-Tonleiter
-    active_notes = []
-    def __init__(self, output_device_id=None):
-        if output_device_id is None:
-            print("Verfügbare MIDI-Geräte:")
-            for i, device in list_midi_devices():
-                print(f"{i}: {device}")
-
-            output_device_id = int(input("Geben Sie die ID des gewünschten MIDI-Outputs ein: "))
-        pygame.midi.init()
-        self.output_port = pygame.midi.Output(output_device_id)
-
-    def start_note(self, note, velocity=64):
-        note_on = [0x90, note, velocity]
-        self.output_port.write_short(*note_on)
-        self.active_notes.append(note)
+
+    def __init__(self, output_device_id=None, threaded=False, backend=None):
+        # backend: a MIDIBackend, a backend name (see midi_backend.BACKENDS) or None
+        # for the pygame output, on the default device if output_device_id is None
+        if backend is None:
+            backend = PygameBackend(output_device_id)
+        elif not isinstance(backend, MIDIBackend):
+            backend = create_backend(backend, output_device_id)
+        self.output_port = backend
+        self.note_counts = new_note_table()
+        # optional dedicated output thread, see MIDIOutputThread
+        self.output_thread = MIDIOutputThread(self.output_port) if threaded else None
+        # perf_counter time of the first note-on and an event set with it, for the startup report
+        self.first_note_time = None
+        self.first_note = asyncio.Event()
+
+    def _write(self, status, data1, data2, notify=True):
+        start_ns = time.perf_counter_ns()
+        if self.output_thread is not None:
+            self.output_thread.send(status, data1, data2, notify=notify)
+        else:
+            self.output_port.write_short(status, data1, data2)
+        tracer.record(Stage.MIDI, start_ns)
+
+    def _notify(self):
+        if self.output_thread is not None:
+            self.output_thread.notify()
+
+    def start_note(self, note, velocity=64, channel=0):
+        # overlapping triggers of the same note are reference counted,
+        # the note-off is only sent when the last trigger stops
+        self.note_counts[channel, note] += 1
+        self._write(0x90 | channel, note, velocity)
+        if self.first_note_time is None:
+            self._first_note()
         return note
 
-    def start_notes(self, notes, velocity=64):
+    def start_notes(self, notes, velocity=64, channel=0):
         for note in notes:
-            note_on = [0x90, note, velocity]
-            self.output_port.write_short(*note_on)
-            self.active_notes.append(note)
+            self.note_counts[channel, note] += 1
+            self._write(0x90 | channel, note, velocity, notify=False)
+        self._notify()
+        if self.first_note_time is None and notes:
+            self._first_note()
+
+    def _first_note(self):
+        self.first_note_time = time.perf_counter()
+        self.first_note.set()
 
-    def stop_note(self, note):
-        note_off = [0x80, note, 0]
-        self.output_port.write_short(*note_off)
-        self.active_notes.remove(note)
+    def stop_note(self, note, channel=0):
+        if self._release(note, channel):
+            self._write(0x80 | channel, note, 0)
 
-    def stop_notes(self, notes):
+    def stop_notes(self, notes, channel=0):
         for note in notes:
-            note_off = [0x80, note, 0]
-            self.output_port.write_short(*note_off)
-            self.active_notes.remove(note)
+            if self._release(note, channel):
+                self._write(0x80 | channel, note, 0, notify=False)
+        self._notify()
+
+    def control_change(self, controller, value, channel=0):
+        self._write(0xB0 | channel, controller, value)
+
+    def poly_aftertouch(self, note, pressure, channel=0):
+        """ key pressure 0..127 of a sounding note """
+        self._write(0xA0 | channel, note, pressure)
+
+    def pitch_bend(self, value, channel=0):
+        """ value 0..16383, 8192 is the center """
+        self._write(0xE0 | channel, value & 0x7F, value >> 7)
+
+    def _release(self, note, channel):
+        """ drop one reference, True if the note has to be switched off now """
+        count = self.note_counts[channel, note]
+        if count == 0:
+            return False  # already stopped
+        self.note_counts[channel, note] = count - 1
+        return count == 1
+
+    def is_active(self, note, channel=0) -> bool:
+        return self.note_counts[channel, note] > 0
+
+    def active_notes(self, channel=None):
+        """ list of sounding (channel, note) pairs """
+        channels, notes = np.nonzero(self.note_counts)
+        return [(c, n) for c, n in zip(channels.tolist(), notes.tolist()) if channel is None or c == channel]
+
+    def flush(self):
+        """ wait until all queued messages are written to the device """
+        if self.output_thread is not None:
+            self.output_thread.flush()
+
+    def panic(self):
+        """ drop everything queued and silence all channels """
+        if self.output_thread is not None:
+            self.output_thread.discard()
+        for channel in range(16):
+            self._write(0xB0 | channel, 120, 0, notify=False)  # all sound off
+            self._write(0xB0 | channel, 123, 0, notify=False)  # all notes off
+        self._notify()
+        self.note_counts[:] = 0
+        self.flush()
+
+    def stop_all(self, channel=None):
+        """ note-off for every sounding note, on one channel or on all """
+        channels = range(16) if channel is None else [channel]
+        for c in channels:
+            for note in np.flatnonzero(self.note_counts[c]).tolist():
+                self._write(0x80 | c, note, 0, notify=False)
+            self.note_counts[c] = 0
+        self._notify()
 
-    def stop_all(self):
-        self.stop_notes(self.active_notes)
+    def all_notes_off(self, channel=0):
+        """ cheap channel reset with the all-notes-off controller """
+        self._write(0xB0 | channel, 123, 0)
+        self.note_counts[channel] = 0
 
     def play_scale(self):
         notes = self.c_scale  # C-Dur-Tonleiter
@@ -65,23 +240,18 @@ class MIDISender:
             self.stop_note(note)
 
     def close(self):
-        del self.output_port
-        pygame.midi.quit()
+        if self.output_thread is not None:
+            self.output_thread.close()
+        self.output_port.close()
 
 
-def list_midi_devices():
-    pygame.midi.init()
-    devices = []
-    for i in range(pygame.midi.get_count()):
-        device_info = pygame.midi.get_device_info(i)
-        device_name = device_info[1].decode('utf-8')
-        devices.append((i, device_name))
-    pygame.midi.quit()
-    return devices
+def new_note_table():
+    """ reference count per (channel, note) """
+    return np.zeros((16, 128), dtype=np.int32)
 
 
 def main():
-    midi_sender = MIDISender()
+    midi_sender = MIDISender(prompt_output_device())
     midi_sender.play_scale()
     midi_sender.play_chord()
     midi_sender.play_melody()
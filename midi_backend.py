@@ -0,0 +1,172 @@
+import time
+from abc import ABC, abstractmethod
+import numpy as np
+
+
+class MIDIBackend(ABC):
+    """
+    Output sink of MIDISender.
+
+    write_short sends one message, write sends a batch in the format of
+    pygame.midi.Output.write: [[[status, data1, data2], timestamp], ...].
+    """
+    name = None
+
+    @abstractmethod
+    def write_short(self, status, data1=0, data2=0):
+        ...
+
+    def write(self, batch):
+        for message, timestamp in batch:
+            self.write_short(*message)
+
+    def close(self):
+        pass
+
+
+class NullBackend(MIDIBackend):
+    """ drops everything, measures the pipeline without any MIDI cost """
+    name = 'null'
+
+    def write_short(self, status, data1=0, data2=0):
+        pass
+
+    def write(self, batch):
+        pass
+
+
+class RecordingBackend(MIDIBackend):
+    """ keeps all messages in memory with their perf_counter_ns send time """
+    name = 'recording'
+
+    def __init__(self):
+        self.messages = []
+
+    def write_short(self, status, data1=0, data2=0):
+        self.messages.append((time.perf_counter_ns(), status, data1, data2))
+
+    def write(self, batch):
+        now = time.perf_counter_ns()
+        for message, timestamp in batch:
+            self.messages.append((now, *message))
+
+    def as_array(self) -> np.ndarray:
+        """ (N, 4) int64 array with columns time_ns, status, data1, data2 """
+        return np.array(self.messages, dtype=np.int64).reshape(-1, 4)
+
+    def clear(self):
+        self.messages.clear()
+
+
+class PygameBackend(MIDIBackend):
+    """ pygame.midi output port, the default output if no device is given """
+    name = 'pygame'
+
+    def __init__(self, device=None, latency=0):
+        import pygame.midi
+        self.midi = pygame.midi
+        if device is None:
+            device = _default_output_id()
+        pygame.midi.init()
+        self.port = pygame.midi.Output(find_output_device(device), latency)
+
+    def write_short(self, status, data1=0, data2=0):
+        self.port.write_short(status, data1, data2)
+
+    def write(self, batch):
+        self.port.write(batch)
+
+    def close(self):
+        self.port.close()
+        self.midi.quit()
+
+
+class DirectBackend(MIDIBackend):
+    """
+    PortMidi stream without the pygame.midi wrapper.
+
+    Binds the pypm WriteShort/Write methods directly, which skips the per-call
+    checks and argument shuffling of pygame.midi.Output.
+    """
+    name = 'direct'
+
+    def __init__(self, device=None, latency=0):
+        import pygame.midi
+        import pygame.pypm
+        self.midi = pygame.midi
+        pygame.midi.init()
+        if device is None:
+            device = _default_output_id()
+        self.port = pygame.pypm.Output(find_output_device(device), latency)
+        # the bound port methods shadow the forwarding methods below on the hot path
+        self.write_short = self.port.WriteShort
+        self.write = self.port.Write
+
+    def write_short(self, status, data1=0, data2=0):
+        self.port.WriteShort(status, data1, data2)
+
+    def write(self, batch):
+        self.port.Write(batch)
+
+    def close(self):
+        del self.write_short
+        del self.write
+        self.port.Close()
+        self.midi.quit()
+
+
+BACKENDS = {backend.name: backend for backend in (PygameBackend, DirectBackend, NullBackend, RecordingBackend)}
+
+
+def create_backend(name='pygame', device=None, **kwargs) -> MIDIBackend:
+    """ backend factory, device is an output id or (part of) its name, None for the default output """
+    if name not in BACKENDS:
+        raise ValueError(f"unknown MIDI backend {name}, choose from {', '.join(BACKENDS)}")
+    backend = BACKENDS[name]
+    if backend in (NullBackend, RecordingBackend):
+        return backend()
+    return backend(device, **kwargs)
+
+
+def _default_output_id():
+    import pygame.midi
+    pygame.midi.init()
+    device = pygame.midi.get_default_output_id()
+    if device < 0:
+        raise ValueError("no MIDI output device available")
+    return device
+
+
+def find_output_device(device) -> int:
+    """ resolve an output id, numeric string or case-insensitive name fragment to an output id """
+    if isinstance(device, int):
+        return device
+    if str(device).isdigit():
+        return int(device)
+    import pygame.midi
+    pygame.midi.init()
+    for i in range(pygame.midi.get_count()):
+        interface, name, is_input, is_output, opened = pygame.midi.get_device_info(i)
+        if is_output and str(device).lower() in name.decode('utf-8').lower():
+            return i
+    raise ValueError(f"no MIDI output device matching {device}")
+
+
+def prompt_output_device() -> int:
+    """ ask for the output id on the console """
+    print("Verfügbare MIDI-Geräte:")
+    for i, name in list_midi_devices():
+        print(f"{i}: {name}")
+    return int(input("Geben Sie die ID des gewünschten MIDI-Outputs ein: "))
+
+
+def list_midi_devices():
+    import pygame.midi
+    pygame.midi.init()
+    devices = []
+    for i in range(pygame.midi.get_count()):
+        device_info = pygame.midi.get_device_info(i)
+        device_name = device_info[1].decode('utf-8')
+        devices.append((i, device_name))
+    pygame.midi.quit()
+    return devices
@@ -0,0 +1,158 @@
+import argparse
+import time
+import numpy as np
+from clock import ClockSync
+from data import SensorDataDecoder, TIMED_PACKET_DTYPE
+from processing import Dimension, Event3, EventType
+from recorder import load_session
+
+EVENT_TABLE_DTYPE = np.dtype([('index', '<i8'),  # sample index in the derivative signal
+                              ('time', '<f8'),
+                              ('value', '<f8'),
+                              ('type', '<i4'),  # position in EVENT_TYPES
+                              ('dimension', '<i4')])  # position in DIMENSIONS
+EVENT_TYPES = list(EventType)
+DIMENSIONS = list(Dimension)
+
+
+def derivative(values: np.ndarray, t: np.ndarray, absolute=False):
+    """
+    Whole-array equivalent of Derivation3.
+
+    Samples whose timestamp is not newer than all previous ones are dropped,
+    like Derivation3.append does online.
+
+    Args:
+        values (np.ndarray): (N, 3) signal.
+        t (np.ndarray): (N,) timestamps.
+        absolute (bool): Derive the absolute values.
+
+    Returns:
+        (np.ndarray, np.ndarray): (M, 3) derivative and its (M,) timestamps.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    t = np.asarray(t, dtype=np.float64)
+    if len(t) == 0:
+        return np.empty((0, 3)), np.empty(0)
+    keep = np.empty(len(t), dtype=bool)
+    keep[0] = True
+    keep[1:] = t[1:] > np.maximum.accumulate(t)[:-1]
+    values = values[keep]
+    t = t[keep]
+    if absolute:
+        values = np.abs(values)
+    return np.diff(values, axis=0) / np.diff(t)[:, None], t[1:]
+
+
+def detect_events(signal: np.ndarray, t: np.ndarray, cooldown=10, threshold_pos=50, threshold_neg=-50):
+    """
+    Whole-array equivalent of EventProcessor3 analyzing every sample online.
+
+    Every peak is reported once at its own sample index (online it is reported again
+    while it is younger than window_length samples), so the table contains the
+    distinct (index, type, dimension) events of the online detector.
+
+    Args:
+        signal (np.ndarray): (N, 3) signal, e.g. the gyro derivative.
+        t (np.ndarray): (N,) timestamps.
+
+    Returns:
+        np.ndarray: Event table of dtype EVENT_TABLE_DTYPE, sorted by index.
+    """
+    signal = np.asarray(signal, dtype=np.float64)
+    t = np.asarray(t, dtype=np.float64)
+    windows = np.lib.stride_tricks.sliding_window_view
+    padding = ((cooldown - 1, 0), (0, 0))
+    # a peak is the maximum (minimum) of the last cooldown samples, the newest one on ties
+    running_max = windows(np.pad(signal, padding, constant_values=-np.inf), cooldown, axis=0).max(axis=-1)
+    running_min = windows(np.pad(signal, padding, constant_values=np.inf), cooldown, axis=0).min(axis=-1)
+    peak_pos = (signal > threshold_pos) & (signal >= running_max)
+    peak_neg = (signal < threshold_neg) & (signal <= running_min) & ~peak_pos
+
+    last = signal[:-1]
+    value = signal[1:]
+    rise = np.zeros_like(peak_pos)
+    fall = np.zeros_like(peak_neg)
+    rise[1:] = (last <= threshold_pos) & (threshold_pos < value)
+    fall[1:] = ~rise[1:] & (last >= threshold_neg) & (threshold_neg > value)
+
+    tables = []
+    for mask, event_type in ((peak_pos, EventType.THRESHOLD_POS), (peak_neg, EventType.THRESHOLD_NEG),
+                             (rise, EventType.EDGE_RISE), (fall, EventType.EDGE_FALL)):
+        index, dimension = np.nonzero(mask)
+        table = np.empty(len(index), dtype=EVENT_TABLE_DTYPE)
+        table['index'] = index
+        table['time'] = t[index]
+        table['value'] = signal[index, dimension]
+        table['type'] = EVENT_TYPES.index(event_type)
+        table['dimension'] = dimension
+        tables.append(table)
+    table = np.concatenate(tables)
+    return table[np.lexsort((table['type'], table['dimension'], table['index']))]
+
+
+def clock_sync_times(timestamps, device_times, window=10.0) -> np.ndarray:
+    """
+    Sample times of the 44 byte protocol as the Receiver computes them online:
+    the device clock (uint32 microseconds) mapped onto the receive timestamps with ClockSync.
+    """
+    clock = ClockSync(window)
+    update = clock.update
+    return np.array([update(t, device_time * 1e-6)
+                     for t, device_time in zip(np.asarray(timestamps, dtype=np.float64).tolist(),
+                                               np.asarray(device_times).tolist())], dtype=np.float64)
+
+
+def analyze_session(path, cooldown=10, threshold_pos=50, threshold_neg=-50, device_clock=False):
+    """
+    Gyro derivative events of a recorded session, see detect_events.
+
+    The time base is the one the Receiver uses online: receive timestamps for 36 and
+    18 byte packets, ClockSync-mapped device times for 44 byte packets. device_clock
+    uses the raw device clock instead (44 byte packets only).
+    """
+    buffer, timestamps, packet_size = load_session(path)
+    frames = SensorDataDecoder.decode_batch(buffer, timestamps, packet_size, device_clock=device_clock)
+    if packet_size == 44 and not device_clock:
+        frames['time'] = clock_sync_times(timestamps, np.frombuffer(buffer, TIMED_PACKET_DTYPE)['device_time'])
+    signal, t = derivative(frames['gyro'], frames['time'])
+    return detect_events(signal, t, cooldown, threshold_pos, threshold_neg)
+
+
+def to_events(table: np.ndarray) -> [Event3]:
+    """ Event3 objects of an event table, e.g. to feed Player.event_triggered """
+    return [Event3(row['time'], 0, row['value'], EVENT_TYPES[row['type']], DIMENSIONS[row['dimension']],
+                   int(row['index']))
+            for row in table]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline event detection on a recorded session")
+    parser.add_argument("session", help="session log written with main.py --record")
+    parser.add_argument("--cooldown", type=int, default=10)
+    parser.add_argument("--threshold-pos", type=float, default=50)
+    parser.add_argument("--threshold-neg", type=float, default=-50)
+    parser.add_argument("--device-clock", action="store_true",
+                        help="use the device clock of the 44 byte protocol as time base")
+    parser.add_argument("--output", metavar="PATH", help="write the event table as csv")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    start = time.perf_counter()
+    table = analyze_session(args.session, args.cooldown, args.threshold_pos, args.threshold_neg,
+                            args.device_clock)
+    elapsed = time.perf_counter() - start
+    print(f"{len(table)} events in {elapsed * 1000:.1f} ms")
+    for i, event_type in enumerate(EVENT_TYPES):
+        counts = [int(np.count_nonzero((table['type'] == i) & (table['dimension'] == d)))
+                  for d in range(len(DIMENSIONS))]
+        print(f"  {event_type.name:<14} x {counts[0]:>7}  y {counts[1]:>7}  z {counts[2]:>7}")
+    if args.output:
+        np.savetxt(args.output, table, fmt=['%d', '%.6f', '%.6f', '%d', '%d'], delimiter=',',
+                   header=','.join(EVENT_TABLE_DTYPE.names), comments='')
+
+
+if __name__ == "__main__":
+    main()
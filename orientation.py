@@ -0,0 +1,225 @@
+import math
+from typing import Optional
+import numpy as np
+from data import Vec3
+
+DEG_TO_RAD = math.pi / 180.0
+RAD_TO_DEG = 180.0 / math.pi
+
+
+class OrientationEngine:
+    """
+    Madgwick MARG filter fusing gyro, accelerometer and magnetometer into a quaternion.
+
+    update() is the streaming O(1) step for one sample, batch() runs a whole recorded
+    session from NumPy arrays. Without a magnetometer (mag None) the filter runs as IMU
+    only, the yaw then just integrates the gyro. The 36 and 44 byte protocols send the
+    rot field as angles in degrees, so it is only a magnetometer source (magnetometer=True)
+    for firmware streaming the raw field there.
+    beta weights the acc/mag correction against the gyro integration: larger values
+    converge faster but pass more magnetic noise.
+    """
+
+    def __init__(self, beta=0.1, gyro_scale=DEG_TO_RAD, sample_period=0.01, max_period=0.1, magnetometer=False):
+        self.beta = beta
+        # the caller feeds the rot field of SensorData as magnetometer, see class docstring
+        self.magnetometer = magnetometer
+        self.gyro_scale = gyro_scale  # gyro unit -> rad/s, default for deg/s
+        self.sample_period = sample_period  # used for the first sample and invalid timestamps
+        self.max_period = max_period
+        self.q = [1.0, 0.0, 0.0, 0.0]
+        self.last_time = None
+
+    def reset(self):
+        self.q = [1.0, 0.0, 0.0, 0.0]
+        self.last_time = None
+
+    def update(self, gyro: Vec3, acc: Vec3, mag: Optional[Vec3], t: float):
+        dt = self.sample_period
+        if self.last_time is not None:
+            dt = t - self.last_time
+            if dt <= 0.0 or dt > self.max_period:
+                dt = self.sample_period
+        self.last_time = t
+        s = self.gyro_scale
+        if mag is None:
+            self.q = madgwick_step(self.q, gyro.x * s, gyro.y * s, gyro.z * s,
+                                   acc.x, acc.y, acc.z, 0.0, 0.0, 0.0, dt, self.beta)
+        else:
+            self.q = madgwick_step(self.q, gyro.x * s, gyro.y * s, gyro.z * s,
+                                   acc.x, acc.y, acc.z, mag.x, mag.y, mag.z, dt, self.beta)
+        return self.q
+
+    def batch(self, gyro, acc, mag, t) -> np.ndarray:
+        """
+        Run the filter over whole arrays, continuing from the current state.
+
+        Args:
+            gyro, acc, mag (np.array): Arrays of shape (N, 3), mag None for IMU only.
+            t (np.array): Timestamps of shape (N,).
+
+        Returns:
+            np.array: Quaternions (w, x, y, z) of shape (N, 4).
+        """
+        t = np.asarray(t, dtype=np.float64)
+        # everything that doesn't depend on the filter state is done vectorized up front
+        gyro = np.asarray(gyro, dtype=np.float64) * self.gyro_scale
+        acc = _normalized(np.asarray(acc, dtype=np.float64))
+        if mag is None:
+            mag = np.zeros_like(acc)
+        else:
+            mag = _normalized(np.asarray(mag, dtype=np.float64))
+        dt = np.empty_like(t)
+        dt[0] = t[0] - self.last_time if self.last_time is not None else self.sample_period
+        dt[1:] = np.diff(t)
+        dt[(dt <= 0.0) | (dt > self.max_period)] = self.sample_period
+
+        quaternions = np.empty((len(t), 4))
+        q = self.q
+        beta = self.beta
+        for i, (g, a, m, step) in enumerate(zip(gyro.tolist(), acc.tolist(), mag.tolist(), dt.tolist())):
+            q = madgwick_step(q, g[0], g[1], g[2], a[0], a[1], a[2], m[0], m[1], m[2], step, beta)
+            quaternions[i] = q
+        self.q = q
+        if len(t):
+            self.last_time = float(t[-1])
+        return quaternions
+
+    def euler(self) -> Vec3:
+        """ roll (x), pitch (y), yaw (z) in degrees """
+        return Vec3(*quaternion_to_euler(self.q))
+
+    def rotation_matrix(self) -> np.ndarray:
+        return quaternion_to_matrix(self.q)
+
+
+def _normalized(v):
+    norm = np.linalg.norm(v, axis=1, keepdims=True)
+    norm[norm == 0.0] = 1.0
+    return v / norm
+
+
+def madgwick_step(q, gx, gy, gz, ax, ay, az, mx, my, mz, dt, beta):
+    """
+    one Madgwick MARG update, gyro in rad/s, acc and mag in any (consistent) unit.
+    A zero mag vector falls back to the IMU (acc + gyro) update like the reference implementation.
+    """
+    q0, q1, q2, q3 = q
+
+    # rate of change of quaternion from gyroscope
+    qdot0 = 0.5 * (-q1 * gx - q2 * gy - q3 * gz)
+    qdot1 = 0.5 * (q0 * gx + q2 * gz - q3 * gy)
+    qdot2 = 0.5 * (q0 * gy - q1 * gz + q3 * gx)
+    qdot3 = 0.5 * (q0 * gz + q1 * gy - q2 * gx)
+
+    a_norm = math.sqrt(ax * ax + ay * ay + az * az)
+    if a_norm > 0.0:
+        ax /= a_norm
+        ay /= a_norm
+        az /= a_norm
+        m_norm = math.sqrt(mx * mx + my * my + mz * mz)
+        if m_norm > 0.0:
+            mx /= m_norm
+            my /= m_norm
+            mz /= m_norm
+
+            _2q0mx = 2.0 * q0 * mx
+            _2q0my = 2.0 * q0 * my
+            _2q0mz = 2.0 * q0 * mz
+            _2q1mx = 2.0 * q1 * mx
+            _2q0 = 2.0 * q0
+            _2q1 = 2.0 * q1
+            _2q2 = 2.0 * q2
+            _2q3 = 2.0 * q3
+            _2q0q2 = 2.0 * q0 * q2
+            _2q2q3 = 2.0 * q2 * q3
+            q0q0 = q0 * q0
+            q0q1 = q0 * q1
+            q0q2 = q0 * q2
+            q0q3 = q0 * q3
+            q1q1 = q1 * q1
+            q1q2 = q1 * q2
+            q1q3 = q1 * q3
+            q2q2 = q2 * q2
+            q2q3 = q2 * q3
+            q3q3 = q3 * q3
+
+            # reference direction of earth's magnetic field
+            hx = mx * q0q0 - _2q0my * q3 + _2q0mz * q2 + mx * q1q1 + _2q1 * my * q2 + _2q1 * mz * q3 - mx * q2q2 - mx * q3q3
+            hy = _2q0mx * q3 + my * q0q0 - _2q0mz * q1 + _2q1mx * q2 - my * q1q1 + my * q2q2 + _2q2 * mz * q3 - my * q3q3
+            _2bx = math.sqrt(hx * hx + hy * hy)
+            _2bz = -_2q0mx * q2 + _2q0my * q1 + mz * q0q0 + _2q1mx * q3 - mz * q1q1 + _2q2 * my * q3 - mz * q2q2 + mz * q3q3
+            _4bx = 2.0 * _2bx
+            _4bz = 2.0 * _2bz
+
+            # gradient descent corrective step
+            s0 = (-_2q2 * (2.0 * q1q3 - _2q0q2 - ax) + _2q1 * (2.0 * q0q1 + _2q2q3 - ay)
+                  - _2bz * q2 * (_2bx * (0.5 - q2q2 - q3q3) + _2bz * (q1q3 - q0q2) - mx)
+                  + (-_2bx * q3 + _2bz * q1) * (_2bx * (q1q2 - q0q3) + _2bz * (q0q1 + q2q3) - my)
+                  + _2bx * q2 * (_2bx * (q0q2 + q1q3) + _2bz * (0.5 - q1q1 - q2q2) - mz))
+            s1 = (_2q3 * (2.0 * q1q3 - _2q0q2 - ax) + _2q0 * (2.0 * q0q1 + _2q2q3 - ay)
+                  - 4.0 * q1 * (1 - 2.0 * q1q1 - 2.0 * q2q2 - az)
+                  + _2bz * q3 * (_2bx * (0.5 - q2q2 - q3q3) + _2bz * (q1q3 - q0q2) - mx)
+                  + (_2bx * q2 + _2bz * q0) * (_2bx * (q1q2 - q0q3) + _2bz * (q0q1 + q2q3) - my)
+                  + (_2bx * q3 - _4bz * q1) * (_2bx * (q0q2 + q1q3) + _2bz * (0.5 - q1q1 - q2q2) - mz))
+            s2 = (-_2q0 * (2.0 * q1q3 - _2q0q2 - ax) + _2q3 * (2.0 * q0q1 + _2q2q3 - ay)
+                  - 4.0 * q2 * (1 - 2.0 * q1q1 - 2.0 * q2q2 - az)
+                  + (-_4bx * q2 - _2bz * q0) * (_2bx * (0.5 - q2q2 - q3q3) + _2bz * (q1q3 - q0q2) - mx)
+                  + (_2bx * q1 + _2bz * q3) * (_2bx * (q1q2 - q0q3) + _2bz * (q0q1 + q2q3) - my)
+                  + (_2bx * q0 - _4bz * q2) * (_2bx * (q0q2 + q1q3) + _2bz * (0.5 - q1q1 - q2q2) - mz))
+            s3 = (_2q1 * (2.0 * q1q3 - _2q0q2 - ax) + _2q2 * (2.0 * q0q1 + _2q2q3 - ay)
+                  + (-_4bx * q3 + _2bz * q1) * (_2bx * (0.5 - q2q2 - q3q3) + _2bz * (q1q3 - q0q2) - mx)
+                  + (-_2bx * q0 + _2bz * q2) * (_2bx * (q1q2 - q0q3) + _2bz * (q0q1 + q2q3) - my)
+                  + _2bx * q1 * (_2bx * (q0q2 + q1q3) + _2bz * (0.5 - q1q1 - q2q2) - mz))
+        else:
+            # no magnetometer: IMU gradient from gravity alone, yaw only follows the gyro
+            _2q0 = 2.0 * q0
+            _2q1 = 2.0 * q1
+            _2q2 = 2.0 * q2
+            _2q3 = 2.0 * q3
+            _4q0 = 4.0 * q0
+            _4q1 = 4.0 * q1
+            _4q2 = 4.0 * q2
+            _8q1 = 8.0 * q1
+            _8q2 = 8.0 * q2
+            q0q0 = q0 * q0
+            q1q1 = q1 * q1
+            q2q2 = q2 * q2
+            q3q3 = q3 * q3
+            s0 = _4q0 * q2q2 + _2q2 * ax + _4q0 * q1q1 - _2q1 * ay
+            s1 = (_4q1 * q3q3 - _2q3 * ax + 4.0 * q0q0 * q1 - _2q0 * ay - _4q1
+                  + _8q1 * q1q1 + _8q1 * q2q2 + _4q1 * az)
+            s2 = (4.0 * q0q0 * q2 + _2q0 * ax + _4q2 * q3q3 - _2q3 * ay - _4q2
+                  + _8q2 * q1q1 + _8q2 * q2q2 + _4q2 * az)
+            s3 = 4.0 * q1q1 * q3 - _2q1 * ax + 4.0 * q2q2 * q3 - _2q2 * ay
+        s_norm = math.sqrt(s0 * s0 + s1 * s1 + s2 * s2 + s3 * s3)
+        if s_norm > 0.0:
+            s_norm = beta / s_norm
+            qdot0 -= s_norm * s0
+            qdot1 -= s_norm * s1
+            qdot2 -= s_norm * s2
+            qdot3 -= s_norm * s3
+
+    # integrate and normalise
+    q0 += qdot0 * dt
+    q1 += qdot1 * dt
+    q2 += qdot2 * dt
+    q3 += qdot3 * dt
+    norm = 1.0 / math.sqrt(q0 * q0 + q1 * q1 + q2 * q2 + q3 * q3)
+    return [q0 * norm, q1 * norm, q2 * norm, q3 * norm]
+
+
+def quaternion_to_euler(q):
+    """ roll, pitch, yaw in degrees """
+    q0, q1, q2, q3 = q
+    roll = math.atan2(2.0 * (q0 * q1 + q2 * q3), 1.0 - 2.0 * (q1 * q1 + q2 * q2))
+    pitch = math.asin(max(-1.0, min(1.0, 2.0 * (q0 * q2 - q3 * q1))))
+    yaw = math.atan2(2.0 * (q0 * q3 + q1 * q2), 1.0 - 2.0 * (q2 * q2 + q3 * q3))
+    return roll * RAD_TO_DEG, pitch * RAD_TO_DEG, yaw * RAD_TO_DEG
+
+
+def quaternion_to_matrix(q) -> np.ndarray:
+    q0, q1, q2, q3 = q
+    return np.array([[1 - 2 * (q2 * q2 + q3 * q3), 2 * (q1 * q2 - q0 * q3), 2 * (q1 * q3 + q0 * q2)],
+                     [2 * (q1 * q2 + q0 * q3), 1 - 2 * (q1 * q1 + q3 * q3), 2 * (q2 * q3 - q0 * q1)],
+                     [2 * (q1 * q3 - q0 * q2), 2 * (q2 * q3 + q0 * q1), 1 - 2 * (q1 * q1 + q2 * q2)]])
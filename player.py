@@ -1,44 +1,126 @@
 from midi import MIDISender
 from data import SensorData
 from receiver import Receiver
+from dispatch import Priority
+from tracing import tracer, Stage
+import time
 from processing import Event3, EventType, Processor
+from onset import Onset, OnsetPhase
 
 class Player:
     data: SensorData
     midi: MIDISender
-    def __init__(self, midi: MIDISender):
+    def __init__(self, midi: MIDISender, controller=None, channel=0, orientation=None):
         self.midi = midi
+        self.channel = channel
+        # optional orientation.OrientationEngine, picks the note from the fused pitch angle
+        self.orientation = orientation
         self.data = None
         self.active_notes = {}
+        # optional controller.ContinuousController streaming CC/pitch bend on every frame
+        self.controller = controller
+        # gesture name -> notes played when gesture.GestureRecognizer reports it
+        self.gesture_actions = {}
+        self.gesture_notes = []
+        self.gesture_hold = 0.5  # seconds a gesture chord sounds
+        self.gesture_start = 0.0
+        # notes started by onset.OnsetDetector swings, by swing direction
+        self.onset_notes = {}
+        self.onset_counts = {}
+        self.aftertouch = False
 
     async def add_receiver(self, receiver: Receiver):
-        await receiver.add_callback(self.new_data)
+        await receiver.add_callback(self.new_data, Priority.CRITICAL)
+        receiver.add_disconnect_callback(self.link_lost)
+
+    def link_lost(self):
+        # the controller values are sent again from scratch after a reconnect
+        if self.controller is not None:
+            self.controller.reset()
 
     async def add_event_processor(self, processor: Processor):
-        await processor.add_callback(self.event_triggered)
+        await processor.add_callback(self.event_triggered, Priority.CRITICAL)
+
+    async def add_onset_detector(self, detector, aftertouch=False):
+        """ play on the rising slope instead of the threshold events, optionally with aftertouch at the peak """
+        self.aftertouch = aftertouch
+        await detector.add_callback(self.onset_triggered, Priority.CRITICAL)
+
+    async def onset_triggered(self, phase: OnsetPhase, onset: Onset):
+        start_ns = time.perf_counter_ns()
+        # same notes as event_triggered: negative swings play the scale note, positive ones two octaves lower
+        sign = onset.sign
+        if phase == OnsetPhase.START:
+            count = self.onset_counts.get(sign, 0)
+            if count == 0:
+                note = self.midi.c_scale[self.scale_index()]
+                if sign > 0:
+                    note -= 24
+                self.onset_notes[sign] = self.midi.start_note(note, onset.velocity, channel=self.channel)
+            self.onset_counts[sign] = count + 1
+        elif phase == OnsetPhase.PEAK:
+            if self.aftertouch and sign in self.onset_notes:
+                self.midi.poly_aftertouch(self.onset_notes[sign], onset.pressure, self.channel)
+        elif self.onset_counts.get(sign, 0) > 0:
+            self.onset_counts[sign] -= 1
+            if self.onset_counts[sign] == 0:
+                self.midi.stop_note(self.onset_notes.pop(sign), self.channel)
+        tracer.record(Stage.PLAYER, start_ns)
+
+    async def add_gesture_recognizer(self, recognizer, actions=None):
+        if actions:
+            self.gesture_actions.update(actions)
+        await recognizer.add_callback(self.gesture_recognized, Priority.CRITICAL)
+
+    async def gesture_recognized(self, name, distance):
+        notes = self.gesture_actions.get(name)
+        if not notes:
+            return
+        self.stop_gesture()
+        self.midi.start_notes(notes, channel=self.channel)
+        self.gesture_notes = list(notes)
+        self.gesture_start = self.data.time if self.data is not None else 0.0
+
+    def stop_gesture(self):
+        if self.gesture_notes:
+            self.midi.stop_notes(self.gesture_notes, self.channel)
+            self.gesture_notes = []
 
     async def event_triggered(self, events: [Event3]):
+        start_ns = time.perf_counter_ns()
         types=set()
         for e in events:
             types.add(e.type)
         for t in types:
             if t == EventType.THRESHOLD_NEG:
                 if t not in self.active_notes.keys():
-                    self.active_notes[EventType.THRESHOLD_NEG] = self.midi.start_note(self.midi.c_scale[
-                                             round((self.data.rot.y + 100) /
-                                                   200 * (len(self.midi.c_scale)-1))])
+                    self.active_notes[EventType.THRESHOLD_NEG] = self.midi.start_note(
+                        self.midi.c_scale[self.scale_index()], channel=self.channel)
             if t == EventType.THRESHOLD_POS:
                 if t not in self.active_notes.keys():
-                    self.active_notes[EventType.THRESHOLD_POS] = self.midi.start_note(self.midi.c_scale[
-                                             round((self.data.rot.y + 100) /
-                                                   200 * (len(self.midi.c_scale)-1))]-24)
+                    self.active_notes[EventType.THRESHOLD_POS] = self.midi.start_note(
+                        self.midi.c_scale[self.scale_index()]-24, channel=self.channel)
         stop_notes = []
         for k, v in self.active_notes.items():
             if k not in types:
                 stop_notes.append(k)
         for k in stop_notes:
-            self.midi.stop_note(self.active_notes[k])
+            self.midi.stop_note(self.active_notes[k], self.channel)
             self.active_notes.pop(k)
+        tracer.record(Stage.PLAYER, start_ns)
+
+    def scale_index(self):
+        """ position in c_scale from the saber orientation """
+        if self.orientation is not None:
+            # fused pitch angle -90..90 degrees
+            position = (self.orientation.euler().y + 90) / 180
+        else:
+            position = (self.data.rot.y + 100) / 200
+        return round(min(max(position, 0.0), 1.0) * (len(self.midi.c_scale)-1))
 
     async def new_data(self, data: SensorData):
-        self.data = data
\ No newline at end of file
+        self.data = data
+        if self.gesture_notes and data.time - self.gesture_start > self.gesture_hold:
+            self.stop_gesture()
+        if self.controller is not None:
+            self.controller.update(data)
@@ -1,64 +1,140 @@
 from data import SensorData, Vec3
+from dispatch import Dispatcher, Priority
+from tracing import tracer, Stage
+from collections import deque
 from enum import Enum
 from receiver import Receiver
 import time
+import numpy as np
 
 
 class Signal3:
-    x: [float]
-    y: [float]
-    z: [float]
-    t: [float]
+    """
+    Growing 3-axis signal with timestamps.
 
-    def __init__(self):
-        self.x = []
-        self.y = []
-        self.z = []
-        self.t = []
+    Samples are stored in a mirrored NumPy buffer (every sample is written twice,
+    capacity apart), so the x, y, z and t properties are always contiguous,
+    zero-copy views of the stored samples. Views are only valid until the next append.
+
+    Single samples are written and read through a flat memoryview of the buffer,
+    which takes and returns Python floats without creating NumPy scalars or tuples.
+    """
+
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.count = 0  # total number of appended samples
+        self._allocate()
+        self._start = 0
+        self._length = 0
+
+    def _allocate(self):
+        self._buffer = np.zeros((4, 2 * self.capacity))
+        # row r, column c is flat[r * stride + c]
+        self.flat = memoryview(self._buffer).cast('B').cast('d')
+        self.stride = 2 * self.capacity
+
+    def __len__(self):
+        return self._length
+
+    @property
+    def x(self) -> np.ndarray:
+        return self._buffer[0, self._start:self._start + self._length]
+
+    @property
+    def y(self) -> np.ndarray:
+        return self._buffer[1, self._start:self._start + self._length]
+
+    @property
+    def z(self) -> np.ndarray:
+        return self._buffer[2, self._start:self._start + self._length]
+
+    @property
+    def t(self) -> np.ndarray:
+        return self._buffer[3, self._start:self._start + self._length]
+
+    def view(self) -> np.ndarray:
+        """ (4, N) view with rows x, y, z, t """
+        return self._buffer[:, self._start:self._start + self._length]
+
+    def column(self, i) -> int:
+        """ position of sample i (0 is the oldest stored sample) in the rows of flat """
+        return self._start + i
 
     def append(self, data: Vec3, t: float):
-        self.x.append(data.x)
-        self.y.append(data.y)
-        self.z.append(data.z)
-        self.t.append(t)
+        self.append_values(data.x, data.y, data.z, t)
+
+    def append_values(self, x: float, y: float, z: float, t: float):
+        if self._length == self.capacity:
+            self._full()
+        position = self._start + self._length
+        if position >= self.capacity:
+            position -= self.capacity
+        self._length += 1
+        self._write(position, x, y, z, t)
+        self.count += 1
+
+    def _write(self, position, x, y, z, t):
+        flat = self.flat
+        stride = self.stride
+        mirror = position + self.capacity
+        flat[position] = flat[mirror] = x
+        position += stride
+        mirror += stride
+        flat[position] = flat[mirror] = y
+        position += stride
+        mirror += stride
+        flat[position] = flat[mirror] = z
+        position += stride
+        mirror += stride
+        flat[position] = flat[mirror] = t
+
+    def _full(self):
+        # unbounded signal: double the capacity, amortized O(1)
+        data = self.view().copy()
+        self.flat.release()
+        self.capacity *= 2
+        self._allocate()
+        self._buffer[:, :self._length] = data
+        self._buffer[:, self.capacity:self.capacity + self._length] = data
+        self._start = 0
 
 
 class History3(Signal3):
 
     def __init__(self, history_length=20):
-        super().__init__()
+        super().__init__(history_length)
         self.history_length = history_length
 
-    def append(self, data: Vec3, t: float):
-        super().append(data, t)
-        # limit data to not overload the RAM
-        self.x = self.x[-self.history_length:]
-        self.y = self.y[-self.history_length:]
-        self.z = self.z[-self.history_length:]
-        self.t = self.t[-self.history_length:]
+    def _full(self):
+        # limit data to not overload the RAM: overwrite the oldest sample
+        self._length -= 1
+        self._start += 1
+        if self._start == self.capacity:
+            self._start = 0
 
 
 class Derivation3(History3):
-    last_data: Vec3
 
     def __init__(self, history_length=20, absolute=False):
         super().__init__(history_length)
         self.absolute = absolute
         self.last_update = None
+        self.last_x = 0.0
+        self.last_y = 0.0
+        self.last_z = 0.0
 
-    def abs(self, data: float):
+    def append_values(self, x: float, y: float, z: float, t: float):
         if self.absolute:
-            return abs(data)
-        else:
-            return data
-
-    def append(self, data: Vec3, t: float):
-        derive = False
+            x, y, z = abs(x), abs(y), abs(z)
         if self.last_update is not None:
-            super().append(Vec3((self.abs(data.x) - self.abs(self.last_data.x)) / (t - self.last_update),
-                                (self.abs(data.y) - self.abs(self.last_data.y)) / (t - self.last_update),
-                                (self.abs(data.z) - self.abs(self.last_data.z)) / (t - self.last_update)), t)
-        self.last_data = data
+            dt = t - self.last_update
+            if dt <= 0:
+                # same or older timestamp, no valid derivative: drop the sample
+                return
+            super().append_values((x - self.last_x) / dt, (y - self.last_y) / dt, (z - self.last_z) / dt, t)
+        self.last_x = x
+        self.last_y = y
+        self.last_z = z
         self.last_update = t
 
 
@@ -75,10 +151,14 @@ class SensorHistory:
         self.gyro_derivation = Derivation3(history_length)
 
     def append(self, data: SensorData):
-        self.rot.append(data.rot, data.time)
-        self.acc.append(data.acc, data.time)
-        self.gyro.append(data.gyro, data.time)
-        self.gyro_derivation.append(data.gyro, data.time)
+        t = data.time
+        rot = data.rot
+        acc = data.acc
+        gyro = data.gyro
+        self.rot.append_values(rot.x, rot.y, rot.z, t)
+        self.acc.append_values(acc.x, acc.y, acc.z, t)
+        self.gyro.append_values(gyro.x, gyro.y, gyro.z, t)
+        self.gyro_derivation.append_values(gyro.x, gyro.y, gyro.z, t)
 
 
 class EventType(Enum):
@@ -106,18 +186,56 @@ class Event:
 
 
 class Event3:
+    __slots__ = ('position', 'window_index', 'value', 'type', 'dimension', 'index')
     type: EventType
     dimension: Dimension
 
-    def __init__(self, position, window_index, value, type: EventType, dimension: Dimension):
+    def __init__(self, position, window_index, value, type: EventType, dimension: Dimension, index=None):
         self.position = position
         self.window_index = window_index
         self.value = value
         self.type = type
         self.dimension = dimension
+        # running sample index of the signal the event was detected in
+        self.index = index
+
+    def copy(self) -> 'Event3':
+        return Event3(self.position, self.window_index, self.value, self.type, self.dimension, self.index)
+
+
+class AxisState:
+    """
+    Streaming detector state of one axis.
+
+    The running max/min of the last cooldown samples are kept in monotonic deques
+    (indices and values in parallel deques, so no tuple is allocated per sample),
+    so each sample is handled in amortized O(1).
+    """
+
+    def __init__(self, dimension: Dimension):
+        self.dimension = dimension
+        self.max_index = deque()
+        self.max_value = deque()  # decreasing
+        self.min_index = deque()
+        self.min_value = deque()  # increasing
+        # latest positive/negative peak, reported through the reused Event3 objects
+        self.peak_pos = None  # sample index of the peak
+        self.peak_neg = None
+        self.event_pos = Event3(0.0, 0, 0.0, EventType.THRESHOLD_POS, dimension)
+        self.event_neg = Event3(0.0, 0, 0.0, EventType.THRESHOLD_NEG, dimension)
+        self.last_value = None
 
 
 class EventProcessor3:
+    """
+    Incremental threshold and edge detector on a Signal3.
+
+    A sample above threshold_pos that is the maximum of the last cooldown samples is a
+    positive peak (negative peaks accordingly). A peak is reported as THRESHOLD_POS/NEG
+    event while it is younger than window_length samples. Crossing threshold_pos upwards
+    (threshold_neg downwards) emits a one-shot EDGE_RISE (EDGE_FALL) event.
+    Only samples appended since the last call to analyze are looked at.
+    """
 
     def __init__(self, signal: Signal3, window_length=5, cooldown=10,
                  threshold_pos=50, threshold_neg=-50):
@@ -126,57 +244,166 @@ class EventProcessor3:
         self.cooldown = cooldown
         self.threshold_pos = threshold_pos
         self.threshold_neg = threshold_neg
+        self.axes = [AxisState(Dimension.X), AxisState(Dimension.Y), AxisState(Dimension.Z)]
+        self.processed = 0  # number of signal samples already analyzed
+        self.edges = []
+        self.active = []  # returned by events(), reused
 
     def analyze(self):
-        events = []
-        max_threshold_pos = 0
-        min_threshold_neg = 0
-        for (signal, dimension) in [(self.signal.x, Dimension.X),
-                                    (self.signal.y, Dimension.Y),
-                                    (self.signal.z, Dimension.Z)]:
-            for index, val in enumerate(signal[-self.cooldown:]):
-                if val > self.threshold_pos:
-                    events.append(Event3(self.signal.t[index-self.cooldown+len(signal)], index,
-                                         val, EventType.THRESHOLD_POS, dimension))
-                    if val > max_threshold_pos:
-                        max_threshold_pos = val
-                elif val < self.threshold_neg:
-                    events.append(Event3(self.signal.t[index-self.cooldown+len(signal)], index,
-                                         val, EventType.THRESHOLD_NEG, dimension))
-                    if val < min_threshold_neg:
-                        min_threshold_neg = val
-
-            for e in events:
-                if e.window_index < self.cooldown - self.window_length:
-                    events.remove(e)
-                elif e.value < max_threshold_pos and e.type == EventType.THRESHOLD_POS:
-                    events.remove(e)
-                elif e.value > min_threshold_neg and e.type == EventType.THRESHOLD_NEG:
-                    events.remove(e)
-
+        signal = self.signal
+        new_samples = min(signal.count - self.processed, len(signal))
+        self.edges.clear()
+        if new_samples > 0:
+            flat = signal.flat
+            stride = signal.stride
+            first = signal.column(len(signal) - new_samples)
+            # samples older than the signal length are lost, number from the oldest one still stored
+            first_index = signal.count - new_samples
+            for offset in range(new_samples):
+                column = first + offset
+                x = flat[column]
+                y = flat[column + stride]
+                z = flat[column + 2 * stride]
+                t = flat[column + 3 * stride]
+                index = first_index + offset
+                self._update_axis(self.axes[0], index, t, x)
+                self._update_axis(self.axes[1], index, t, y)
+                self._update_axis(self.axes[2], index, t, z)
+            self.processed = self.signal.count
+        return self.events()
+
+    def _update_axis(self, axis: AxisState, index, t, value):
+        expired = index - self.cooldown
+        max_index = axis.max_index
+        max_value = axis.max_value
+        while max_value and max_value[-1] <= value:
+            max_value.pop()
+            max_index.pop()
+        max_index.append(index)
+        max_value.append(value)
+        if max_index[0] <= expired:
+            max_index.popleft()
+            max_value.popleft()
+        min_index = axis.min_index
+        min_value = axis.min_value
+        while min_value and min_value[-1] >= value:
+            min_value.pop()
+            min_index.pop()
+        min_index.append(index)
+        min_value.append(value)
+        if min_index[0] <= expired:
+            min_index.popleft()
+            min_value.popleft()
+
+        if value > self.threshold_pos and max_index[0] == index:
+            axis.peak_pos = index
+            axis.event_pos.position = t
+            axis.event_pos.value = value
+            axis.event_pos.index = index
+        elif value < self.threshold_neg and min_index[0] == index:
+            axis.peak_neg = index
+            axis.event_neg.position = t
+            axis.event_neg.value = value
+            axis.event_neg.index = index
+
+        last_value = axis.last_value
+        if last_value is not None:
+            if last_value <= self.threshold_pos < value:
+                self.edges.append(Event3(t, self.cooldown - 1, value, EventType.EDGE_RISE,
+                                         axis.dimension, index))
+            elif last_value >= self.threshold_neg > value:
+                self.edges.append(Event3(t, self.cooldown - 1, value, EventType.EDGE_FALL,
+                                         axis.dimension, index))
+        axis.last_value = value
+
+    def events(self):
+        """
+        currently active threshold events plus edges of the last analyzed samples
+
+        The list and the threshold events (objects of the axis state) are reused,
+        they are updated in place by the next analyze.
+        """
+        events = self.active
+        events.clear()
+        newest = self.processed - 1
+        for axis in self.axes:
+            if axis.peak_pos is not None:
+                age = newest - axis.peak_pos
+                if age < self.window_length:
+                    axis.event_pos.window_index = self.cooldown - 1 - age
+                    events.append(axis.event_pos)
+            if axis.peak_neg is not None:
+                age = newest - axis.peak_neg
+                if age < self.window_length:
+                    axis.event_neg.window_index = self.cooldown - 1 - age
+                    events.append(axis.event_neg)
+        if self.edges:
+            events.extend(self.edges)
         return events
 
 
 class Processor:
-    def __init__(self):
+    def __init__(self, orientation=None, graph=None, detector=True):
         self.history = SensorHistory()
+        # optional orientation.OrientationEngine, updated with every sample
+        self.orientation = orientation
+        # optional dsp.SignalGraph, its detector events are dispatched with the
+        # events of the gyro derivative detector (or instead of them without detector)
+        self.graph = graph
+        self.detector = detector
         self.gyro_dev_processor = EventProcessor3(self.history.gyro_derivation)
-        self.callbacks = []
+        self.events = []  # reused event list without the detector
+        # the event lists and objects are reused, coalesced consumers get copies
+        self.callbacks = Dispatcher(snapshot=copy_events)
         self.old_nevents = 0
+        # gesture.GestureRecognizer instances matched against the history
+        self.recognizers = []
+        # onset.OnsetDetector instances fed with the history
+        self.onset_detectors = []
 
     async def add_receiver(self, receiver: Receiver):
-        await receiver.add_callback(self.new_data)
+        await receiver.add_callback(self.new_data, Priority.CRITICAL)
 
     async def new_data(self, data: SensorData):
+        start_ns = time.perf_counter_ns()
         self.history.append(data)
-        gyro_deriv_events = self.gyro_dev_processor.analyze()
+        tracer.record(Stage.HISTORY, start_ns)
+        if self.orientation is not None:
+            mag = data.rot if self.orientation.magnetometer else None
+            self.orientation.update(data.gyro, data.acc, mag, data.time)
+        start_ns = time.perf_counter_ns()
+        if self.detector:
+            gyro_deriv_events = self.gyro_dev_processor.analyze()
+        else:
+            gyro_deriv_events = self.events
+            gyro_deriv_events.clear()
+        if self.graph is not None:
+            self.graph.step(data)
+            gyro_deriv_events.extend(self.graph.events())
+        tracer.record(Stage.ANALYZE, start_ns)
+        # onsets arm below the detector threshold, a START of this sample goes out before its events
+        for onset_detector in self.onset_detectors:
+            await onset_detector.update(self.history)
         if len(gyro_deriv_events) > 0 or self.old_nevents > len(gyro_deriv_events):
-            for cb in self.callbacks:
-                await cb(gyro_deriv_events)
+            await self.callbacks.dispatch(gyro_deriv_events)
         self.old_nevents = len(gyro_deriv_events)
+        for recognizer in self.recognizers:
+            await recognizer.update(self.history)
+
+    def add_gesture_recognizer(self, recognizer):
+        if recognizer.length > self.history.gyro.capacity:
+            raise ValueError("gesture length exceeds the history length")
+        self.recognizers.append(recognizer)
 
-    async def add_callback(self, callback):
-        self.callbacks.append(callback)
+    def add_onset_detector(self, onset_detector):
+        self.onset_detectors.append(onset_detector)
+
+    async def add_callback(self, callback, priority=Priority.NORMAL):
+        self.callbacks.add(callback, priority)
 
     async def remove_callback(self, callback):
-        self.callbacks.remove(callback)
\ No newline at end of file
+        self.callbacks.remove(callback)
+
+
+def copy_events(events: [Event3]):
+    return ([event.copy() for event in events],)
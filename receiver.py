@@ -1,16 +1,131 @@
 from bleak import BleakClient, BleakScanner
-from data import SensorDataDecoder
+from data import FramePool, SensorDataDecoder
+from clock import ClockSync, JitterBuffer, SequenceTracker
+from dispatch import Dispatcher, Priority
+from tracing import tracer, Stage
+import asyncio
+import json
+import os
 import time
+from importlib.metadata import PackageNotFoundError, version
+import numpy as np
+
+DEVICE_MAC_ADDRESS = "A0:A3:B3:97:7C:D6"
+SERVICE_UUID = "4fafc201-1fb5-459e-8fcc-c5c9c331914b"
+CHARACTERISTIC_UUID = "e68da052-33c2-4814-8793-60112fe6570a"
+# bleak versions whose BlueZ backend has the private _acquire_mtu (checked up to 3.0)
+ACQUIRE_MTU_VERSIONS = ((0, 19), (4, 0))
+DEVICE_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".musicsaber_devices.json")
+
+
+class DeviceStats:
+    """ packet rate and handling latency of one device, latencies kept in a fixed ring """
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.latencies = [0] * capacity
+        self.packets = 0
+        self.first = None
+        self.last = None
+
+    def record(self, t: float, latency_ns: int):
+        if self.first is None:
+            self.first = t
+        self.last = t
+        self.latencies[self.packets % self.capacity] = latency_ns
+        self.packets += 1
+
+    def summary(self):
+        latencies = np.array(self.latencies[:min(self.packets, self.capacity)], dtype=np.float64) / 1000.0
+        duration = (self.last - self.first) if self.packets > 1 else 0.0
+        return {'packets': self.packets,
+                'packets_per_second': (self.packets - 1) / duration if duration > 0 else 0.0,
+                'p50_us': float(np.percentile(latencies, 50)) if latencies.size else 0.0,
+                'p99_us': float(np.percentile(latencies, 99)) if latencies.size else 0.0,
+                'max_us': float(latencies.max()) if latencies.size else 0.0}
+
+
+class DeviceCache:
+    """ addresses of sabers connected before, most recent first, stored as json """
+
+    def __init__(self, path=DEVICE_CACHE_PATH):
+        self.path = path
+        self.addresses = []
+        try:
+            with open(path) as file:
+                self.addresses = [str(address) for address in json.load(file)]
+        except (OSError, ValueError, TypeError):
+            pass
+
+    def add(self, address):
+        if self.addresses[:1] == [address]:
+            return
+        if address in self.addresses:
+            self.addresses.remove(address)
+        self.addresses.insert(0, address)
+        try:
+            with open(self.path, 'w') as file:
+                json.dump(self.addresses, file)
+        except OSError as error:
+            print("Could not store the device cache:", error)
+
 
 class Receiver:
-    def __init__(self):
+    def __init__(self, device_address=None, name=None, client_class=BleakClient, scanner=BleakScanner):
         self.client = None
         self.connected = False
-        self.callbacks = []
+        self.device_address = device_address
+        self.name = name or device_address
+        self.callbacks = Dispatcher()
+        self.recorder = None
+        self.stats = DeviceStats()
+        # used when the device sends sequence number and clock (44 byte protocol)
+        self.sequence = SequenceTracker()
+        self.clock = ClockSync()
+        self.jitter_buffer = None
+        # frames are decoded into reused objects, consumers must not keep them
+        self.frames = FramePool()
+        # BLE client and scanner, replaceable by a stand-in (see ble_sim)
+        self.client_class = client_class
+        self.scanner = scanner
+        self.service_uuid = None
+        self.characteristic_uuid = None
+        # automatic reconnect after link loss, see keep_connected
+        self.reconnect = False
+        self.reconnect_task = None
+        self.disconnected_at = None
+        # called without arguments on link loss and on disconnect()
+        self.disconnect_callbacks = []
+        self.downtimes = []  # seconds from link loss until notifications run again
+
+    async def find_device(self, service_uuid, cache: DeviceCache = None, timeout=5.0, exclude=()):
+        """
+        Scan until a known device (own address or cached) or any device advertising
+        service_uuid shows up, without user interaction.
 
-    def __del__(self):
-        print("receiver destroyed")
-        self.disconnect()
+        Returns the found device (None after timeout) and keeps its address. The caller
+        adds the address to the cache once the connection succeeded.
+        """
+        known = set(cache.addresses) if cache is not None else set()
+        if self.device_address:
+            known.add(self.device_address)
+        service_uuid = service_uuid.lower()
+
+        def match(device, advertisement):
+            if device.address in exclude:
+                return False
+            return device.address in known or any(uuid.lower() == service_uuid
+                                                  for uuid in advertisement.service_uuids)
+
+        print(f"Scanning for a saber ({timeout:.0f}s)...")
+        device = await self.scanner.find_device_by_filter(match, timeout=timeout)
+        if device is None:
+            print("No saber found")
+            return None
+        self.device_address = device.address
+        if self.name is None:
+            self.name = device.address
+        return device
 
     async def scan_and_select_device(self):
         print("Scanning for devices...")
@@ -26,36 +141,143 @@ class Receiver:
         index = int(input("Enter the number of the device you want to connect to: "))
         self.device_address = devices[index].address
 
-    async def connect(self):
+    async def connect(self, device=None, timeout=5.0):
+        """ connect to device (as returned by find_device) or the device address """
         print("Trying to connect to device with MAC address:", self.device_address)
         if not self.connected:
-            self.client = BleakClient(self.device_address)
+            self.client = self.client_class(device or self.device_address,
+                                            disconnected_callback=self._on_disconnect, timeout=timeout)
             await self.client.connect()
             self.connected = True
+            await self._request_mtu()
             print("Connected to device with MAC address:", self.device_address)
 
+    async def _request_mtu(self):
+        # Windows and macOS negotiate the largest MTU on connect, BlueZ only on request.
+        # Bleak doesn't expose the connection interval, the peripheral has to ask for it
+        acquire_mtu = getattr(getattr(self.client, '_backend', None), '_acquire_mtu', None)
+        if acquire_mtu is not None and _bleak_supports_acquire_mtu():
+            try:
+                await acquire_mtu()
+            except Exception as error:
+                print("MTU request failed:", error)
+        print("MTU:", getattr(self.client, 'mtu_size', None))
+
     async def disconnect(self):
+        # an intended disconnect must not trigger a reconnect
+        self.reconnect = False
+        if self.reconnect_task is not None:
+            self.reconnect_task.cancel()
+            self.reconnect_task = None
         if self.connected:
-            await self.client.disconnect()
             self.connected = False
+            await self.client.disconnect()
             print("Disconnected from device with MAC address:", self.device_address)
+            self._notify_disconnect()
+
+    def keep_connected(self):
+        """ reconnect and resubscribe the notifications automatically after link loss """
+        self.reconnect = True
+
+    def _on_disconnect(self, client):
+        if client is not self.client or not self.connected:
+            return
+        self.connected = False
+        print("Lost connection to device with MAC address:", self.device_address)
+        self._notify_disconnect()
+        if self.reconnect and self.reconnect_task is None:
+            self.disconnected_at = time.perf_counter()
+            self.reconnect_task = asyncio.ensure_future(self._reconnect())
+
+    def add_disconnect_callback(self, callback):
+        self.disconnect_callbacks.append(callback)
+
+    def _notify_disconnect(self):
+        for callback in self.disconnect_callbacks:
+            callback()
 
-    async def add_callback(self, callback):
-        self.callbacks.append(callback)
+    async def _reconnect(self, backoff=0.05, max_backoff=2.0):
+        # the first attempt is immediate, then back off exponentially
+        delay = 0.0
+        while self.reconnect:
+            try:
+                await self.connect(timeout=max(1.0, 4 * delay))
+                await self.start_notifications(self.service_uuid, self.characteristic_uuid)
+                break
+            except Exception as error:
+                print("Reconnect failed:", error)
+                self.connected = False
+                # a connect without notifications would refuse every further connect
+                try:
+                    await self.client.disconnect()
+                except Exception as disconnect_error:
+                    print("Disconnect after failed reconnect failed:", disconnect_error)
+            await asyncio.sleep(delay)
+            delay = min(max(2 * delay, backoff), max_backoff)
+        if self.connected:
+            self.downtimes.append(time.perf_counter() - self.disconnected_at)
+        self.reconnect_task = None
+
+    async def add_callback(self, callback, priority=Priority.NORMAL):
+        self.callbacks.add(callback, priority)
         print("Callback added.")
 
     async def remove_callback(self, callback):
         self.callbacks.remove(callback)
         print("Callback removed.")
 
-    async def handle_data(self, sender, data):
-        decoded = SensorDataDecoder.decode_data(data, time.perf_counter())
-        for callback in self.callbacks:
-            await callback(decoded)
-        print("Data handled by callbacks.")
+    def set_recorder(self, recorder):
+        """ log every raw notification to recorder (a recorder.SessionRecorder), None to stop """
+        self.recorder = recorder
+
+    def enable_jitter_buffer(self, min_delay=0.005, max_delay=0.05, multiplier=2.0):
+        """ release device-clocked frames evenly spaced, after an adaptive, bounded delay """
+        self.jitter_buffer = JitterBuffer(self.callbacks.dispatch, min_delay, max_delay, multiplier)
+        # buffered frames outlive the frame pool
+        self.frames = None
+
+    def link_stats(self):
+        """ packet loss, clock offset and jitter buffer state of the device link """
+        stats = self.sequence.summary()
+        stats['clock_offset'] = self.clock.offset
+        if self.jitter_buffer is not None:
+            stats['jitter_buffer'] = self.jitter_buffer.summary()
+        stats['reconnects'] = len(self.downtimes)
+        if self.downtimes:
+            stats['max_downtime'] = max(self.downtimes)
+        return stats
+
+    async def handle_data(self, sender, data, t=None):
+        start_ns = time.perf_counter_ns()
+        if t is None:
+            t = time.perf_counter()
+        if self.recorder is not None:
+            self.recorder.write(t, data)
+        if self.frames is not None:
+            decoded = SensorDataDecoder.decode_into(data, self.frames.next(), t)
+        else:
+            decoded = SensorDataDecoder.decode_data(data, t)
+        if decoded is None:
+            # unknown packet format, already logged by the decoder
+            return
+        tracer.record(Stage.DECODE, start_ns)
+        if decoded.device_time is not None:
+            self.sequence.update(decoded.sequence)
+            # sample time from the device clock, mapped onto the host clock
+            decoded.time = self.clock.update(t, decoded.device_time)
+            if self.jitter_buffer is not None:
+                self.jitter_buffer.push(decoded, self.clock.delay)
+                self.stats.record(t, time.perf_counter_ns() - start_ns)
+                return
+        await self.callbacks.dispatch(decoded)
+        tracer.record(Stage.RECEIVE, start_ns)
+        self.stats.record(t, time.perf_counter_ns() - start_ns)
 
     async def start_notifications(self, service_uuid, characteristic_uuid):
         print("Starting notifications for service UUID:", service_uuid, "and characteristic UUID:", characteristic_uuid)
+        # kept for resubscribing after a reconnect
+        self.service_uuid = service_uuid
+        self.characteristic_uuid = characteristic_uuid
         await self.client.start_notify(characteristic_uuid, self.handle_data)
         print("Notifications started.")
 
@@ -63,3 +285,11 @@ class Receiver:
         print("Stopping notifications for characteristic UUID:", characteristic_uuid)
         await self.client.stop_notify(characteristic_uuid)
         print("Notifications stopped.")
+
+
+def _bleak_supports_acquire_mtu():
+    try:
+        installed = tuple(int(part) for part in version('bleak').split('.')[:2])
+    except (PackageNotFoundError, ValueError):
+        return False
+    return ACQUIRE_MTU_VERSIONS[0] <= installed < ACQUIRE_MTU_VERSIONS[1]
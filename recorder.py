@@ -0,0 +1,157 @@
+import asyncio
+import struct
+import time
+import numpy as np
+from receiver import Receiver
+
+# binary session log: file header followed by one record per notification,
+# each record is a little-endian (float64 perf_counter timestamp, uint16 length) + raw payload
+SESSION_MAGIC = b'MSBS'
+SESSION_VERSION = 1
+_HEADER = struct.Struct('<4sBxxx')
+_RECORD = struct.Struct('<dH')
+
+
+class SessionRecorder:
+    """ Appends raw BLE notifications with their receive timestamp to a binary log. """
+
+    def __init__(self, path, buffering=1 << 16):
+        self.path = path
+        self.file = open(path, 'wb', buffering=buffering)
+        self.file.write(_HEADER.pack(SESSION_MAGIC, SESSION_VERSION))
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write(self, t: float, data):
+        self.file.write(_RECORD.pack(t, len(data)))
+        self.file.write(data)
+        self.count += 1
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+
+def read_session(path):
+    """ Yield (timestamp, payload) tuples of a recorded session. """
+    with open(path, 'rb') as file:
+        header = file.read(_HEADER.size)
+        magic, version = _HEADER.unpack(header)
+        if magic != SESSION_MAGIC or version != SESSION_VERSION:
+            raise ValueError(f"{path} is not a session log")
+        while True:
+            record = file.read(_RECORD.size)
+            if len(record) < _RECORD.size:
+                return
+            t, length = _RECORD.unpack(record)
+            data = file.read(length)
+            if len(data) < length:
+                return
+            yield t, data
+
+
+def load_session(path):
+    """
+    Load a whole recorded session for batch processing.
+
+    Returns:
+        (bytes, np.ndarray, int): Concatenated payloads, timestamps and packet size,
+            ready for SensorDataDecoder.decode_batch.
+    """
+    timestamps = []
+    payloads = []
+    for t, data in read_session(path):
+        timestamps.append(t)
+        payloads.append(data)
+    packet_size = len(payloads[0]) if payloads else 36
+    if any(len(data) != packet_size for data in payloads):
+        raise ValueError("session contains packets of different protocols")
+    return b''.join(payloads), np.array(timestamps), packet_size
+
+
+class ReplayReceiver(Receiver):
+    """
+    Receiver playing back a recorded session instead of a BLE device.
+
+    speed scales the playback: 1.0 is real time, 2.0 twice as fast and
+    None (or 0) replays as fast as possible. Timestamps handed to the callbacks
+    keep the recorded spacing, independent of the playback speed.
+    """
+
+    def __init__(self, path, speed=1.0):
+        super().__init__(path)
+        self.path = path
+        self.speed = speed
+
+    async def scan_and_select_device(self):
+        pass
+
+    async def connect(self, device=None, timeout=5.0):
+        self.connected = True
+
+    async def disconnect(self):
+        self.connected = False
+
+    async def start_notifications(self, service_uuid=None, characteristic_uuid=None):
+        await self.play()
+
+    async def stop_notifications(self, characteristic_uuid=None):
+        pass
+
+    def packets(self):
+        return read_session(self.path)
+
+    async def play(self):
+        """ Replay the whole session, returns the number of replayed packets """
+        count = 0
+        start = time.perf_counter()
+        first = None
+        for t, data in self.packets():
+            if first is None:
+                first = t
+            elapsed = t - first
+            if self.speed:
+                delay = start + elapsed / self.speed - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            elif count % 64 == 0:
+                # as fast as possible, but let the other tasks run every few packets
+                await asyncio.sleep(0)
+            await self.handle_data(self.device_address, data, start + elapsed)
+            count += 1
+        return count
+
+
+def synthetic_session(count=10000, rate=100.0, swing_period=0.8, amplitude=400.0):
+    """
+    Yield (timestamp, payload) tuples of generated 36 byte packets.
+
+    The gyro follows a sine swing on all axes (phase shifted), so the
+    detection chain sees regular threshold events like with a real saber.
+    """
+    omega = 2 * np.pi / swing_period
+    for i in range(count):
+        t = i / rate
+        phase = omega * t
+        gyro = (amplitude * np.sin(phase), 0.5 * amplitude * np.sin(phase + 2.0), 0.2 * amplitude * np.sin(phase + 4.0))
+        acc = (9.81 * np.cos(phase), 0.0, 1.0)
+        rot = (20.0 * np.cos(phase), 60.0 * np.sin(0.2 * phase), -30.0)
+        yield t, struct.pack('<9f', *rot, *acc, *gyro)
+
+
+class SimulatedReceiver(ReplayReceiver):
+    """ Local stand-in for a saber, plays synthetic_session packets in real time (speed 1.0) """
+
+    def __init__(self, name='simulated', count=1000000, rate=100.0, speed=1.0, swing_period=0.8):
+        super().__init__(name, speed)
+        self.count = count
+        self.rate = rate
+        self.swing_period = swing_period
+
+    def packets(self):
+        return synthetic_session(self.count, self.rate, self.swing_period)
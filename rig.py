@@ -0,0 +1,129 @@
+import asyncio
+from controller import ContinuousController, default_mappings
+from dsp import SignalGraph
+from gesture import GestureRecognizer, GestureRecorder
+from midi import MIDISender
+from onset import OnsetDetector
+from orientation import OrientationEngine
+from player import Player
+from processing import Processor
+from receiver import Receiver
+
+
+class SaberPipeline:
+    """ Receiver -> Processor -> Player chain of one saber, playing on its own MIDI channel """
+
+    def __init__(self, receiver: Receiver, midi: MIDISender, channel: int, controllers=False, fusion=False,
+                 gestures=None, dsp=None, dsp_only=False, onset=False, aftertouch=False, record_gesture=None,
+                 gesture_notes=()):
+        self.receiver = receiver
+        self.channel = channel
+        # fusion 'imu' uses gyro and acc, 'marg' also the rot field as raw magnetometer
+        self.orientation = OrientationEngine(magnetometer=fusion == 'marg') if fusion else None
+        # optional json file of a dsp.SignalGraph, every saber gets its own graph state
+        graph = SignalGraph.load(dsp) if dsp is not None else None
+        self.processor = Processor(self.orientation, graph, detector=not dsp_only)
+        self.controller = ContinuousController(midi, default_mappings(channel)) if controllers else None
+        self.controller_task = None
+        self.player = Player(midi, self.controller, channel, self.orientation)
+        # optional json file of gesture templates, see gesture.GestureRecognizer.save
+        self.gestures = gestures
+        self.recognizer = None
+        # record takes of gesture record_gesture into the gestures file instead of recognizing
+        self.record_gesture = record_gesture
+        self.gesture_notes = gesture_notes
+        self.recorder = None
+        # play on the rising slope with velocity instead of the threshold events
+        self.onset_detector = OnsetDetector() if onset else None
+        self.aftertouch = aftertouch
+
+    async def setup(self):
+        await self.processor.add_receiver(self.receiver)
+        await self.player.add_receiver(self.receiver)
+        if self.controller is not None:
+            self.controller_task = asyncio.ensure_future(self.controller.run())
+        if self.onset_detector is not None:
+            self.processor.add_onset_detector(self.onset_detector)
+            await self.player.add_onset_detector(self.onset_detector, self.aftertouch)
+        else:
+            await self.player.add_event_processor(self.processor)
+        if self.record_gesture is not None:
+            self.recognizer = GestureRecognizer()
+            self.recorder = GestureRecorder(self.recognizer, self.record_gesture, self.gestures, self.gesture_notes)
+            self.processor.add_gesture_recognizer(self.recorder)
+            await self.recorder.add_callback(self.gesture_recorded)
+        elif self.gestures is not None:
+            self.recognizer = GestureRecognizer()
+            actions = self.recognizer.load(self.gestures)
+            self.processor.add_gesture_recognizer(self.recognizer)
+            await self.player.add_gesture_recognizer(self.recognizer, actions)
+
+    async def gesture_recorded(self, template):
+        print(f"Recorded take {self.recorder.takes} of gesture {template.name} into {self.gestures}")
+
+    async def close(self):
+        if self.controller_task is not None:
+            self.controller_task.cancel()
+            self.controller_task = None
+        await self.receiver.disconnect()
+
+
+class SaberRig:
+    """
+    Several sabers in one asyncio loop, all playing into one shared MIDI output.
+
+    Every saber gets its own pipeline and MIDI channel (in order of adding). The
+    pipelines share no state, one saber's notifications are handled completely
+    inline before the next one is dispatched, and the MIDI output should be
+    threaded (MIDISender(threaded=True)) so no pipeline waits for MIDI I/O.
+    """
+
+    def __init__(self, midi: MIDISender, controllers=False, fusion=False, gestures=None, dsp=None, dsp_only=False,
+                 onset=False, aftertouch=False, record_gesture=None, gesture_notes=()):
+        self.midi = midi
+        self.controllers = controllers
+        self.fusion = fusion
+        self.gestures = gestures
+        self.dsp = dsp
+        self.dsp_only = dsp_only
+        self.onset = onset
+        self.aftertouch = aftertouch
+        # only the first saber records gesture takes
+        self.record_gesture = record_gesture
+        self.gesture_notes = gesture_notes
+        self.pipelines = []
+
+    async def add_device(self, receiver: Receiver, channel=None) -> SaberPipeline:
+        if channel is None:
+            channel = len(self.pipelines) % 16
+        record_gesture = self.record_gesture if not self.pipelines else None
+        pipeline = SaberPipeline(receiver, self.midi, channel, self.controllers, self.fusion,
+                                 self.gestures, self.dsp, self.dsp_only, self.onset, self.aftertouch,
+                                 record_gesture, self.gesture_notes)
+        await pipeline.setup()
+        self.pipelines.append(pipeline)
+        return pipeline
+
+    async def connect_all(self, service_uuid, characteristic_uuid):
+        """ connect all devices concurrently, start their notifications and reconnect them on link loss """
+        async def connect(receiver: Receiver):
+            await receiver.connect()
+            await receiver.start_notifications(service_uuid, characteristic_uuid)
+            receiver.keep_connected()
+        await asyncio.gather(*(connect(pipeline.receiver) for pipeline in self.pipelines))
+
+    async def disconnect_all(self):
+        await asyncio.gather(*(pipeline.close() for pipeline in self.pipelines))
+
+    def stats(self):
+        """ throughput and handling latency per device """
+        return {pipeline.receiver.name: {'channel': pipeline.channel, **pipeline.receiver.stats.summary(),
+                                         **pipeline.receiver.link_stats()}
+                for pipeline in self.pipelines}
+
+    def print_stats(self):
+        for name, stats in self.stats().items():
+            print(f"{name} (ch {stats['channel'] + 1}): {stats['packets']} packets,"
+                  f" {stats['packets_per_second']:.1f}/s, latency p50 {stats['p50_us']:.1f}us"
+                  f" p99 {stats['p99_us']:.1f}us max {stats['max_us']:.1f}us, {stats['lost']} lost,"
+                  f" {stats['reconnects']} reconnects")
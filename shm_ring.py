@@ -0,0 +1,136 @@
+import sys
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+from data import SensorData, Vec3
+from processing import Dimension, Event3, EventType
+
+FRAME_DTYPE = np.dtype([('time', '<f8'),
+                        ('rot', '<f8', (3,)),
+                        ('acc', '<f8', (3,)),
+                        ('gyro', '<f8', (3,))])
+EVENT_DTYPE = np.dtype([('position', '<f8'),
+                        ('value', '<f8'),
+                        ('type', '<i4'),
+                        ('dimension', '<i4')])
+# enum members are stored by their position
+EVENT_TYPES = list(EventType)
+DIMENSIONS = list(Dimension)
+_EVENT_TYPE_INDEX = {event_type: i for i, event_type in enumerate(EVENT_TYPES)}
+_DIMENSION_INDEX = {dimension: i for i, dimension in enumerate(DIMENSIONS)}
+
+HEADER_DTYPE = np.dtype([('frames_written', '<u8'),
+                         ('events_version', '<u8'),  # odd while the writer updates the events
+                         ('events_count', '<u8'),
+                         ('capacity', '<u8'),
+                         ('max_events', '<u8')])
+
+
+class SharedFrameRing:
+    """
+    Single-writer, multi-reader ring of decoded frames in shared memory.
+
+    The audio process writes frames and the latest event list without ever
+    blocking or waiting for a reader. Readers in other processes poll at their
+    own pace. A reader that falls more than a ring length behind skips the lost
+    frames. A reader that crashes or detaches doesn't affect the writer at all.
+    """
+
+    def __init__(self, name=None, capacity=4096, max_events=64):
+        if name is None:
+            size = HEADER_DTYPE.itemsize + capacity * FRAME_DTYPE.itemsize + max_events * EVENT_DTYPE.itemsize
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.owner = True
+        elif sys.version_info >= (3, 13):
+            self.shm = shared_memory.SharedMemory(name=name, track=False)
+            self.owner = False
+        else:
+            self.shm = _attach_untracked(name)
+            self.owner = False
+        self.header = np.ndarray(1, HEADER_DTYPE, self.shm.buf)[0]
+        if self.owner:
+            self.header['capacity'] = capacity
+            self.header['max_events'] = max_events
+        self.capacity = int(self.header['capacity'])
+        self.max_events = int(self.header['max_events'])
+        offset = HEADER_DTYPE.itemsize
+        self.frames = np.ndarray(self.capacity, FRAME_DTYPE, self.shm.buf, offset)
+        offset += self.capacity * FRAME_DTYPE.itemsize
+        self.events = np.ndarray(self.max_events, EVENT_DTYPE, self.shm.buf, offset)
+        self.read_position = int(self.header['frames_written'])
+        self.events_version = None  # version of the event list the reader returned last
+        self.lost = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    # writer side
+
+    def write_frame(self, data: SensorData):
+        written = int(self.header['frames_written'])
+        frame = self.frames[written % self.capacity]
+        frame['time'] = data.time
+        frame['rot'] = (data.rot.x, data.rot.y, data.rot.z)
+        frame['acc'] = (data.acc.x, data.acc.y, data.acc.z)
+        frame['gyro'] = (data.gyro.x, data.gyro.y, data.gyro.z)
+        # publish after the frame is complete
+        self.header['frames_written'] = written + 1
+
+    def write_events(self, events: [Event3]):
+        self.header['events_version'] += 1
+        count = min(len(events), self.max_events)
+        for i in range(count):
+            e = events[i]
+            self.events[i] = (e.position, e.value, _EVENT_TYPE_INDEX[e.type], _DIMENSION_INDEX[e.dimension])
+        self.header['events_count'] = count
+        self.header['events_version'] += 1
+
+    # reader side
+
+    def read_frames(self) -> np.ndarray:
+        """ copy of all frames written since the last call """
+        written = int(self.header['frames_written'])
+        # keep a margin to the slots the writer may be overwriting right now
+        oldest = written - self.capacity + 16
+        if self.read_position < oldest:
+            self.lost += oldest - self.read_position
+            self.read_position = oldest
+        positions = np.arange(self.read_position, written) % self.capacity
+        self.read_position = written
+        return self.frames[positions]
+
+    def read_events(self):
+        """ copy of the event list if it changed since the last call, None if not or if the writer was updating it """
+        version = int(self.header['events_version'])
+        if version % 2 or version == self.events_version:
+            return None
+        events = self.events[:int(self.header['events_count'])].copy()
+        if int(self.header['events_version']) != version:
+            return None
+        self.events_version = version
+        return events
+
+    def close(self):
+        del self.header, self.frames, self.events
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def _attach_untracked(name):
+    """
+    Attach without registering the segment with the resource tracker, which would
+    unlink it when the reader exits (track=False before Python 3.13). Unregistering
+    after attaching is no option, the tracker may be shared with the owner.
+    """
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+def frame_to_sensor_data(frame) -> SensorData:
+    rot, acc, gyro = frame['rot'], frame['acc'], frame['gyro']
+    return SensorData(Vec3(*rot.tolist()), Vec3(*acc.tolist()), Vec3(*gyro.tolist()), float(frame['time']))
@@ -0,0 +1,28 @@
+from clock import SEQUENCE_MODULO, SequenceTracker
+
+
+def feed(sequences, **kwargs):
+    tracker = SequenceTracker(**kwargs)
+    for sequence in sequences:
+        tracker.update(sequence)
+    return tracker.summary()
+
+
+def test_stale_duplicates_give_back_no_loss():
+    assert feed([1, 2, 3, 1, 2]) == {'received': 5, 'lost': 0, 'duplicates': 2, 'reordered': 0}
+
+
+def test_late_packet_gives_back_its_loss_once():
+    assert feed([1, 2, 4, 5, 3, 3]) == {'received': 6, 'lost': 0, 'duplicates': 1, 'reordered': 1}
+
+
+def test_loss_across_counter_wrap():
+    last = SEQUENCE_MODULO - 1
+    assert feed([last - 1, 1, last]) == {'received': 3, 'lost': 1, 'duplicates': 0, 'reordered': 1}
+
+
+def test_only_the_window_of_skipped_packets_is_remembered():
+    summary = feed([0, 100, 10, 98], window=4)
+    assert summary['lost'] == 98
+    assert summary['duplicates'] == 1
+    assert summary['reordered'] == 1
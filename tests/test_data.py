@@ -0,0 +1,76 @@
+import struct
+import numpy as np
+import pytest
+from data import FramePool, LEGACY_SCALE_SI, SENSOR_DTYPE, SensorDataDecoder
+
+VALUES = [1.5, -2.25, 3.0, 9.81, 0.0, -9.81, 120.5, -33.0, 0.125]
+
+
+def test_decode_float_packet():
+    decoded = SensorDataDecoder.decode_data(struct.pack('<9f', *VALUES), 12.5)
+    assert (decoded.rot.x, decoded.rot.y, decoded.rot.z) == tuple(VALUES[0:3])
+    assert (decoded.acc.x, decoded.acc.y, decoded.acc.z) == pytest.approx(VALUES[3:6])
+    assert (decoded.gyro.x, decoded.gyro.y, decoded.gyro.z) == tuple(VALUES[6:9])
+    assert decoded.time == 12.5
+    assert decoded.sequence is None and decoded.device_time is None
+
+
+def test_decode_timed_packet():
+    decoded = SensorDataDecoder.decode_data(struct.pack('<9fII', *VALUES, 42, 2500000), 1.0)
+    assert decoded.sequence == 42
+    assert decoded.device_time == pytest.approx(2.5)
+    assert decoded.gyro.x == 120.5
+
+
+def test_decode_legacy_packet():
+    raw = [100, -200, 300, 1000, 0, -1000, 50, -60, 70]
+    decoded = SensorDataDecoder.decode_data(struct.pack('<9h', *raw), 0.0)
+    assert (decoded.rot.x, decoded.acc.z, decoded.gyro.y) == (100, -1000, -60)
+
+
+def test_decode_unknown_format():
+    assert SensorDataDecoder.decode_data(b'\x00' * 10, 0.0) is None
+
+
+@pytest.mark.parametrize('fmt,extra', [('<9f', ()), ('<9fII', (7, 1000)), ('<9h', ())])
+def test_decode_into_matches_decode_data(fmt, extra):
+    values = [int(v) for v in VALUES] if fmt == '<9h' else VALUES
+    packet = struct.pack(fmt, *values, *extra)
+    frame = FramePool(1).next()
+    SensorDataDecoder.decode_into(packet, frame, 3.0)
+    decoded = SensorDataDecoder.decode_data(packet, 3.0)
+    for name in ('rot', 'acc', 'gyro'):
+        a, b = getattr(frame, name), getattr(decoded, name)
+        assert (a.x, a.y, a.z) == (b.x, b.y, b.z)
+    assert (frame.time, frame.sequence, frame.device_time) == (decoded.time, decoded.sequence, decoded.device_time)
+
+
+def test_frame_pool_reuses_frames_round_robin():
+    pool = FramePool(3)
+    frames = [pool.next() for _ in range(4)]
+    assert frames[0] is frames[3]
+    assert len({id(frame) for frame in frames[:3]}) == 3
+
+
+def test_decode_batch_matches_decode_data():
+    rng = np.random.default_rng(0)
+    values = rng.normal(0, 100, (50, 9)).astype(np.float32)
+    timestamps = np.arange(50) * 0.01
+    buffer = b''.join(struct.pack('<9f', *row) for row in values)
+    batch = SensorDataDecoder.decode_batch(buffer, timestamps)
+    assert batch.dtype == SENSOR_DTYPE
+    for i in (0, 17, 49):
+        decoded = SensorDataDecoder.decode_data(buffer[36 * i:36 * (i + 1)], timestamps[i])
+        assert list(batch['gyro'][i]) == [decoded.gyro.x, decoded.gyro.y, decoded.gyro.z]
+        assert batch['time'][i] == decoded.time
+
+
+def test_decode_batch_legacy_scale():
+    raw = np.arange(18, dtype=np.int16).reshape(2, 9)
+    batch = SensorDataDecoder.decode_batch(raw.tobytes(), [0.0, 0.01], packet_size=18, scale=LEGACY_SCALE_SI)
+    np.testing.assert_allclose(batch['gyro'][1], raw[1, 6:9] * LEGACY_SCALE_SI[6:9], rtol=1e-6)
+
+
+def test_decode_batch_rejects_size_mismatch():
+    with pytest.raises(ValueError):
+        SensorDataDecoder.decode_batch(b'\x00' * 36, [0.0, 1.0])
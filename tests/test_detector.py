@@ -0,0 +1,60 @@
+import numpy as np
+from processing import EventProcessor3, EventType, History3
+
+
+def reference_events(values, cooldown, threshold_pos, threshold_neg):
+    """ brute-force (index, type, axis) set of the peak and edge rules of EventProcessor3 """
+    events = set()
+    for i in range(len(values)):
+        window = values[max(0, i - cooldown + 1):i + 1]
+        for axis in range(3):
+            value = values[i, axis]
+            if value > threshold_pos and value >= window[:, axis].max():
+                events.add((i, EventType.THRESHOLD_POS, axis))
+            elif value < threshold_neg and value <= window[:, axis].min():
+                events.add((i, EventType.THRESHOLD_NEG, axis))
+            if i > 0:
+                last = values[i - 1, axis]
+                if last <= threshold_pos < value:
+                    events.add((i, EventType.EDGE_RISE, axis))
+                elif last >= threshold_neg > value:
+                    events.add((i, EventType.EDGE_FALL, axis))
+    return events
+
+
+def test_event_processor_matches_reference():
+    rng = np.random.default_rng(3)
+    t = np.arange(2000) * 0.01
+    values = 120 * np.sin(2 * np.pi * t[:, None] / 0.7 + np.array([0.0, 1.0, 2.0])) + rng.normal(0, 25, (2000, 3))
+    values[400:420] = 60.0  # plateau with equal values
+    signal = History3(20)
+    processor = EventProcessor3(signal, window_length=5, cooldown=10)
+    axes = [processor.axes[i].dimension for i in range(3)]
+    online = set()
+    for i in range(len(t)):
+        signal.append_values(*values[i], t[i])
+        for event in processor.analyze():
+            online.add((event.index, event.type, axes.index(event.dimension)))
+    assert online == reference_events(values, 10, 50, -50)
+
+
+def test_threshold_event_stays_active_for_window_length():
+    signal = History3(20)
+    processor = EventProcessor3(signal, window_length=3, cooldown=10)
+    samples = [0, 80, 10, 10, 10, 10]
+    active = []
+    for i, value in enumerate(samples):
+        signal.append_values(value, 0, 0, float(i))
+        active.append(any(e.type == EventType.THRESHOLD_POS for e in processor.analyze()))
+    assert active == [False, True, True, True, False, False]
+
+
+def test_catch_up_after_more_samples_than_the_history_length():
+    signal = History3(20)
+    processor = EventProcessor3(signal, window_length=5, cooldown=10)
+    for i in range(30):
+        signal.append_values(200.0 if i == 25 else 0.0, 0, 0, 0.01 * i)
+    x = processor.axes[0].dimension
+    events = [(event.index, event.type) for event in processor.analyze() if event.dimension == x]
+    assert (25, EventType.EDGE_RISE) in events
+    assert (25, EventType.THRESHOLD_POS) in events
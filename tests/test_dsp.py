@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+from data import SensorDataDecoder
+from dsp import DEFAULT_GRAPH, SignalGraph, biquad_coefficients
+from processing import Derivation3, EventType
+from recorder import synthetic_session
+
+PACKETS = list(synthetic_session(500))
+FRAMES = [SensorDataDecoder.decode_data(data, t) for t, data in PACKETS]
+
+
+def test_lowpass_and_derivative_match_references():
+    graph = SignalGraph([{'name': 'smooth', 'type': 'lowpass', 'input': 'gyro', 'cutoff': 20.0},
+                         {'name': 'slope', 'type': 'derivative', 'input': 'gyro'}])
+    derivation = Derivation3(len(FRAMES))
+    smooth = []
+    slope = []
+    for frame in FRAMES:
+        graph.step(frame)
+        derivation.append(frame.gyro, frame.time)
+        smooth.append(graph.output('smooth')[0])
+        slope.append(graph.output('slope'))
+
+    b0, b1, b2, a1, a2 = biquad_coefficients('lowpass', 20.0, 100.0)
+    x = np.array([frame.gyro.x for frame in FRAMES])
+    y = np.zeros_like(x)
+    for n in range(len(x)):
+        y[n] = b0 * x[n] + (b1 * x[n - 1] - a1 * y[n - 1] if n > 0 else 0.0) + \
+            (b2 * x[n - 2] - a2 * y[n - 2] if n > 1 else 0.0)
+    np.testing.assert_allclose(smooth, y)
+    np.testing.assert_allclose(np.array(slope)[1:], derivation.view()[:3].T)
+
+
+def test_batch_matches_step_and_reports_events():
+    graph = SignalGraph(DEFAULT_GRAPH['nodes'], DEFAULT_GRAPH['rate'])
+    stepped = []
+    events = 0
+    for frame in FRAMES:
+        graph.step(frame)
+        stepped.append(graph.out)
+        for event in graph.events():
+            assert event.type == EventType.THRESHOLD_POS
+            events += 1
+    assert events > 0
+    graph.reset()
+    frames = SensorDataDecoder.decode_batch(b''.join(data for _, data in PACKETS), [t for t, _ in PACKETS])
+    np.testing.assert_array_equal(graph.batch(frames), np.array(stepped))
+
+
+@pytest.mark.parametrize('name', ['', None, 'gyro', 'smooth'])
+def test_invalid_node_names(name):
+    nodes = [{'name': 'smooth', 'type': 'lowpass', 'input': 'gyro', 'cutoff': 20.0},
+             {'name': name, 'type': 'abs', 'input': 'smooth'}]
+    with pytest.raises(ValueError):
+        SignalGraph(nodes)
+
+
+def test_any_string_is_a_node_name():
+    graph = SignalGraph([{'name': 'swing energy; import os', 'type': 'magnitude', 'input': 'gyro'}])
+    assert 'swing' not in graph.source and 'import' not in graph.source
+    graph.step(FRAMES[0])
+    gyro = FRAMES[0].gyro
+    assert graph.output('swing energy; import os') == [pytest.approx(np.hypot(np.hypot(gyro.x, gyro.y), gyro.z))]
@@ -0,0 +1,79 @@
+import asyncio
+import json
+import time
+import numpy as np
+import pytest
+from gesture import GestureRecognizer, GestureRecorder, GestureTemplate, dtw_distance, dtw_distances
+from processing import SensorHistory
+from data import SensorData, Vec3
+
+
+def swing(length=40, amplitude=400.0):
+    t = np.linspace(0, np.pi, length)
+    return np.stack((amplitude * np.sin(t), -0.5 * amplitude * np.sin(t), np.zeros(length)), axis=1)
+
+
+def test_load_takes_length_and_signal_from_file(tmp_path):
+    path = tmp_path / "gestures.json"
+    saved = GestureRecognizer(length=12, signal='acc')
+    saved.add_template(GestureTemplate('slash', swing(12)))
+    saved.save(path, {'slash': [60]})
+
+    recognizer = GestureRecognizer()
+    assert recognizer.load(path) == {'slash': [60]}
+    assert (recognizer.length, recognizer.signal) == (12, 'acc')
+    assert recognizer.match(swing(12)) is not None
+
+    mismatched = GestureRecognizer(length=20)
+    mismatched.add_template(GestureTemplate('stab', swing(20)))
+    with pytest.raises(ValueError):
+        mismatched.load(path)
+
+
+def test_recorder_adds_one_take_per_swing(tmp_path):
+    path = tmp_path / "gestures.json"
+    recognizer = GestureRecognizer(length=20)
+    recorder = GestureRecorder(recognizer, 'slash', path, notes=[60, 64])
+    history = SensorHistory(64)
+    gyro = np.concatenate((np.zeros((30, 3)), swing(), np.zeros((30, 3)), swing(), np.zeros((30, 3))))
+
+    async def run():
+        for i, value in enumerate(gyro):
+            history.append(SensorData(Vec3(0, 0, 0), Vec3(0, 0, 0), Vec3(*value), 0.01 * i))
+            await recorder.update(history)
+
+    asyncio.run(run())
+    assert recorder.takes == 2
+    content = json.loads(path.read_text())
+    assert content['gestures']['slash']['notes'] == [60, 64]
+    assert len(content['gestures']['slash']['takes']) == 2
+    assert recognizer.match(swing()[10:30]) is not None
+
+    # a second recording session keeps the earlier takes
+    again = GestureRecorder(GestureRecognizer(length=20), 'stab', path)
+    assert len(again.recognizer.templates) == 2
+    assert again.actions == {'slash': [60, 64], 'stab': []}
+
+
+def test_vectorized_dtw_matches_single_template_dtw():
+    rng = np.random.default_rng(5)
+    query = rng.normal(size=(20, 3))
+    templates = rng.normal(size=(12, 20, 3))
+    for radius in (0, 1, 3, 19):
+        expected = [dtw_distance(query, template, radius) for template in templates]
+        np.testing.assert_allclose(dtw_distances(query, templates, radius), expected, rtol=1e-12)
+    assert np.isinf(dtw_distances(query, templates, 3, best_so_far=1e-3)).all()
+
+
+def test_match_with_many_takes_stays_within_budget():
+    rng = np.random.default_rng(7)
+    recognizer = GestureRecognizer(threshold=1e9)  # no template is pruned by its lower bound
+    for take in range(36):
+        recognizer.add_template(GestureTemplate(str(take % 4), swing(20) + rng.normal(0.0, 40.0, (20, 3))))
+    window = swing(20) + rng.normal(0.0, 40.0, (20, 3))
+    best = float('inf')
+    for _ in range(20):
+        start = time.perf_counter()
+        assert recognizer.match(window) is not None
+        best = min(best, time.perf_counter() - start)
+    assert best < 1e-3
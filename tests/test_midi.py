@@ -0,0 +1,103 @@
+import asyncio
+import threading
+import pytest
+from controller import ContinuousController, ControllerMapping
+from data import SensorData, Vec3
+from midi import MIDIOutputThread, MIDISender
+from midi_backend import MIDIBackend, RecordingBackend
+
+
+def messages(backend):
+    return [tuple(message[1:]) for message in backend.messages]
+
+
+def test_overlapping_notes_are_reference_counted():
+    backend = RecordingBackend()
+    midi = MIDISender(backend=backend)
+    midi.start_note(60, channel=2)
+    midi.start_note(60, channel=2)
+    midi.stop_note(60, channel=2)
+    assert midi.is_active(60, channel=2)
+    midi.stop_note(60, channel=2)
+    midi.stop_note(60, channel=2)  # already stopped, no second note-off
+    assert not midi.is_active(60, channel=2)
+    assert messages(backend) == [(0x92, 60, 64), (0x92, 60, 64), (0x82, 60, 0)]
+
+
+def test_active_notes_and_stop_all():
+    backend = RecordingBackend()
+    midi = MIDISender(backend=backend)
+    midi.start_notes([60, 64, 67], channel=0)
+    midi.start_note(48, channel=1)
+    assert midi.active_notes() == [(0, 60), (0, 64), (0, 67), (1, 48)]
+    assert midi.active_notes(channel=1) == [(1, 48)]
+    midi.stop_all(channel=0)
+    assert midi.active_notes() == [(1, 48)]
+
+
+def test_discard_releases_pending_flush():
+    class BlockingBackend(RecordingBackend):
+        def __init__(self):
+            super().__init__()
+            self.entered = threading.Event()
+            self.release = threading.Event()
+
+        def write(self, batch):
+            self.entered.set()
+            self.release.wait(1.0)
+            super().write(batch)
+
+    backend = BlockingBackend()
+    output = MIDIOutputThread(backend)
+    output.send(0x90, 60, 64)
+    backend.entered.wait(1.0)  # the thread blocks in write
+    output.send(0x90, 62, 64)
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(output.flush(timeout=0.5)))
+    waiter.start()
+    while not any(isinstance(message, threading.Event) for message in list(output.queue)):
+        pass
+    output.discard()
+    waiter.join()
+    backend.release.set()
+    output.close()
+    assert results == [True]
+    assert messages(backend) == [(0x90, 60, 64)]
+
+
+def test_backend_is_abstract():
+    with pytest.raises(TypeError):
+        MIDIBackend()
+
+
+def test_controller_flushes_coalesced_value_and_resets():
+    backend = RecordingBackend()
+    controller = ContinuousController(MIDISender(backend=backend),
+                                      [ControllerMapping('rot.y', 1, 0.0, 127.0, deadband=1, max_rate=10.0)])
+
+    def frame(value):
+        return SensorData(Vec3(0, value, 0), Vec3(0, 0, 0), Vec3(0, 0, 0), 0.0)
+
+    controller.update(frame(10), now=0.0)
+    controller.update(frame(20), now=0.05)  # rate limited, coalesced
+    controller.flush(now=0.08)
+    assert messages(backend) == [(0xB0, 1, 10)]
+    controller.flush(now=0.1)
+    assert messages(backend) == [(0xB0, 1, 10), (0xB0, 1, 20)]
+    controller.reset()
+    controller.update(frame(20), now=0.11)  # same value, but sent again after a reset
+    assert messages(backend) == [(0xB0, 1, 10), (0xB0, 1, 20), (0xB0, 1, 20)]
+
+
+def test_first_note_event():
+    midi = MIDISender(backend=RecordingBackend())
+
+    async def run():
+        waiter = asyncio.ensure_future(midi.first_note.wait())
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        midi.start_notes([60, 64])
+        await asyncio.wait_for(waiter, 1.0)
+
+    asyncio.run(run())
+    assert midi.first_note_time is not None
@@ -0,0 +1,55 @@
+import sys
+import types
+import pytest
+from midi_backend import BACKENDS, PygameBackend, create_backend
+
+
+class StubPort:
+    def __init__(self, device, latency=0):
+        self.device = device
+        self.short = []
+        self.batches = []
+        self.closed = False
+
+    def WriteShort(self, status, data1=0, data2=0):
+        self.short.append((status, data1, data2))
+
+    def Write(self, batch):
+        self.batches.append(batch)
+
+    def Close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def stub_pygame(monkeypatch):
+    pygame = types.ModuleType('pygame')
+    midi = types.ModuleType('pygame.midi')
+    midi.init = midi.quit = lambda: None
+    midi.get_default_output_id = lambda: 0
+    pypm = types.ModuleType('pygame.pypm')
+    pypm.Output = StubPort
+    pygame.midi = midi
+    pygame.pypm = pypm
+    monkeypatch.setitem(sys.modules, 'pygame', pygame)
+    monkeypatch.setitem(sys.modules, 'pygame.midi', midi)
+    monkeypatch.setitem(sys.modules, 'pygame.pypm', pypm)
+
+
+@pytest.mark.parametrize('name', [name for name, backend in BACKENDS.items() if backend is not PygameBackend])
+def test_every_backend_can_be_created(stub_pygame, name):
+    backend = create_backend(name, 0)
+    backend.write_short(0x90, 60, 64)
+    backend.write([[[0x80, 60, 0], 0]])
+    backend.close()
+
+
+def test_direct_backend_writes_to_the_port(stub_pygame):
+    backend = create_backend('direct')
+    port = backend.port
+    backend.write_short(0x90, 60, 64)
+    backend.write([[[0x80, 60, 0], 0]])
+    backend.close()
+    assert port.short == [(0x90, 60, 64)]
+    assert port.batches == [[[[0x80, 60, 0], 0]]]
+    assert port.closed
@@ -0,0 +1,61 @@
+import asyncio
+import struct
+import numpy as np
+from dispatch import Priority
+from offline import DIMENSIONS, EVENT_TYPES, analyze_session
+from processing import Processor
+from receiver import Receiver
+from recorder import SessionRecorder, read_session, synthetic_session
+
+
+def online_events(path):
+    """ distinct (index, type, dimension, time, value) of the session fed through Receiver and Processor """
+    receiver = Receiver()
+    processor = Processor()
+    found = set()
+
+    async def collect(events):
+        for event in events:
+            found.add((event.index, EVENT_TYPES.index(event.type), DIMENSIONS.index(event.dimension),
+                       event.position, event.value))
+
+    async def run():
+        await processor.add_receiver(receiver)
+        await processor.add_callback(collect, Priority.CRITICAL)
+        # with the recorded receive times, ReplayReceiver would move them to the replay start
+        for t, data in read_session(path):
+            await receiver.handle_data(None, data, t)
+
+    asyncio.run(run())
+    return found
+
+
+def table_events(table):
+    return {(int(row['index']), int(row['type']), int(row['dimension']), float(row['time']), float(row['value']))
+            for row in table}
+
+
+def test_synthetic_session_matches_online_detector(tmp_path):
+    path = tmp_path / "session.msbs"
+    rng = np.random.default_rng(5)
+    with SessionRecorder(path) as recorder:
+        for t, data in synthetic_session(3000):
+            # BLE delivers with a varying delay
+            recorder.write(t + rng.uniform(0, 0.004), data)
+    table = analyze_session(path)
+    assert len(table) > 100
+    assert table_events(table) == online_events(path)
+
+
+def test_device_clocked_session_uses_the_online_time_base(tmp_path):
+    path = tmp_path / "session.msbs"
+    rng = np.random.default_rng(6)
+    with SessionRecorder(path) as recorder:
+        for i, (t, data) in enumerate(synthetic_session(3000)):
+            device_time = (4000000000 + i * 10000) % (1 << 32)  # wraps during the session
+            # samples arrive in bursts of three connection intervals
+            recorder.write(100.0 + t + 0.03 - (i % 3) * 0.01 + rng.uniform(0, 0.002),
+                           data + struct.pack('<II', i, device_time))
+    table = analyze_session(path)
+    assert len(table) > 100
+    assert table_events(table) == online_events(path)
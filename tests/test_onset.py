@@ -0,0 +1,81 @@
+import asyncio
+import numpy as np
+from data import SensorData, Vec3
+from dispatch import Priority
+from onset import OnsetDetector, OnsetPhase
+from processing import Dimension, EventType, Processor, SensorHistory
+
+
+def run(detector, samples, signal='gyro'):
+    history = SensorHistory(64)
+    found = []
+
+    async def collect(phase, onset):
+        if onset.dimension == Dimension.X and onset.sign > 0:
+            found.append((phase, onset.velocity))
+
+    async def feed():
+        await detector.add_callback(collect, Priority.CRITICAL)
+        for i, value in enumerate(samples):
+            history.append(SensorData(Vec3(0, 0, 0), Vec3(0, 0, 0), Vec3(value, 0, 0), 1.0 + 0.01 * i))
+            await detector.update(history)
+
+    asyncio.run(feed())
+    return found
+
+
+def test_first_sample_only_seeds_the_state():
+    # a signal that starts high has no slope yet, the first swing starts on the next rise
+    found = run(OnsetDetector(signal='gyro', confirm=1), [500, 500, 0, 0, 200, 400, 0])
+    assert [phase for phase, _ in found] == [OnsetPhase.START, OnsetPhase.PEAK, OnsetPhase.RELEASE]
+    assert found[0][1] > 1
+
+
+def test_small_single_rise_is_not_a_swing():
+    assert run(OnsetDetector(signal='gyro'), [0, 0, 25, 0, 0]) == []
+    found = run(OnsetDetector(signal='gyro'), [0, 0, 25, 45, 0, 0])
+    assert [phase for phase, _ in found] == [OnsetPhase.START, OnsetPhase.PEAK, OnsetPhase.RELEASE]
+    # a steep first rise arms at once
+    found = run(OnsetDetector(signal='gyro'), [0, 0, 80, 0, 0])
+    assert [phase for phase, _ in found] == [OnsetPhase.START, OnsetPhase.PEAK, OnsetPhase.RELEASE]
+
+
+def test_start_precedes_threshold_event():
+    # raised cosine swings of different amplitude (dps) and duration (s) at 100 Hz, with rests between
+    gyro = [0.0] * 10
+    for amplitude, duration in [(150, 0.6), (300, 0.4), (600, 0.3), (900, 0.25), (300, 0.8), (600, 0.5)]:
+        length = int(duration * 100)
+        gyro += list(amplitude * np.sin(np.pi * np.arange(length) / length) ** 2) + [0.0] * 50
+    processor = Processor()
+    detector = OnsetDetector()
+    processor.add_onset_detector(detector)
+    log = []
+    current = [0, False]  # sample, inside a swing
+
+    async def collect_events(events):
+        for event in events:
+            if event.type == EventType.THRESHOLD_POS and event.dimension == Dimension.X and not current[1]:
+                current[1] = True
+                log.append(('threshold', current[0]))
+
+    async def collect_onsets(phase, onset):
+        if phase == OnsetPhase.START and onset.dimension == Dimension.X and onset.sign > 0:
+            log.append(('start', current[0]))
+
+    async def feed():
+        await processor.add_callback(collect_events, Priority.CRITICAL)
+        await detector.add_callback(collect_onsets, Priority.CRITICAL)
+        for sample, value in enumerate(gyro):
+            current[0] = sample
+            if value == 0.0:
+                current[1] = False
+            await processor.new_data(SensorData(Vec3(0, 0, 0), Vec3(0, 0, 0), Vec3(value, 0, 0), 0.01 * sample))
+
+    asyncio.run(feed())
+    starts = [index for kind, index in log if kind == 'start']
+    thresholds = [index for kind, index in log if kind == 'threshold']
+    assert len(starts) == len(thresholds) == 6
+    # every swing starts first, the slow ones a whole sample earlier
+    assert [kind for kind, _ in log] == ['start', 'threshold'] * 6
+    assert all(start <= threshold for start, threshold in zip(starts, thresholds))
+    assert any(start < threshold for start, threshold in zip(starts, thresholds))
@@ -0,0 +1,44 @@
+import math
+import numpy as np
+from data import Vec3
+from orientation import OrientationEngine
+
+
+def test_static_tilt_converges_without_magnetometer():
+    engine = OrientationEngine(beta=0.5)
+    tilt = math.radians(30)
+    acc = Vec3(0.0, 9.81 * math.sin(tilt), 9.81 * math.cos(tilt))
+    for i in range(2000):
+        engine.update(Vec3(0, 0, 0), acc, Vec3(0, 0, 0), i * 0.01)
+    angles = engine.euler()
+    assert abs(angles.x - 30.0) < 0.5
+    assert abs(angles.y) < 0.5
+
+
+def test_missing_magnetometer_is_imu_only():
+    with_zero, without = OrientationEngine(beta=0.5), OrientationEngine(beta=0.5)
+    acc = Vec3(1.0, 2.0, 9.0)
+    for i in range(100):
+        with_zero.update(Vec3(1, 2, 3), acc, Vec3(0, 0, 0), i * 0.01)
+        without.update(Vec3(1, 2, 3), acc, None, i * 0.01)
+    assert with_zero.q == without.q
+    assert abs(with_zero.euler().x) > 1.0
+
+
+def test_batch_matches_update():
+    rng = np.random.default_rng(3)
+    n = 300
+    gyro = rng.normal(0.0, 50.0, (n, 3))
+    acc = rng.normal(0.0, 2.0, (n, 3)) + [0.0, 0.0, 9.81]
+    mag = rng.normal(0.0, 5.0, (n, 3)) + [20.0, 0.0, -40.0]
+    mag[100:150] = 0.0  # magnetometer dropouts use the IMU update
+    t = np.arange(n) * 0.01
+    t[200] = t[199]  # invalid timestamp falls back to sample_period
+
+    streamed = OrientationEngine()
+    expected = np.array([streamed.update(Vec3(*g), Vec3(*a), Vec3(*m), ti)
+                         for g, a, m, ti in zip(gyro, acc, mag, t)])
+    batched = OrientationEngine()
+    quaternions = batched.batch(gyro, acc, mag, t)
+    np.testing.assert_allclose(quaternions, expected, rtol=1e-9, atol=1e-12)
+    assert batched.last_time == streamed.last_time
@@ -0,0 +1,66 @@
+import asyncio
+import numpy as np
+from data import SensorData, Vec3
+from dispatch import Priority
+from processing import Derivation3, History3, Processor, Signal3
+
+
+def test_signal_grows_beyond_capacity():
+    signal = Signal3(capacity=4)
+    for i in range(10):
+        signal.append_values(i, 2 * i, 3 * i, 0.1 * i)
+    assert len(signal) == 10
+    assert signal.count == 10
+    np.testing.assert_array_equal(signal.x, np.arange(10))
+    np.testing.assert_array_equal(signal.z, 3 * np.arange(10))
+
+
+def test_history_wraparound_keeps_newest_samples_contiguous():
+    history = History3(5)
+    for i in range(13):
+        history.append(Vec3(i, -i, 0.5 * i), float(i))
+        newest = np.arange(max(0, i - 4), i + 1)
+        assert len(history) == len(newest)
+        np.testing.assert_array_equal(history.x, newest)
+        np.testing.assert_array_equal(history.y, -newest)
+        np.testing.assert_array_equal(history.t, newest.astype(float))
+        # the views are zero-copy slices of the mirrored buffer
+        assert history.x.base is history._buffer
+    assert history.count == 13
+
+
+def test_derivation_drops_non_increasing_timestamps():
+    derivation = Derivation3(10)
+    derivation.append(Vec3(0, 0, 0), 0.0)
+    derivation.append(Vec3(1, 2, 3), 0.5)
+    derivation.append(Vec3(5, 5, 5), 0.5)  # same timestamp, dropped
+    derivation.append(Vec3(2, 4, 6), 1.0)
+    np.testing.assert_allclose(derivation.x, [2.0, 2.0])
+    np.testing.assert_allclose(derivation.z, [6.0, 6.0])
+    np.testing.assert_allclose(derivation.t, [0.5, 1.0])
+
+
+def test_coalesced_consumers_get_copies_of_reused_events():
+    processor = Processor()
+    critical = []
+    visual = []
+
+    async def keep_critical(events):
+        critical.append(events)
+
+    async def keep_visual(events):
+        visual.append(events)
+
+    async def run():
+        await processor.add_callback(keep_critical, Priority.CRITICAL)
+        await processor.add_callback(keep_visual, Priority.VISUAL)
+        for i, value in enumerate([0, 0, 100, 300, 100, 0]):
+            await processor.new_data(SensorData(Vec3(0, 0, 0), Vec3(0, 0, 0), Vec3(value, 0, 0), 0.01 * i))
+            await asyncio.sleep(0)
+
+    asyncio.run(run())
+    assert critical and visual
+    # the critical consumers see the reused list, the coalesced ones a snapshot per dispatch
+    assert all(events is critical[0] for events in critical)
+    assert len({id(events) for events in visual}) == len(visual)
+    assert len({id(event) for events in visual for event in events}) == sum(len(events) for events in visual)
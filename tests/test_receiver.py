@@ -0,0 +1,91 @@
+import asyncio
+import struct
+import pytest
+from ble_sim import SimulatedBle, SimulatedPeripheral
+from dispatch import Priority
+from main import connect_bt
+from receiver import CHARACTERISTIC_UUID, SERVICE_UUID, DeviceCache, Receiver
+
+
+def test_undecodable_packets_are_skipped():
+    receiver = Receiver()
+    received = []
+
+    async def run():
+        async def callback(data):
+            received.append(data.gyro.x)
+        await receiver.add_callback(callback, Priority.CRITICAL)
+        await receiver.handle_data(None, b'\x00' * 7, 0.0)
+        await receiver.handle_data(None, struct.pack('<9f', *range(9)), 0.01)
+
+    asyncio.run(run())
+    assert received == [6.0]
+    assert receiver.stats.packets == 1
+
+
+
+def test_cache_only_holds_connected_devices(tmp_path):
+    ble = SimulatedBle()
+    ble.add_peripheral(SimulatedPeripheral("00:00:00:00:00:01", SERVICE_UUID))
+    cache = DeviceCache(str(tmp_path / "devices.json"))
+
+    def refusing_client(device, disconnected_callback=None, timeout=10.0):
+        client = ble.client(device, disconnected_callback, timeout)
+
+        async def connect():
+            raise ConnectionError("refused")
+        client.connect = connect
+        return client
+
+    async def run(client_class):
+        receiver = Receiver(client_class=client_class, scanner=ble)
+        try:
+            await connect_bt(receiver, cache, timeout=1.0)
+        finally:
+            await receiver.disconnect()
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(run(refusing_client))
+    assert cache.addresses == []
+    asyncio.run(run(ble.client))
+    assert cache.addresses == ["00:00:00:00:00:01"]
+
+
+def test_reconnect_disconnects_when_notifications_fail():
+    ble = SimulatedBle()
+    peripheral = ble.add_peripheral(SimulatedPeripheral("00:00:00:00:00:01", SERVICE_UUID))
+    failures = []
+
+    def flaky_client(device, disconnected_callback=None, timeout=10.0):
+        client = ble.client(device, disconnected_callback, timeout)
+        start_notify = client.start_notify
+
+        async def flaky_start_notify(characteristic_uuid, callback):
+            if failures:
+                raise failures.pop()
+            await start_notify(characteristic_uuid, callback)
+        client.start_notify = flaky_start_notify
+        return client
+
+    async def run():
+        receiver = Receiver(client_class=flaky_client, scanner=ble)
+        await receiver.connect(await receiver.find_device(SERVICE_UUID, timeout=1.0))
+        await receiver.start_notifications(SERVICE_UUID, CHARACTERISTIC_UUID)
+        receiver.keep_connected()
+        # the first reconnect attempt connects, but can't subscribe
+        failures.append(ConnectionError("notify refused"))
+        peripheral.drop()
+        packets = receiver.stats.packets
+        for _ in range(200):
+            await asyncio.sleep(0.01)
+            if receiver.reconnect_task is None and receiver.stats.packets > packets:
+                break
+        try:
+            assert not failures
+            assert receiver.connected
+            assert receiver.reconnect_task is None
+            assert peripheral.client is receiver.client
+        finally:
+            await receiver.disconnect()
+
+    asyncio.run(run())
@@ -0,0 +1,38 @@
+from data import SensorData, Vec3
+from processing import Dimension, Event3, EventType
+from shm_ring import SharedFrameRing
+
+
+def test_reader_gets_every_frame_and_each_event_list_once():
+    writer = SharedFrameRing(capacity=32, max_events=4)
+    reader = SharedFrameRing(writer.name)
+    try:
+        for i in range(10):
+            writer.write_frame(SensorData(Vec3(i, 0, 0), Vec3(0, 0, 0), Vec3(0, 0, -i), 0.01 * i))
+        frames = reader.read_frames()
+        assert frames['rot'][:, 0].tolist() == list(range(10))
+        assert len(reader.read_frames()) == 0
+
+        writer.write_events([Event3(0.5, 0, 80.0, EventType.THRESHOLD_POS, Dimension.Y)])
+        events = reader.read_events()
+        assert events['value'].tolist() == [80.0]
+        assert reader.read_events() is None
+        writer.write_events([])
+        assert len(reader.read_events()) == 0
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_reader_skips_overwritten_frames():
+    writer = SharedFrameRing(capacity=32)
+    reader = SharedFrameRing(writer.name)
+    try:
+        for i in range(100):
+            writer.write_frame(SensorData(Vec3(i, 0, 0), Vec3(0, 0, 0), Vec3(0, 0, 0), 0.0))
+        frames = reader.read_frames()
+        assert frames['rot'][-1, 0] == 99
+        assert reader.lost + len(frames) == 100
+    finally:
+        reader.close()
+        writer.close()
@@ -0,0 +1,21 @@
+import numpy as np
+from tracing import LatencyHistogram
+
+
+def test_histogram_percentiles_within_relative_error():
+    rng = np.random.default_rng(1)
+    values = rng.lognormal(mean=10, sigma=1.0, size=20000).astype(np.int64)
+    histogram = LatencyHistogram(precision=5)
+    histogram.record(values)
+    assert histogram.total == values.size
+    assert histogram.max == values.max()
+    for q in (50, 90, 99):
+        exact = np.percentile(values, q)
+        assert abs(histogram.percentile(q) - exact) <= exact * 2 ** -5 + 1
+
+
+def test_small_values_are_exact():
+    histogram = LatencyHistogram(precision=5)
+    histogram.record([3, 3, 7])
+    assert histogram.percentile(50) == 3
+    assert histogram.percentile(100) == 7
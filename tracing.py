@@ -0,0 +1,171 @@
+import csv
+import json
+import time
+from enum import IntEnum
+import numpy as np
+
+
+class Stage(IntEnum):
+    RECEIVE = 0  # Receiver.handle_data, whole notification incl. all inline callbacks
+    DECODE = 1  # SensorDataDecoder.decode_data
+    HISTORY = 2  # SensorHistory.append in Processor
+    ANALYZE = 3  # EventProcessor3.analyze
+    PLAYER = 4  # Player.event_triggered
+    MIDI = 5  # MIDISender output writes
+
+
+class LatencyHistogram:
+    """
+    HDR-style log-linear histogram of nanosecond durations.
+
+    Values below 2**precision get one bucket each, above that every power of two
+    is split into 2**precision buckets, i.e. the relative error is below 2**-precision.
+    """
+
+    def __init__(self, precision=5, max_exponent=40):
+        self.precision = precision
+        self.sub_buckets = 1 << precision
+        self.counts = np.zeros((max_exponent - precision + 1) * self.sub_buckets, dtype=np.int64)
+        self.total = 0
+        self.max = 0
+
+    def bucket_index(self, values):
+        values = np.maximum(np.asarray(values, dtype=np.int64), 0)
+        exponent = np.frexp(values.astype(np.float64))[1]  # == bit length
+        shift = np.maximum(exponent - 1 - self.precision, 0)
+        index = shift * self.sub_buckets + (values >> shift)
+        return np.minimum(index, len(self.counts) - 1)
+
+    def bucket_bounds(self, index):
+        """ lower (inclusive) and upper (exclusive) value of the buckets """
+        index = np.asarray(index, dtype=np.int64)
+        shift = np.maximum(index // self.sub_buckets - 1, 0)
+        lower = (index - shift * self.sub_buckets) << shift
+        return lower, lower + (np.int64(1) << shift)
+
+    def record(self, values):
+        values = np.asarray(values, dtype=np.int64)
+        if values.size == 0:
+            return
+        self.counts += np.bincount(self.bucket_index(values), minlength=len(self.counts))
+        self.total += int(values.size)
+        self.max = max(self.max, int(values.max()))
+
+    def percentile(self, q):
+        """ value below which q percent of the recorded durations are (bucket midpoint) """
+        if self.total == 0:
+            return 0.0
+        rank = max(1, int(np.ceil(q / 100.0 * self.total)))
+        index = int(np.searchsorted(np.cumsum(self.counts), rank))
+        lower, upper = self.bucket_bounds(index)
+        return min(float(lower + upper - 1) / 2.0, float(self.max))
+
+    def summary(self):
+        return {'count': self.total,
+                'p50_us': self.percentile(50) / 1000.0,
+                'p90_us': self.percentile(90) / 1000.0,
+                'p99_us': self.percentile(99) / 1000.0,
+                'max_us': self.max / 1000.0}
+
+    def reset(self):
+        self.counts[:] = 0
+        self.total = 0
+        self.max = 0
+
+
+class Tracer:
+    """
+    Low-overhead stage tracer for the hot path.
+
+    record() only writes the stage and two perf_counter_ns timestamps into a
+    preallocated ring. rollup() moves the ring content into one LatencyHistogram
+    per stage, it runs on demand (export, overlay) and never on the hot path.
+    """
+
+    def __init__(self, capacity=1 << 16):
+        self.enabled = True
+        self.capacity = capacity
+        self.stages = [0] * capacity
+        self.starts = [0] * capacity
+        self.ends = [0] * capacity
+        self.written = 0
+        self.rolled = 0
+        self.overwritten = 0
+        self.histograms = {stage: LatencyHistogram() for stage in Stage}
+
+    def record(self, stage: Stage, start_ns: int):
+        """ close a stage span that started at start_ns (time.perf_counter_ns) """
+        if not self.enabled:
+            return
+        position = self.written % self.capacity
+        self.stages[position] = stage
+        self.starts[position] = start_ns
+        self.ends[position] = time.perf_counter_ns()
+        self.written += 1
+
+    def rollup(self):
+        """ fold all spans recorded since the last rollup into the histograms """
+        written = self.written
+        pending = written - self.rolled
+        if pending <= 0:
+            return
+        if pending > self.capacity:
+            self.overwritten += pending - self.capacity
+            pending = self.capacity
+        positions = (np.arange(written - pending, written) % self.capacity)
+        stages = np.array(self.stages)[positions]
+        durations = np.array(self.ends)[positions] - np.array(self.starts)[positions]
+        for stage, histogram in self.histograms.items():
+            histogram.record(durations[stages == stage])
+        self.rolled = written
+
+    def summary(self):
+        self.rollup()
+        return {stage.name.lower(): histogram.summary() for stage, histogram in self.histograms.items()
+                if histogram.total > 0}
+
+    def reset(self):
+        self.rolled = self.written
+        self.overwritten = 0
+        for histogram in self.histograms.values():
+            histogram.reset()
+
+    def export_json(self, path):
+        self.rollup()
+        result = {'overwritten': self.overwritten, 'stages': {}}
+        for stage, histogram in self.histograms.items():
+            buckets = np.nonzero(histogram.counts)[0]
+            lower, upper = histogram.bucket_bounds(buckets)
+            result['stages'][stage.name.lower()] = {
+                **histogram.summary(),
+                'buckets': [[int(lo), int(up), int(count)] for lo, up, count
+                            in zip(lower, upper, histogram.counts[buckets])]}
+        with open(path, 'w') as file:
+            json.dump(result, file, indent=2)
+
+    def export_csv(self, path):
+        self.rollup()
+        with open(path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['stage', 'lower_ns', 'upper_ns', 'count'])
+            for stage, histogram in self.histograms.items():
+                buckets = np.nonzero(histogram.counts)[0]
+                lower, upper = histogram.bucket_bounds(buckets)
+                for lo, up, count in zip(lower, upper, histogram.counts[buckets]):
+                    writer.writerow([stage.name.lower(), int(lo), int(up), int(count)])
+
+    def export(self, path):
+        if str(path).endswith('.csv'):
+            self.export_csv(path)
+        else:
+            self.export_json(path)
+
+    def overlay_text(self):
+        lines = [f"{'stage':8s} {'p50':>8s} {'p99':>8s} {'max':>8s}  [us]"]
+        for name, stats in self.summary().items():
+            lines.append(f"{name:8s} {stats['p50_us']:8.1f} {stats['p99_us']:8.1f} {stats['max_us']:8.1f}")
+        return "\n".join(lines)
+
+
+# process wide tracer used by the pipeline modules
+tracer = Tracer()